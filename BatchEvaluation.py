@@ -0,0 +1,100 @@
+import numpy as np
+import ChessBoard
+from Evaluation import PHASE_WEIGHTS, TOTAL_PHASE
+
+# Evaluates many positions at once with NumPy, for bulk analysis and evaluation tuning
+# Positions are an int8 array of shape (N, 64) holding ChessBoard piece codes in ChessBoard square order,
+# with a bool array of shape (N,) saying whether White is to move.
+# The scores are the same as Board.computeScore gives for each position.
+#    squares, whitesMove = encodeFens(fens)
+#    scores = evaluate(squares, whitesMove)
+
+# Middlegame and endgame score of every piece code on every square, in White's favor
+MG_TABLE = np.array(ChessBoard.MG_SCORES, dtype = np.int32)
+EG_TABLE = np.array(ChessBoard.EG_SCORES, dtype = np.int32)
+# Phase weight of every piece code, codes that are not a piece weigh nothing
+PHASE_TABLE = np.zeros(len(MG_TABLE), dtype = np.int32)
+for piece in range(len(MG_TABLE)):
+    if piece & ChessBoard.TYPE_MASK < len(PHASE_WEIGHTS):
+        PHASE_TABLE[piece] = PHASE_WEIGHTS[piece & ChessBoard.TYPE_MASK]
+_SQUARE_INDEX = np.arange(64)
+
+def encodeBoards(boards):
+    boards = list(boards)
+    squares = np.empty((len(boards), 64), dtype = np.int8)
+    whitesMove = np.empty(len(boards), dtype = bool)
+    for i, board in enumerate(boards):
+        squares[i] = board.squares
+        whitesMove[i] = board.whitesMove
+    return squares, whitesMove
+
+def encodeFens(fens):
+    board = ChessBoard.Board.__new__(ChessBoard.Board) # Only the position is needed, not the search tables
+    squares = []
+    whitesMove = []
+    for fen in fens:
+        board.loadFen(fen)
+        squares.append(board.squares)
+        whitesMove.append(board.whitesMove)
+    return np.array(squares, dtype = np.int8).reshape(-1, 64), np.array(whitesMove, dtype = bool)
+
+# Middlegame score, endgame score (both in White's favor) and game phase of every position
+def evaluationTerms(squares):
+    pieces = squares.astype(np.intp)
+    mgScores = MG_TABLE[pieces, _SQUARE_INDEX].sum(axis = 1, dtype = np.int64)
+    egScores = EG_TABLE[pieces, _SQUARE_INDEX].sum(axis = 1, dtype = np.int64)
+    phases = PHASE_TABLE[pieces].sum(axis = 1, dtype = np.int64)
+    return mgScores, egScores, phases
+
+# Score of every position for its side to move, int64 array of shape (N,)
+def evaluate(squares, whitesMove):
+    mgScores, egScores, phases = evaluationTerms(squares)
+    phases = np.minimum(phases, TOTAL_PHASE) # Promotions can take it above the starting value
+    # Floor division like computeScore's // so the results match exactly
+    scores = (mgScores * phases + egScores * (TOTAL_PHASE - phases)) // TOTAL_PHASE
+    return np.where(whitesMove, scores, -scores)
+
+# Collects the leaf positions a search evaluates, to score them in one batch afterwards
+#    recorder = LeafRecorder(board)
+#    board.findBestMove()
+#    squares, whitesMove = recorder.positions()
+#    recorder.detach()
+# It is the board's leafCallback, called at the search's leaves: the quiescence search's stand pat positions,
+# or the positions at depth 0 without quiescence. The evaluations null move and futility pruning make to decide
+# what to search are not leaves and are not recorded. The search still uses the scalar scores.
+# Only a sequential search can be recorded, parallel search workers evaluate their leaves in other processes
+class LeafRecorder():
+
+    def __init__(self, board, capacity = 1 << 16):
+        if board.searchWorkers > 1:
+            raise ValueError("Leaves of a parallel search cannot be recorded, set searchWorkers to 1")
+        if board.leafCallback is not None:
+            raise ValueError("The board already has a leafCallback")
+        self.board = board
+        self.squares = np.empty((capacity, 64), dtype = np.int8)
+        self.whitesMove = np.empty(capacity, dtype = bool)
+        self.count = 0
+        board.leafCallback = self.record
+
+    def record(self):
+        board = self.board
+        if self.count == len(self.squares): # Double the buffers when they are full
+            self.squares = np.concatenate((self.squares, np.empty_like(self.squares)))
+            self.whitesMove = np.concatenate((self.whitesMove, np.empty_like(self.whitesMove)))
+        self.squares[self.count] = board.squares
+        self.whitesMove[self.count] = board.whitesMove
+        self.count += 1
+
+    # (squares, whitesMove) of the leaves recorded so far
+    def positions(self):
+        return self.squares[:self.count], self.whitesMove[:self.count]
+
+    # Scores of the recorded leaves, equal to the ones the search used
+    def evaluate(self):
+        return evaluate(*self.positions())
+
+    def clear(self):
+        self.count = 0
+
+    def detach(self):
+        self.board.leafCallback = None
@@ -1,395 +1,1441 @@
-import sys 
+import random
 import time
-sys.setrecursionlimit(5000) 
-TIMEOUT = 30
-start = None
-end = None
+from TranspositionTable import TranspositionTable, EXACT, LOWER, UPPER
+from SearchStats import SearchStatistics
+from Evaluation import MG_VALUES, EG_VALUES, MG_TABLES, EG_TABLES, PHASE_WEIGHTS, TOTAL_PHASE
+TIMEOUT = 30 # Seconds a search may take when the board has no timeManager
+NODE_CHECK_INTERVAL = 1024 # The search reads the clock once every this many nodes (a power of two)
+
+# Pieces are coded as small integers and the board is a flat list of 64 squares (index = row * 8 + col)
+#    Bit 3 holds the color (0 for White, 8 for Black), the low 3 bits hold the piece type
+#    0 represents no piece
+EMPTY = 0
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+WHITE, BLACK = 0, 8
+COLOR_MASK = 8
+TYPE_MASK = 7
+
+PIECE_NAMES = {EMPTY: '--',
+               WHITE | PAWN: 'wP', WHITE | KNIGHT: 'wN', WHITE | BISHOP: 'wB',
+               WHITE | ROOK: 'wR', WHITE | QUEEN: 'wQ', WHITE | KING: 'wK',
+               BLACK | PAWN: 'bP', BLACK | KNIGHT: 'bN', BLACK | BISHOP: 'bB',
+               BLACK | ROOK: 'bR', BLACK | QUEEN: 'bQ', BLACK | KING: 'bK'}
+PIECE_CODES = {name: code for code, name in PIECE_NAMES.items()}
+PIECE_LETTERS = ' PNBRQK'
+PROMOTION_PIECES = (QUEEN, ROOK, BISHOP, KNIGHT)
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# Moves are packed into one int so generating and searching them does not allocate objects
+#    bits 0-5 end square, bits 6-11 start square, bits 12-14 promotion piece type, then the flags
+# The low 15 bits are the moveID, enough to tell the moves of one position apart,
+# and the low 12 bits (startSq * 64 + endSq) index the history tables
+MOVE_ID_MASK = 0x7FFF
+PROMOTION_MASK = 7 << 12
+CASTLE_FLAG = 1 << 15
+ENPASSANT_FLAG = 1 << 16
+
+# Castling rights are one int with a bit per right
+WHITE_KINGSIDE, BLACK_KINGSIDE, WHITE_QUEENSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+# The rights that survive a move from or to each square, a king or rook leaving home or a rook captured there
+_castlingKept = [15] * 64
+_castlingKept[60] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+_castlingKept[4] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+_castlingKept[63] = 15 & ~WHITE_KINGSIDE
+_castlingKept[56] = 15 & ~WHITE_QUEENSIDE
+_castlingKept[7] = 15 & ~BLACK_KINGSIDE
+_castlingKept[0] = 15 & ~BLACK_QUEENSIDE
+CASTLING_KEPT = tuple(_castlingKept)
+
+# Score for being checkmated now, mates further away score closer to 0 so the nearest mate is preferred
+MATE_SCORE = 100000
+MATE_BOUND = MATE_SCORE - 1000 # Scores beyond this are mates
+
+# Mate scores count plies from the root, the transposition table stores them counted from the node instead
+# so they stay right when the position comes up again at another distance from the root
+def _scoreToTable(score, ply):
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+def _scoreFromTable(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+# Move ordering scores, every capture sorts above the killers and every killer above the quiet moves
+MAX_PLY = 64
+ORDER_TT_MOVE = 1 << 30
+ORDER_CAPTURE = 1 << 28
+ORDER_KILLER = 1 << 27
+HISTORY_LIMIT = 1 << 26 # History scores are halved once one reaches this, so they stay below the killers
+
+# Selective search, each part can be switched off on the board (useNullMove, useLateMoveReductions, useFutilityPruning)
+NULL_MOVE = 0 # Undo record move of a passed turn, a8a8 is never a real move
+NULL_MOVE_MIN_DEPTH = 3 # Null move pruning is tried from this depth...
+NULL_MOVE_REDUCTION = 2 # ...searching the passed turn this much shallower, one more above NULL_MOVE_DEEP
+NULL_MOVE_DEEP = 6
+LMR_MIN_DEPTH = 3 # Late quiet moves are searched shallower from this depth...
+LMR_MIN_MOVES = 3 # ...after this many moves, by one ply and by two after LMR_LATE_MOVES
+LMR_LATE_MOVES = 8
+FUTILITY_MARGINS = (0, 150, 350) # By depth, quiet moves cannot raise a score this far below alpha
+SEARCH_CACHE_MIN_DEPTH = 4 # Shallower results are not worth keeping in the search cache
+
+# Quiescence search (useQuiescence on the board)
+SEE_VALUES = MG_VALUES[:KING] + (MATE_SCORE,) # Piece values for static exchange evaluation, by piece type
+DELTA_MARGIN = 200 # A capture is skipped when even this much on top of the captured piece cannot reach alpha
+
+# Order of captures and promotions: most valuable victim first, then least valuable attacker,
+# promotions by the piece promoted to
+def _captureOrder(move, squares):
+    victim = PAWN if move & ENPASSANT_FLAG else squares[move & 63] & TYPE_MASK
+    return victim * 8 - (squares[move >> 6 & 63] & TYPE_MASK) + (move >> 12 & 7) * 64
+
+# Whether a packed move captures or promotes, asked before it is made
+def _isTactical(move, squares):
+    return squares[move & 63] != EMPTY or move & (PROMOTION_MASK | ENPASSANT_FLAG) != 0
+
+KNIGHT_OFFSETS = ((-2, -1), (-1, -2), (1, -2), (2, -1), (2, 1), (1, 2), (-1, 2), (-2, 1))
+KING_OFFSETS = ((-1, 0), (-1, -1), (0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1))
+ROOK_DIRECTIONS = ((-1, 0), (0, 1), (1, 0), (0, -1)) # up, right, down, left
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1)) # top left, top right, bottom left, bottom right
+
+# For every square, the squares a leaper (knight, king, pawn capture) can reach from it
+def _leaperTargets(offsets):
+    targets = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        targets.append(tuple((row + dr) * 8 + col + dc for dr, dc in offsets
+                             if 0 <= row + dr <= 7 and 0 <= col + dc <= 7))
+    return tuple(targets)
+
+# For every square, the rays a slider can travel along from it, nearest square first
+def _slidingRays(directions):
+    rays = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        squareRays = []
+        for dr, dc in directions:
+            ray = []
+            endRow, endCol = row + dr, col + dc
+            while 0 <= endRow <= 7 and 0 <= endCol <= 7:
+                ray.append(endRow * 8 + endCol)
+                endRow += dr
+                endCol += dc
+            if ray:
+                squareRays.append(tuple(ray))
+        rays.append(tuple(squareRays))
+    return tuple(rays)
+
+KNIGHT_TARGETS = _leaperTargets(KNIGHT_OFFSETS)
+KING_TARGETS = _leaperTargets(KING_OFFSETS)
+ROOK_RAYS = _slidingRays(ROOK_DIRECTIONS)
+BISHOP_RAYS = _slidingRays(BISHOP_DIRECTIONS)
+QUEEN_RAYS = tuple(rookRays + bishopRays for rookRays, bishopRays in zip(ROOK_RAYS, BISHOP_RAYS))
+PAWN_CAPTURES = {WHITE: _leaperTargets(((-1, -1), (-1, 1))), BLACK: _leaperTargets(((1, -1), (1, 1)))}
+PIECE_TARGETS = {KNIGHT: KNIGHT_TARGETS, KING: KING_TARGETS}
+PIECE_RAYS = {BISHOP: BISHOP_RAYS, ROOK: ROOK_RAYS, QUEEN: QUEEN_RAYS}
+
+# Evaluation of every piece code on every square in White's favor (material plus piece-square value)
+# Black's pieces use the mirrored square and count negative, so a position's score is the plain sum
+def _pieceSquareScores(values, tables):
+    scores = [[0] * 64 for piece in range(15)]
+    for pieceType in range(PAWN, KING + 1):
+        for sq in range(64):
+            scores[WHITE | pieceType][sq] = values[pieceType] + tables[pieceType][sq]
+            scores[BLACK | pieceType][sq] = -(values[pieceType] + tables[pieceType][sq ^ 56])
+    return tuple(tuple(pieceScores) for pieceScores in scores)
+
+MG_SCORES = _pieceSquareScores(MG_VALUES, MG_TABLES)
+EG_SCORES = _pieceSquareScores(EG_VALUES, EG_TABLES)
+
+# Zobrist keys, a position's hash is the XOR of the keys of everything in it
+# Fixed seed so a position hashes the same in every process and every run
+_zobristRandom = random.Random(0x5EED)
+ZOBRIST_PIECES = tuple(tuple(_zobristRandom.getrandbits(64) for sq in range(64)) for piece in range(15))
+ZOBRIST_CASTLING = tuple(_zobristRandom.getrandbits(64) for rights in range(16)) # One per value of castlingRights
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+ZOBRIST_ENPASSANT = tuple(_zobristRandom.getrandbits(64) for col in range(8)) # One per file of the en passant square
+
 class Board():
 
-    def __init__(self):  
-
-        # Chess Board representation as a 2D list
-        #    First character in the string represents the color (b for Black, w for White)
-        #    Second character is the piece (R for Rook, N for Knight)
-        #    -- represents no piece
-        self.board = [
-            ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
-            ["bP", "bP", "bP", "bP", "bP", "bP", "bP", "bP"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["wP", "wP", "wP", "wP", "wP", "wP", "wP", "wP"],
-            ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"],    
-        ]
-        self.moveFunctions = {'P': self.getPawnMoves, 'R': self.getRookMoves, 'N': self.getKnightMoves,
-                             'B': self.getBishopMoves, 'Q': self.getQueenMoves, 'K': self.getKingMoves}
-        self.whitePieces = {'P': 8, 'R': 2, 'N': 2, 'B': 2, 'Q': 1, 'K': 1}
-        self.blackPieces = {'P': 8, 'R': 2, 'N': 2, 'B': 2, 'Q': 1, 'K': 1}
-        self.whitesMove = True
-        self.movesLog = []
-        self.whiteKingLocation = (7, 4)
-        self.blackKingLocation = (0, 4)
-        self.checkMate = False
-        self.staleMate = False
-        self.currentCastlingRight = CastleRights(True, True, True, True)
-        # Update log correctly with the actual values
-        self.castleRightsLog = [CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
-                                             self.currentCastlingRight.wqs, self.currentCastlingRight.bqs )]
+    # fen describes the position to start from, the normal starting position by default
+    def __init__(self, fen = START_FEN):  
+        self.loadFen(fen)
+        self.createSearchTables()
         self.INTIAL_DEPTH = 2
+        self.MAX_DEPTH = 7
+        self.searchWorkers = 1 # Processes findBestMove searches with, see ParallelSearch
         self.currentDepth = 0
         self.globalBestMove = None
         self.bestMove = None
         self.timedOut = None
+        self.stopRequested = False # Set from another thread to end the current search early
+        self.timeManager = None # TimeManager limiting findBestMove, TIMEOUT is used without one
+        self.softDeadline = None # Limits of the running search, set by startSearchClock
+        self.deadline = None
+        self.nodeLimit = None
+        self.nodesSearched = 0 # Nodes of the running search's completed iterations
+        self.globalBestScore = None # Score of globalBestMove for the side to move
+        self.printProgress = True # Print a line for every completed depth
+        self.progressCallback = None # Called with (depth, bestMove) after every completed depth
+        self.statisticsCallback = None # Called with the SearchStatistics of every completed depth
+        self.searchStatistics = [] # SearchStatistics of each depth the last findBestMove completed
+        self.useNullMove = True
+        self.useLateMoveReductions = True
+        self.useFutilityPruning = True
+        self.useQuiescence = True
+        self.openingBook = None # OpeningBook findBestMove plays from without searching while the position is in it
+        self.tablebases = None # Tablebase.Tablebases, probed by findBestMove and negamax in their endgames
+        self.searchCache = None # SearchCache.SearchCache, search results findBestMove keeps between runs
+
+    # A board that only follows a game, without the search tables findBestMove needs (the transposition table
+    # alone is several megabytes), for holding many positions at once. It generates and makes moves as usual
+    @classmethod
+    def positionOnly(cls, fen = START_FEN):
+        board = cls.__new__(cls)
+        board.loadFen(fen)
+        board.moveFunctions = board.createMoveFunctions()
+        return board
+
+    def createMoveFunctions(self):
+        return {PAWN: self.getPawnMoves, ROOK: self.getRookMoves, KNIGHT: self.getKnightMoves,
+                BISHOP: self.getBishopMoves, QUEEN: self.getQueenMoves, KING: self.getKingMoves}
+
+    # Per process state that is not part of the position
+    def createSearchTables(self):
+        self._boardView = None
+        self.moveFunctions = self.createMoveFunctions()
+        self.transpositionTable = TranspositionTable()
+        # Two quiet moves per ply that caused a beta cutoff, as packed moves
+        self.killerMoves = [[None, None] for ply in range(MAX_PLY)]
+        # Butterfly history, how often a quiet move from one square to another caused a cutoff (index startSq * 64 + endSq)
+        self.historyTable = {WHITE: [0] * 4096, BLACK: [0] * 4096}
+        self.statistics = SearchStatistics() # Counters of the iteration being searched
+        self.profiler = None # See SearchStats.Profiler
+        self.stopSignal = None # multiprocessing.Event that also ends the search when set, see ParallelSearch
+        self.leafCallback = None # Called before a search leaf is evaluated, see BatchEvaluation.LeafRecorder
+
+    # Pickling (e.g. to send a position to a worker process) leaves out the search tables, which are large
+    # and rebuilt empty on the other side, and the callbacks, profiler and search cache, which belong to this process
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.profiler is not None:
+            for name in self.profiler.names:
+                del state[name]
+        for name in ('_boardView', 'moveFunctions', 'transpositionTable', 'killerMoves', 'historyTable',
+                     'statistics', 'profiler', 'stopSignal', 'leafCallback', 'progressCallback', 'statisticsCallback',
+                     'searchCache'):
+            del state[name]
+        state['undoStack'] = self.undoStack[:self.undoCount] # Spare records are not worth sending
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.progressCallback = None
+        self.statisticsCallback = None
+        self.searchCache = None
+        self.createSearchTables()
+
+    # Set up the position from a FEN string, forgetting any moves made so far
+    # The halfmove clock and fullmove number fields are optional
+    def loadFen(self, fen):
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("FEN needs at least 4 fields: " + fen)
+        rows = fields[0].split('/')
+        if len(rows) != 8:
+            raise ValueError("FEN piece placement needs 8 rows: " + fen)
+        squares = []
+        for rowNumber, row in enumerate(rows):
+            for char in row:
+                if char.isdigit():
+                    squares.extend([EMPTY] * int(char))
+                else:
+                    color = WHITE if char.isupper() else BLACK
+                    pieceType = PIECE_LETTERS.find(char.upper())
+                    if pieceType <= 0:
+                        raise ValueError("Unknown piece '" + char + "' in FEN: " + fen)
+                    squares.append(color | pieceType)
+            if len(squares) != (rowNumber + 1) * 8:
+                raise ValueError("FEN row does not have 8 squares: " + fen)
+        if fields[1] not in ('w', 'b') or squares.count(WHITE | KING) != 1 or squares.count(BLACK | KING) != 1:
+            raise ValueError("Invalid FEN: " + fen)
+        if not all(field.isdigit() for field in fields[4:6]):
+            raise ValueError("FEN move counters must be numbers: " + fen)
+        if fields[3] != '-' and (len(fields[3]) != 2 or fields[3][0] not in Move.filesToCols or fields[3][1] not in '36'):
+            raise ValueError("Invalid en passant square in FEN: " + fen)
+        self.squares = squares
+        self._boardView = None
+        self.whitesMove = fields[1] == 'w'
+        self.kingSquares = {WHITE: squares.index(WHITE | KING), BLACK: squares.index(BLACK | KING)}
+        self.whitePieces = {letter: squares.count(WHITE | pieceType) for pieceType, letter in enumerate(PIECE_LETTERS) if pieceType}
+        self.blackPieces = {letter: squares.count(BLACK | pieceType) for pieceType, letter in enumerate(PIECE_LETTERS) if pieceType}
+        self.castlingRights = (('K' in fields[2]) * WHITE_KINGSIDE | ('k' in fields[2]) * BLACK_KINGSIDE |
+                               ('Q' in fields[2]) * WHITE_QUEENSIDE | ('q' in fields[2]) * BLACK_QUEENSIDE)
+        # Square a pawn skipped over with a two square advance on the last move, None if there is not one
+        self.enpassantPossible = None
+        if fields[3] != '-':
+            self.enpassantPossible = Move.rankToRows[fields[3][1]] * 8 + Move.filesToCols[fields[3][0]]
+        self.halfmoveClock = int(fields[4]) if len(fields) > 4 else 0 # Plies since the last capture or pawn move
+        self.fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1 # Goes up after every Black move
+        self.movesLog = [] # Move objects made with makeMove, for the GUI
+        # One record per move made, preallocated and reused so making a move does not allocate
+        # Only the first undoCount records are in use
+        self.undoStack = [UndoRecord() for i in range(UNDO_STACK_SIZE)]
+        self.undoCount = 0
+        self.checkMate = False
+        self.staleMate = False
+        self.zobristKey = self.computeZobristKey()
+        self.mgScore, self.egScore, self.phase = self.computeEvaluation()
+
+    # The position as a FEN string, the inverse of loadFen
+    def getFen(self):
+        rows = []
+        for row in range(8):
+            text = ""
+            empty = 0
+            for piece in self.squares[row * 8:row * 8 + 8]:
+                if piece == EMPTY:
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                letter = PIECE_LETTERS[piece & TYPE_MASK]
+                text += letter if piece & COLOR_MASK == WHITE else letter.lower()
+            if empty:
+                text += str(empty)
+            rows.append(text)
+        castling = "".join(letter for right, letter in ((WHITE_KINGSIDE, 'K'), (WHITE_QUEENSIDE, 'Q'),
+                                                        (BLACK_KINGSIDE, 'k'), (BLACK_QUEENSIDE, 'q'))
+                           if self.castlingRights & right) or '-'
+        enpassant = '-'
+        if self.enpassantPossible is not None:
+            enpassant = Move.colsToFiles[self.enpassantPossible & 7] + Move.rowsToRanks[self.enpassantPossible >> 3]
+        return " ".join(("/".join(rows), 'w' if self.whitesMove else 'b', castling, enpassant,
+                         str(self.halfmoveClock), str(self.fullmoveNumber)))
+
+    # 2D list of strings ("wR", "--", ...) derived from self.squares, used by main.py for drawing
+    # Rebuilt lazily after the position changes
+    @property
+    def board(self):
+        if self._boardView is None:
+            names = [PIECE_NAMES[piece] for piece in self.squares]
+            self._boardView = [names[row * 8:row * 8 + 8] for row in range(8)]
+        return self._boardView
+
+    @property
+    def whiteKingLocation(self):
+        return divmod(self.kingSquares[WHITE], 8)
+
+    @property
+    def blackKingLocation(self):
+        return divmod(self.kingSquares[BLACK], 8)
+
+    # Hash of the position from scratch, makeMove and undoMove keep self.zobristKey up to date incrementally
+    def computeZobristKey(self):
+        key = ZOBRIST_CASTLING[self.castlingRights]
+        for sq, piece in enumerate(self.squares):
+            if piece:
+                key ^= ZOBRIST_PIECES[piece][sq]
+        if not self.whitesMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        if self.enpassantPossible is not None:
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible & 7]
+        return key
+
+    # Middlegame score, endgame score (both in White's favor) and game phase from scratch
+    # makeMove and undoMove keep self.mgScore, self.egScore and self.phase up to date incrementally
+    def computeEvaluation(self):
+        mgScore = egScore = phase = 0
+        for sq, piece in enumerate(self.squares):
+            if piece:
+                mgScore += MG_SCORES[piece][sq]
+                egScore += EG_SCORES[piece][sq]
+                phase += PHASE_WEIGHTS[piece & TYPE_MASK]
+        return mgScore, egScore, phase
            
+    # move is a Move, as returned by getValidMoves
     def makeMove(self, move):
-        if move.pieceCaptured[0] == 'w':
-            self.whitePieces[move.pieceCaptured[1]] -= 1
-        elif move.pieceCaptured[0] == 'b':
-            self.blackPieces[move.pieceCaptured[1]] -= 1
-        self.board[move.startRow][move.startCol] = '--'
-        self.board[move.endRow][move.endCol] = move.pieceMoved
+        self.pushMove(move.packed)
         self.movesLog.append(move)
+
+    def undoMove(self):
+        if len(self.movesLog) != 0:
+            self.movesLog.pop()
+            self.popMove()
+
+    # Makes a packed move, the search's version of makeMove
+    def pushMove(self, move):
+        squares = self.squares
+        startSq = move >> 6 & 63
+        endSq = move & 63
+        moved = squares[startSq]
+        # En passant captures the pawn beside the start square, on the file the pawn moves to
+        capturedSq = (startSq & ~7) | (endSq & 7) if move & ENPASSANT_FLAG else endSq
+        captured = squares[capturedSq]
+
+        if self.undoCount == len(self.undoStack):
+            self.undoStack.append(UndoRecord())
+        record = self.undoStack[self.undoCount]
+        self.undoCount += 1
+        record.move = move
+        record.pieceCaptured = captured
+        record.castlingRights = self.castlingRights
+        record.enpassantPossible = self.enpassantPossible
+        record.zobristKey = self.zobristKey
+        record.mgScore = self.mgScore
+        record.egScore = self.egScore
+        record.phase = self.phase
+        record.halfmoveClock = self.halfmoveClock
+
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_CASTLING[self.castlingRights]
+        key ^= ZOBRIST_PIECES[moved][startSq] ^ ZOBRIST_PIECES[moved][endSq]
+        mgScore = self.mgScore - MG_SCORES[moved][startSq] + MG_SCORES[moved][endSq]
+        egScore = self.egScore - EG_SCORES[moved][startSq] + EG_SCORES[moved][endSq]
+        if captured:
+            key ^= ZOBRIST_PIECES[captured][capturedSq]
+            mgScore -= MG_SCORES[captured][capturedSq]
+            egScore -= EG_SCORES[captured][capturedSq]
+            self.phase -= PHASE_WEIGHTS[captured & TYPE_MASK]
+            if captured & COLOR_MASK == WHITE:
+                self.whitePieces[PIECE_LETTERS[captured & TYPE_MASK]] -= 1
+            else:
+                self.blackPieces[PIECE_LETTERS[captured & TYPE_MASK]] -= 1
+            squares[capturedSq] = EMPTY
+        squares[startSq] = EMPTY
+        squares[endSq] = moved
+        if captured or moved & TYPE_MASK == PAWN:
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if not self.whitesMove:
+            self.fullmoveNumber += 1
         self.whitesMove = not self.whitesMove
+        self._boardView = None
 
         # Update king's location
-        if move.pieceMoved == 'wK':
-            self.whiteKingLocation = (move.endRow, move.endCol)
-        elif move.pieceMoved == 'bK':
-            self.blackKingLocation = (move.endRow, move.endCol)
+        if moved & TYPE_MASK == KING:
+            self.kingSquares[moved & COLOR_MASK] = endSq
 
-        # Pawn promotion (only for QUEEN)
-        if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'Q'
+        # Pawn promotion
+        promotionPiece = move >> 12 & 7
+        if promotionPiece:
+            promoted = (moved & COLOR_MASK) | promotionPiece
+            squares[endSq] = promoted
+            key ^= ZOBRIST_PIECES[moved][endSq] ^ ZOBRIST_PIECES[promoted][endSq]
+            mgScore += MG_SCORES[promoted][endSq] - MG_SCORES[moved][endSq]
+            egScore += EG_SCORES[promoted][endSq] - EG_SCORES[moved][endSq]
+            self.phase += PHASE_WEIGHTS[promotionPiece]
+            pieces = self.whitePieces if moved & COLOR_MASK == WHITE else self.blackPieces
+            pieces['P'] -= 1
+            pieces[PIECE_LETTERS[promotionPiece]] += 1
+
+        # Only a two square pawn advance allows en passant on the next move
+        if self.enpassantPossible is not None:
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible & 7]
+        if moved & TYPE_MASK == PAWN and abs(endSq - startSq) == 16:
+            self.enpassantPossible = (startSq + endSq) // 2
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible & 7]
+        else:
+            self.enpassantPossible = None
 
         # Castle Move
-        if move.isCastleMove:
-            if move.endCol - move.startCol == 2: # Kingside castle
-                self.board[move.endRow][move.endCol - 1] = self.board[move.endRow][move.endCol + 1] # Moves rook into new square
-                self.board[move.endRow][move.endCol + 1] = '--' # Erase old rook
+        if move & CASTLE_FLAG:
+            if endSq - startSq == 2: # Kingside castle
+                rookStart, rookEnd = endSq + 1, endSq - 1
             else: # Queenside castle
-                self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 2] # Moves rook into new square
-                self.board[move.endRow][move.endCol - 2] = '--' # Erase old rook
+                rookStart, rookEnd = endSq - 2, endSq + 1
+            rook = squares[rookStart]
+            squares[rookEnd] = rook # Moves rook into new square
+            squares[rookStart] = EMPTY # Erase old rook
+            key ^= ZOBRIST_PIECES[rook][rookStart] ^ ZOBRIST_PIECES[rook][rookEnd]
+            mgScore += MG_SCORES[rook][rookEnd] - MG_SCORES[rook][rookStart]
+            egScore += EG_SCORES[rook][rookEnd] - EG_SCORES[rook][rookStart]
+        self.mgScore = mgScore
+        self.egScore = egScore
 
-        # Update castling rights whenever it is a rook or king move
-        self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
-                                                 self.currentCastlingRight.wqs, self.currentCastlingRight.bqs))
-            
+        # Update castling rights whenever a king or rook leaves its square or a rook is captured on it
+        self.castlingRights &= CASTLING_KEPT[startSq] & CASTLING_KEPT[endSq]
+        self.zobristKey = key ^ ZOBRIST_CASTLING[self.castlingRights]
+
+    # Passes the turn, for null move pruning. Taken back with popNullMove
+    def pushNullMove(self):
+        if self.undoCount == len(self.undoStack):
+            self.undoStack.append(UndoRecord())
+        record = self.undoStack[self.undoCount]
+        self.undoCount += 1
+        record.move = NULL_MOVE
+        record.pieceCaptured = EMPTY
+        record.enpassantPossible = self.enpassantPossible
+        record.zobristKey = self.zobristKey
+        record.halfmoveClock = self.halfmoveClock
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE
+        if self.enpassantPossible is not None:
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible & 7]
+            self.enpassantPossible = None
+        self.zobristKey = key
+        self.halfmoveClock = 0 # No repetition reaches back past a passed turn
+        if not self.whitesMove:
+            self.fullmoveNumber += 1
+        self.whitesMove = not self.whitesMove
+        self._boardView = None
+
+    def popNullMove(self):
+        self.undoCount -= 1
+        record = self.undoStack[self.undoCount]
+        self.enpassantPossible = record.enpassantPossible
+        self.zobristKey = record.zobristKey
+        self.halfmoveClock = record.halfmoveClock
+        self.whitesMove = not self.whitesMove
+        if not self.whitesMove:
+            self.fullmoveNumber -= 1
+        self._boardView = None
+
+    # Takes back the last pushMove
+    def popMove(self):
+        self.undoCount -= 1
+        record = self.undoStack[self.undoCount]
+        move = record.move
+        squares = self.squares
+        startSq = move >> 6 & 63
+        endSq = move & 63
+        moved = squares[endSq]
+        promotionPiece = move >> 12 & 7
+        if promotionPiece:
+            pieces = self.whitePieces if moved & COLOR_MASK == WHITE else self.blackPieces
+            pieces['P'] += 1
+            pieces[PIECE_LETTERS[promotionPiece]] -= 1
+            moved = (moved & COLOR_MASK) | PAWN
+        squares[startSq] = moved
+        squares[endSq] = EMPTY
+        captured = record.pieceCaptured
+        if captured:
+            squares[(startSq & ~7) | (endSq & 7) if move & ENPASSANT_FLAG else endSq] = captured
+            if captured & COLOR_MASK == WHITE:
+                self.whitePieces[PIECE_LETTERS[captured & TYPE_MASK]] += 1
+            else:
+                self.blackPieces[PIECE_LETTERS[captured & TYPE_MASK]] += 1
+
+        if moved & TYPE_MASK == KING:
+            self.kingSquares[moved & COLOR_MASK] = startSq
+
+        # Undo castling
+        if move & CASTLE_FLAG:
+            if endSq - startSq == 2: #Kingside
+                squares[endSq + 1] = squares[endSq - 1]
+                squares[endSq - 1] = EMPTY
+            else: # Queenside
+                squares[endSq - 2] = squares[endSq + 1]
+                squares[endSq + 1] = EMPTY
+
+        self.castlingRights = record.castlingRights
+        self.enpassantPossible = record.enpassantPossible
+        self.zobristKey = record.zobristKey
+        self.mgScore = record.mgScore
+        self.egScore = record.egScore
+        self.phase = record.phase
+        self.halfmoveClock = record.halfmoveClock
+        self.whitesMove = not self.whitesMove
+        if not self.whitesMove:
+            self.fullmoveNumber -= 1
+        self._boardView = None
 
-    def undoMove(self):
-        if len(self.movesLog) != 0:
-            move = self.movesLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
-            self.whitesMove = not self.whitesMove
-
-            if move.pieceMoved == 'wK':
-                self.whiteKingLocation = (move.startRow, move.startCol)
-            elif move.pieceMoved == 'bK':
-                self.blackKingLocation = (move.startRow, move.startCol)
-
-            # Undo castling rights
-            self.castleRightsLog.pop() # Get rid of new castle rights from the move we are undoing
-            newRights = self.castleRightsLog[-1] 
-            self.currentCastlingRight = CastleRights(newRights.wks, newRights.bks, newRights.wqs, newRights.bqs) # Update castle rights
-            # Undo castling 
-            if move.isCastleMove:
-                if move.endCol - move.startCol == 2: #Kingside
-                    self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 1]
-                    self.board[move.endRow][move.endCol - 1] == '--'
-                else: # Queenside
-                    self.board[move.endRow][move.endCol - 2] = self.board[move.endRow][move.endCol + 1]
-                    self.board[move.endRow][move.endCol + 1] == '--'
-
-    def updateCastleRights(self, move):
-        if move.pieceMoved == 'wK':
-            self.currentCastlingRight.wks = False
-            self.currentCastlingRight.wqs = False
-        elif move.pieceMoved == 'bK':
-            self.currentCastlingRight.bks = False
-            self.currentCastlingRight.bqs = False
-        elif move.pieceMoved == 'wR':
-            if move.startRow == 7:
-                if move.startCol == 0: # Left rook
-                    self.currentCastlingRight.wqs = False
-                elif move.startCol == 7: # Right rook
-                    self.currentCastlingRight.wks = False
-        elif move.pieceMoved == 'bR':
-            if move.startRow == 0:
-                if move.startCol == 0: # Left rook
-                    self.currentCastlingRight.bqs = False
-                elif move.startCol == 7: # Right rook
-                    self.currentCastlingRight.bks = False
-    
     # Considers checks on the King
     def getValidMoves(self):
-        # Hold because when we makeMove(moves[i]), it can change self.currentCastlingRight
-        tempCasteRights = CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
-                                       self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)
-        moves = self.getAllPossibleMoves() # Generate all possible moves
-        if self.whitesMove:
-            self.getCastleMoves(self.whiteKingLocation[0], self.whiteKingLocation[1], moves)
+        squares = self.squares
+        return [Move.fromPacked(move, squares) for move in self.getLegalMoves()]
+
+    # getValidMoves as packed moves
+    # Legality comes from the checks and pins seen from the king, so no move has to be played to test it
+    def getLegalMoves(self):
+        color = WHITE if self.whitesMove else BLACK
+        kingSq = self.kingSquares[color]
+        checks, pins = self.getChecksAndPins(kingSq, color)
+        if len(checks) > 1: # Double check, only the king can move
+            moves = []
+            self.getKingMoves(kingSq, moves)
         else:
-            self.getCastleMoves(self.blackKingLocation[0], self.blackKingLocation[1], moves)
-        # Then for each move, make the move (go through list backwards b/c if remove a move, then you could skip if you did it forward)
-        for i in range(len(moves) -1, -1, -1):
-            self.makeMove(moves[i]) # Swap turn
-            opponentMoves = self.getAllPossibleMoves() # Generate all opponents move
-            # For each of those moves, see if it attacks king
-            # If it does, it is not a valid move
-            self.whitesMove = not self.whitesMove # Swap turn, self.MakeMove changes turn
-            if self.inCheck():
-                moves.remove(moves[i]) 
-            self.whitesMove = not self.whitesMove # Swap turn
-            self.undoMove() # Swap turn
-        if len(moves) == 0: # Checkmate or stalemate
-            if self.inCheck():
+            moves = self.getAllPossibleMoves() # Generate all possible moves
+            if not checks:
+                self.getCastleMoves(kingSq, moves)
+        validMoves = self.filterValidMoves(moves, kingSq, checks, pins)
+        if len(validMoves) == 0: # Checkmate or stalemate
+            if checks:
                 self.checkMate = True
             else:
                 self.staleMate = True
         else:
             self.checkMate = False
             self.staleMate = False
+        return validMoves
 
-        self.currentCastlingRight = tempCasteRights
-        return moves
+    # The moves that do not leave the king on kingSq in check, given the checks and pins from getChecksAndPins
+    def filterValidMoves(self, moves, kingSq, checks, pins):
+        enemyColor = (self.squares[kingSq] & COLOR_MASK) ^ COLOR_MASK
+        blockSquares = checks[0] if checks else None
+        doubleCheck = len(checks) > 1
+        validMoves = []
+        for move in moves:
+            startSq = move >> 6 & 63
+            endSq = move & 63
+            if move & ENPASSANT_FLAG:
+                # Removes two pawns from one rank, which pins cannot describe, so play it and look
+                self.pushMove(move)
+                if not self.squareAttacked(kingSq, enemyColor):
+                    validMoves.append(move)
+                self.popMove()
+                continue
+            if startSq == kingSq:
+                # The king is ignored as a blocker so it cannot step back along the ray that checks it
+                if move & CASTLE_FLAG or not self.squareAttacked(endSq, enemyColor, kingSq):
+                    validMoves.append(move)
+                continue
+            if doubleCheck: # Only the king can move
+                continue
+            pinLine = pins.get(startSq)
+            if pinLine is not None and endSq not in pinLine: # Pinned piece leaving its line
+                continue
+            if blockSquares is not None and endSq not in blockSquares: # Does not capture or block the checker
+                continue
+            validMoves.append(move)
+        return validMoves
+
+    # Legal moves for the search, produced in stages so each stage's work is only done if the search gets to it:
+    #    the transposition table move, captures and promotions (MVV-LVA), the killer moves, then quiet moves by history
+    # When an early move causes a beta cutoff, the quiet moves are never generated
+    def generateMoves(self, ttMove, ply):
+        squares = self.squares
+        color = WHITE if self.whitesMove else BLACK
+        kingSq = self.kingSquares[color]
+        checks, pins = self.getChecksAndPins(kingSq, color)
+        searched = [] # Moves already produced by an earlier stage
+        if ttMove is not None and self.isPseudoLegal(ttMove) and self.filterValidMoves([ttMove], kingSq, checks, pins):
+            searched.append(ttMove)
+            yield ttMove
+
+        captures = self.filterValidMoves(self.getCaptureMoves(), kingSq, checks, pins)
+        captures.sort(key = lambda move: _captureOrder(move, squares), reverse = True)
+        for move in captures:
+            if move not in searched:
+                yield move
+
+        for move in (tuple(self.killerMoves[ply]) if ply < MAX_PLY else ()):
+            if move is None or move in searched or _isTactical(move, squares):
+                continue
+            if self.isPseudoLegal(move) and self.filterValidMoves([move], kingSq, checks, pins):
+                searched.append(move)
+                yield move
+
+        quiets = self.filterValidMoves(self.getQuietMoves(), kingSq, checks, pins)
+        history = self.historyTable[color]
+        quiets.sort(key = lambda move: history[move & 4095], reverse = True)
+        for move in quiets:
+            if move not in searched:
+                yield move
+
+    # Whether a packed move remembered from elsewhere (transposition table, killers) can be played here,
+    # without considering checks
+    def isPseudoLegal(self, move):
+        startSq = move >> 6 & 63
+        piece = self.squares[startSq]
+        if piece == EMPTY or piece & COLOR_MASK != (WHITE if self.whitesMove else BLACK):
+            return False
+        moves = []
+        self.moveFunctions[piece & TYPE_MASK](startSq, moves)
+        if piece & TYPE_MASK == KING:
+            self.getCastleMoves(startSq, moves)
+        return move in moves
+
+    # Whether a packed move is legal here, without changing checkMate and staleMate like getLegalMoves
+    def isLegal(self, move):
+        color = WHITE if self.whitesMove else BLACK
+        kingSq = self.kingSquares[color]
+        checks, pins = self.getChecksAndPins(kingSq, color)
+        return self.isPseudoLegal(move) and len(self.filterValidMoves([move], kingSq, checks, pins)) == 1
+
+    # Best line of the last search as packed moves, its first move followed by the transposition table moves
+    def getPrincipalVariation(self, maxLength = MAX_PLY):
+        line = []
+        seen = set() # Stops at a repetition, the table could lead round in a cycle
+        move = self.globalBestMove
+        while move is not None and len(line) < maxLength and self.zobristKey not in seen and self.isLegal(move):
+            seen.add(self.zobristKey)
+            line.append(move)
+            self.pushMove(move)
+            entry = self.transpositionTable.probe(self.zobristKey)
+            move = entry[3] if entry is not None else None
+        for move in line:
+            self.popMove()
+        return line
+
+    # Look outwards from the king at kingSq
+    # Returns a list with one set of squares per checking piece (the checker and the squares between it and the king)
+    # and a dict from each pinned piece's square to the squares it may still move to
+    def getChecksAndPins(self, kingSq, color):
+        squares = self.squares
+        enemyColor = color ^ COLOR_MASK
+        checks = []
+        pins = {}
+        for rays, sliders in ((ROOK_RAYS, (enemyColor | ROOK, enemyColor | QUEEN)),
+                              (BISHOP_RAYS, (enemyColor | BISHOP, enemyColor | QUEEN))):
+            for ray in rays[kingSq]:
+                pinnedSq = None
+                for i, sq in enumerate(ray):
+                    piece = squares[sq]
+                    if piece == EMPTY:
+                        continue
+                    if piece & COLOR_MASK == color:
+                        if pinnedSq is None: # First friendly piece could be pinned
+                            pinnedSq = sq
+                            continue
+                        break # Two friendly pieces in a row, nothing is pinned
+                    if piece in sliders:
+                        if pinnedSq is None:
+                            checks.append(frozenset(ray[:i + 1]))
+                        else:
+                            pins[pinnedSq] = frozenset(ray[:i + 1])
+                    break
+        for sq in KNIGHT_TARGETS[kingSq]:
+            if squares[sq] == enemyColor | KNIGHT:
+                checks.append(frozenset((sq,)))
+        for sq in PAWN_CAPTURES[color][kingSq]: # Enemy pawns that attack the king stand where our pawns would capture
+            if squares[sq] == enemyColor | PAWN:
+                checks.append(frozenset((sq,)))
+        return checks, pins
+
+    # Whether the position occurred at least times times before, looking back to the last capture or pawn move
+    # times = 2 is threefold repetition
+    def isRepetition(self, times = 2):
+        count = 0
+        stack = self.undoStack
+        # Records hold the key from before their move, the same side was to move every other record
+        for i in range(self.undoCount - 2, max(self.undoCount - self.halfmoveClock, 0) - 1, -2):
+            if stack[i].zobristKey == self.zobristKey:
+                count += 1
+                if count >= times:
+                    return True
+        return False
+
+    # Fifty moves by each side without a capture or pawn move
+    def isFiftyMoveDraw(self):
+        return self.halfmoveClock >= 100
+
+    # Neither side has the material to checkmate: bare kings with at most one knight or bishop between them
+    def isInsufficientMaterial(self):
+        minorPieces = 0
+        for pieces in (self.whitePieces, self.blackPieces):
+            if pieces['P'] or pieces['R'] or pieces['Q']:
+                return False
+            minorPieces += pieces['N'] + pieces['B']
+        return minorPieces <= 1
 
+    # Standard algebraic notation of a legal Move in this position, e.g. Nf3, exd5, O-O, e8=Q+
+    def getSan(self, move):
+        pieceType = move.pieceMoved & TYPE_MASK
+        if move.isCastleMove:
+            san = "O-O" if move.endSq > move.startSq else "O-O-O"
+        elif pieceType == PAWN:
+            san = move.getRankAndFile(move.endRow, move.endCol)
+            if move.pieceCaptured:
+                san = Move.colsToFiles[move.startCol] + "x" + san
+            if move.isPawnPromotion:
+                san += "=" + PIECE_LETTERS[move.promotionPiece]
+        else:
+            san = PIECE_LETTERS[pieceType]
+            # Other pieces of the same kind that can go to the same square
+            others = [other >> 6 & 63 for other in self.getLegalMoves() if other & 63 == move.endSq and
+                      other >> 6 & 63 != move.startSq and self.squares[other >> 6 & 63] == move.pieceMoved]
+            if others:
+                if all(sq & 7 != move.startCol for sq in others):
+                    san += Move.colsToFiles[move.startCol]
+                elif all(sq >> 3 != move.startRow for sq in others):
+                    san += Move.rowsToRanks[move.startRow]
+                else:
+                    san += move.getRankAndFile(move.startRow, move.startCol)
+            if move.pieceCaptured:
+                san += "x"
+            san += move.getRankAndFile(move.endRow, move.endCol)
+        checkMate, staleMate = self.checkMate, self.staleMate
+        self.pushMove(move.packed)
+        if self.inCheck():
+            san += "+" if self.getLegalMoves() else "#"
+        self.popMove()
+        self.checkMate, self.staleMate = checkMate, staleMate # getLegalMoves set them for the other position
+        return san
 
     # Determine if current player is in check
     def inCheck(self):
-        if self.whitesMove:
-            return self.squareUnderAttack(self.whiteKingLocation[0], self.whiteKingLocation[1])
-        else:
-            return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
-
-    # Determine if the enemy can attack the square (row, col)
-    def squareUnderAttack(self, row, col):
-        self.whitesMove = not self.whitesMove  # Switch to opponent's turn to figure out all of their possible moves
-        opponentMoves = self.getAllPossibleMoves()
-        self.whitesMove = not self.whitesMove # Switch turn's back 
-        for move in opponentMoves:
-            if move.endRow == row and move.endCol == col: # Square is under attack
+        color = WHITE if self.whitesMove else BLACK
+        return self.squareAttacked(self.kingSquares[color], color ^ COLOR_MASK)
+
+    # Determine if the enemy can attack the square sq
+    def squareUnderAttack(self, sq):
+        return self.squareAttacked(sq, BLACK if self.whitesMove else WHITE)
+
+    # Determine if a piece of byColor attacks sq by looking back from sq along every way a piece could reach it
+    # ignoreSq is treated as empty, used for the king so it does not block attacks on the squares behind it
+    def squareAttacked(self, sq, byColor, ignoreSq = None):
+        squares = self.squares
+        for attackerSq in KNIGHT_TARGETS[sq]:
+            if squares[attackerSq] == byColor | KNIGHT:
+                return True
+        for attackerSq in PAWN_CAPTURES[byColor ^ COLOR_MASK][sq]:
+            if squares[attackerSq] == byColor | PAWN:
+                return True
+        for attackerSq in KING_TARGETS[sq]:
+            if squares[attackerSq] == byColor | KING:
                 return True
+        for rays, rider in ((ROOK_RAYS, byColor | ROOK), (BISHOP_RAYS, byColor | BISHOP)):
+            for ray in rays[sq]:
+                for attackerSq in ray:
+                    piece = squares[attackerSq]
+                    if piece and attackerSq != ignoreSq:
+                        if piece == rider or piece == byColor | QUEEN:
+                            return True
+                        break
         return False
 
 
     # Does not consider checks on the King
     def getAllPossibleMoves(self):
         moves = []
-        for row in range(len(self.board)):
-            for col in range(len(self.board[row])):
-                turn = self.board[row][col][0]
-                if (turn == 'w' and self.whitesMove) or (turn == 'b' and not self.whitesMove):
-                    piece = self.board[row][col][1]
-                    self.moveFunctions[piece](row, col, moves) # Call appropriate move function based on piece type
+        squares = self.squares
+        color = WHITE if self.whitesMove else BLACK
+        moveFunctions = self.moveFunctions
+        for sq in range(64):
+            piece = squares[sq]
+            if piece and piece & COLOR_MASK == color:
+                moveFunctions[piece & TYPE_MASK](sq, moves) # Call appropriate move function based on piece type
         return moves
                     
-    def getPawnMoves(self, row, col, moves):
+    # Captures and promotions only, without considering checks
+    def getCaptureMoves(self):
+        moves = []
+        squares = self.squares
+        color = WHITE if self.whitesMove else BLACK
+        for sq in range(64):
+            piece = squares[sq]
+            if piece and piece & COLOR_MASK == color:
+                pieceType = piece & TYPE_MASK
+                if pieceType == PAWN:
+                    self.getPawnCaptureMoves(sq, moves)
+                elif pieceType in PIECE_TARGETS:
+                    self.getLeaperCaptureMoves(sq, moves, PIECE_TARGETS[pieceType])
+                else:
+                    self.getSlidingCaptureMoves(sq, moves, PIECE_RAYS[pieceType])
+        return moves
+
+    # Every other move (including castling), without considering checks
+    def getQuietMoves(self):
+        moves = []
+        squares = self.squares
+        color = WHITE if self.whitesMove else BLACK
+        for sq in range(64):
+            piece = squares[sq]
+            if piece and piece & COLOR_MASK == color:
+                pieceType = piece & TYPE_MASK
+                if pieceType == PAWN:
+                    self.getPawnQuietMoves(sq, moves)
+                elif pieceType in PIECE_TARGETS:
+                    self.getLeaperQuietMoves(sq, moves, PIECE_TARGETS[pieceType])
+                else:
+                    self.getSlidingQuietMoves(sq, moves, PIECE_RAYS[pieceType])
+        self.getCastleMoves(self.kingSquares[color], moves)
+        return moves
+
+    # Pawns never stand on the last rank (they promote), so the square in front always exists
+    def getPawnMoves(self, sq, moves):
+        squares = self.squares
+        piece = squares[sq]
         if self.whitesMove:
-            if row - 1 >= 0: # Make sure within the board
-                if self.board[row - 1][col] == '--': # One square pawn advance
-                    moves.append(Move((row, col), (row - 1, col), self.board))
-                    if row == 6 and self.board[row - 2][col] == '--': # Two square pawn advance if first move
-                        moves.append(Move((row, col), (row - 2, col), self.board))
-                if col - 1 >= 0: # Make sure within the board
-                    if self.board[row - 1][col - 1][0] == 'b': # Capture on left
-                        moves.append(Move((row, col), (row - 1, col - 1), self.board))
-                if col + 1 <= 7: 
-                    if self.board[row - 1][col + 1][0] == 'b': # Capture on right
-                        moves.append(Move((row, col), (row - 1, col + 1), self.board))
+            step, startRow, promotionRow, enemyColor = -8, 6, 1, BLACK
         else:
-            if row + 1 <= 7: # Make sure within the board
-                if self.board[row + 1][col] == '--': # One square pawn advance
-                    moves.append(Move((row, col), (row + 1, col), self.board))
-                    if row == 1 and self.board[row + 2][col] == '--': # Two square pawn advance if first move
-                        moves.append(Move((row, col), (row + 2, col), self.board))
-                if col - 1 >= 0: # Make sure within the board
-                    if self.board[row + 1][col - 1][0] == 'w': # Capture on left
-                        moves.append(Move((row, col), (row + 1, col - 1), self.board))
-                if col + 1 <= 7: 
-                    if self.board[row + 1][col + 1][0] == 'w': # Capture on right
-                        moves.append(Move((row, col), (row + 1, col + 1), self.board))
-
-    def getRookMoves(self, row, col, moves):
-        directions = ((-1, 0), (0, 1), (1, 0), (0, -1)) # up, right, down, left
-        enemyColor = 'b' if self.whitesMove else 'w'
-        for d in directions:
-            for i in range(1, 8):
-                endRow = row + d[0] * i
-                endCol = col + d[1] * i
-                if 0 <= endRow <= 7 and 0 <= endCol <= 7:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == '--':
-                        moves.append(Move((row, col), (endRow, endCol), self.board)) 
-                    elif endPiece[0] == enemyColor: # Enemy Piece, take
-                        moves.append(Move((row, col), (endRow, endCol), self.board))
-                        break # Break to get out of inner loop, Rook cannot get go further as piece is in way
-                    else: # Friendly piece, same reason as previous line comment
-                        break
-                else: # Off board
+            step, startRow, promotionRow, enemyColor = 8, 1, 6, WHITE
+        promotes = sq >> 3 == promotionRow
+        if squares[sq + step] == EMPTY: # One square pawn advance
+            if promotes:
+                self.getPromotionMoves(sq, sq + step, moves)
+            else:
+                moves.append(sq << 6 | (sq + step))
+                if sq >> 3 == startRow and squares[sq + 2 * step] == EMPTY: # Two square pawn advance if first move
+                    moves.append(sq << 6 | (sq + 2 * step))
+        for endSq in PAWN_CAPTURES[piece & COLOR_MASK][sq]:
+            endPiece = squares[endSq]
+            if endPiece and endPiece & COLOR_MASK == enemyColor: # Capture diagonally
+                if promotes:
+                    self.getPromotionMoves(sq, endSq, moves)
+                else:
+                    moves.append(sq << 6 | endSq)
+            elif endSq == self.enpassantPossible:
+                moves.append(ENPASSANT_FLAG | sq << 6 | endSq)
+
+    # One move per piece the pawn can promote to
+    def getPromotionMoves(self, sq, endSq, moves):
+        for promotionPiece in PROMOTION_PIECES:
+            moves.append(promotionPiece << 12 | sq << 6 | endSq)
+
+    # The getPawnMoves moves that capture or promote
+    def getPawnCaptureMoves(self, sq, moves):
+        squares = self.squares
+        piece = squares[sq]
+        step, promotionRow = (-8, 1) if self.whitesMove else (8, 6)
+        enemyColor = (piece & COLOR_MASK) ^ COLOR_MASK
+        promotes = sq >> 3 == promotionRow
+        if promotes and squares[sq + step] == EMPTY:
+            self.getPromotionMoves(sq, sq + step, moves)
+        for endSq in PAWN_CAPTURES[piece & COLOR_MASK][sq]:
+            endPiece = squares[endSq]
+            if endPiece and endPiece & COLOR_MASK == enemyColor:
+                if promotes:
+                    self.getPromotionMoves(sq, endSq, moves)
+                else:
+                    moves.append(sq << 6 | endSq)
+            elif endSq == self.enpassantPossible:
+                moves.append(ENPASSANT_FLAG | sq << 6 | endSq)
+
+    # The getPawnMoves moves that do neither
+    def getPawnQuietMoves(self, sq, moves):
+        squares = self.squares
+        step, startRow, promotionRow = (-8, 6, 1) if self.whitesMove else (8, 1, 6)
+        if sq >> 3 != promotionRow and squares[sq + step] == EMPTY:
+            moves.append(sq << 6 | (sq + step))
+            if sq >> 3 == startRow and squares[sq + 2 * step] == EMPTY:
+                moves.append(sq << 6 | (sq + 2 * step))
+
+    # Walks each ray until it leaves the board or hits a piece
+    def getSlidingMoves(self, sq, moves, rays):
+        squares = self.squares
+        color = squares[sq] & COLOR_MASK
+        for ray in rays[sq]:
+            for endSq in ray:
+                endPiece = squares[endSq]
+                if endPiece == EMPTY:
+                    moves.append(sq << 6 | endSq)
+                else:
+                    if endPiece & COLOR_MASK != color: # Enemy Piece, take
+                        moves.append(sq << 6 | endSq)
+                    break # Piece cannot go further as something is in the way
+
+    # Moves to each target square that is empty or holds an enemy piece
+    def getLeaperMoves(self, sq, moves, targets):
+        squares = self.squares
+        color = squares[sq] & COLOR_MASK
+        for endSq in targets[sq]:
+            endPiece = squares[endSq]
+            if endPiece == EMPTY or endPiece & COLOR_MASK != color:
+                moves.append(sq << 6 | endSq)
+
+    def getSlidingCaptureMoves(self, sq, moves, rays):
+        squares = self.squares
+        color = squares[sq] & COLOR_MASK
+        for ray in rays[sq]:
+            for endSq in ray:
+                endPiece = squares[endSq]
+                if endPiece:
+                    if endPiece & COLOR_MASK != color:
+                        moves.append(sq << 6 | endSq)
                     break
 
-    def getKnightMoves(self, row, col, moves):
-        directions = ((-2, -1), (-1, -2), (1, -2), (2, -1), (2, 1), (1, 2), (-1, 2), (-2, 1))
-        enemyColor = 'b' if self.whitesMove else 'w'
-        for d in directions:
-            endRow = row + d[0]
-            endCol = col + d[1]
-            if 0 <= endRow <= 7 and 0 <= endCol <= 7:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor or endPiece == '--':
-                    moves.append(Move((row, col), (endRow, endCol), self.board)) 
-
-
-    def getBishopMoves(self, row, col, moves):
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1)) # top right, top left, bottom right, bottom left
-        enemyColor = 'b' if self.whitesMove else 'w'
-        for d in directions:
-            for i in range(1, 8):
-                endRow = row + d[0] * i
-                endCol = col + d[1] * i
-                if 0 <= endRow <= 7 and 0 <= endCol <= 7:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == '--':
-                        moves.append(Move((row, col), (endRow, endCol), self.board)) 
-                    elif endPiece[0] == enemyColor: # Enemy Piece, take
-                        moves.append(Move((row, col), (endRow, endCol), self.board))
-                        break # Break to get out of inner loop, Rook cannot get go further as piece is in way
-                    else: # Friendly piece, same reason as previous line comment
-                        break
-                else: # Off board
+    def getSlidingQuietMoves(self, sq, moves, rays):
+        squares = self.squares
+        for ray in rays[sq]:
+            for endSq in ray:
+                if squares[endSq]:
                     break
+                moves.append(sq << 6 | endSq)
+
+    def getLeaperCaptureMoves(self, sq, moves, targets):
+        squares = self.squares
+        enemyColor = (squares[sq] & COLOR_MASK) ^ COLOR_MASK
+        for endSq in targets[sq]:
+            endPiece = squares[endSq]
+            if endPiece and endPiece & COLOR_MASK == enemyColor:
+                moves.append(sq << 6 | endSq)
+
+    def getLeaperQuietMoves(self, sq, moves, targets):
+        squares = self.squares
+        for endSq in targets[sq]:
+            if squares[endSq] == EMPTY:
+                moves.append(sq << 6 | endSq)
 
-    def getQueenMoves(self, row, col, moves):
-        self.getRookMoves(row, col, moves)
-        self.getBishopMoves(row, col, moves)
-
-    def getKingMoves(self, row, col, moves):
-        directions = ((-1, 0), (-1, -1), (0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1))
-        enemyColor = 'b' if self.whitesMove else 'w'
-        for i in range(8):
-            endRow = row + directions[i][0]
-            endCol = col + directions[i][1]
-            if 0 <= endRow <= 7 and 0 <= endCol <= 7:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor or endPiece == '--':
-                    moves.append(Move((row, col), (endRow, endCol), self.board)) 
-
-    # Generate all valid castle moves for the king at (row, col) and add them to the list of moves
-    def getCastleMoves(self, row, col, moves):
-        if self.squareUnderAttack(row, col):
+    def getRookMoves(self, sq, moves):
+        self.getSlidingMoves(sq, moves, ROOK_RAYS)
+
+    def getKnightMoves(self, sq, moves):
+        self.getLeaperMoves(sq, moves, KNIGHT_TARGETS)
+
+    def getBishopMoves(self, sq, moves):
+        self.getSlidingMoves(sq, moves, BISHOP_RAYS)
+
+    def getQueenMoves(self, sq, moves):
+        self.getSlidingMoves(sq, moves, QUEEN_RAYS)
+
+    def getKingMoves(self, sq, moves):
+        self.getLeaperMoves(sq, moves, KING_TARGETS)
+
+    # Generate all valid castle moves for the king at sq and add them to the list of moves
+    def getCastleMoves(self, sq, moves):
+        if self.squareUnderAttack(sq):
             return # Can't castle while in check
-        if (self.whitesMove and self.currentCastlingRight.wks) or (not self.whitesMove and self.currentCastlingRight.bks):
-            self.getKingsideCastleMoves(row, col, moves)
-        if (self.whitesMove and self.currentCastlingRight.wqs) or (not self.whitesMove and self.currentCastlingRight.bqs):
-            self.getQueensideCastleMoves(row, col, moves)
+        if self.castlingRights & (WHITE_KINGSIDE if self.whitesMove else BLACK_KINGSIDE):
+            self.getKingsideCastleMoves(sq, moves)
+        if self.castlingRights & (WHITE_QUEENSIDE if self.whitesMove else BLACK_QUEENSIDE):
+            self.getQueensideCastleMoves(sq, moves)
         
         
-    def getKingsideCastleMoves(self, row, col, moves):
-        if self.board[row][col + 1] == '--' and self.board[row][col + 2] == '--':
-            if not self.squareUnderAttack(row, col + 1) and not self.squareUnderAttack(row, col + 2):
-                moves.append(Move((row, col), (row, col + 2), self.board, isCastleMove = True))
+    def getKingsideCastleMoves(self, sq, moves):
+        squares = self.squares
+        if squares[sq + 1] == EMPTY and squares[sq + 2] == EMPTY:
+            if not self.squareUnderAttack(sq + 1) and not self.squareUnderAttack(sq + 2):
+                moves.append(CASTLE_FLAG | sq << 6 | (sq + 2))
 
 
-    def getQueensideCastleMoves(self, row, col, moves):
-        if self.board[row][col - 1] == '--' and self.board[row][col - 2] == '--' and self.board[row][col - 3] == '--':
-            if not self.squareUnderAttack(row, col - 1) and not self.squareUnderAttack(row, col - 2):
-                moves.append(Move((row, col), (row, col - 2), self.board, isCastleMove = True))
+    def getQueensideCastleMoves(self, sq, moves):
+        squares = self.squares
+        if squares[sq - 1] == EMPTY and squares[sq - 2] == EMPTY and squares[sq - 3] == EMPTY:
+            if not self.squareUnderAttack(sq - 1) and not self.squareUnderAttack(sq - 2):
+                moves.append(CASTLE_FLAG | sq << 6 | (sq - 2))
 
-    # Pieces are assigned values
-    # Determine the score of white and black based on the current board
+    # Score of the position for the side to move, in centipawns
+    # The middlegame and endgame scores are blended by how much material is left (the phase),
+    # all three are kept up to date by makeMove and undoMove so this is O(1)
     def computeScore(self):
-        pieceValues = {"P": 1, "B": 3, "N": 3, "R": 5, "Q": 9 , "K": 99}
-        # blackPieces = []
-        # whitePieces = []
-        blackScore = 0
-        whiteScore = 0
-        for key, value in self.whitePieces.items():
-            whiteScore += pieceValues[key] * value
-        for key, value in self.blackPieces.items():
-            blackScore += pieceValues[key] * value
+        phase = min(self.phase, TOTAL_PHASE) # Promotions can take it above the starting value
+        score = (self.mgScore * phase + self.egScore * (TOTAL_PHASE - phase)) // TOTAL_PHASE
         if self.whitesMove:
-            return whiteScore - blackScore
-        return blackScore - whiteScore
-        """
-        for row in range(len(self.board)):
-            for col in range(len(self.board[row])):
-                color = self.board[row][col][0]
-                piece = self.board[row][col]
-                if color == 'w':
-                    whitePieces.append(piece)
-                elif color == 'b':
-                    blackPieces.append(piece)
-        for bPiece in blackPieces:
-            blackScore += pieceValues[bPiece[1]]
-        for wPiece in whitePieces:
-            whiteScore += pieceValues[wPiece[1]]
-        # print("White's score: " + str(whiteScore))
-        # print("Black's score: " + str(blackScore))
-        if self.whitesMove:
-            return whiteScore - blackScore
-        return blackScore - whiteScore
-        """
-
-    def undoMovee(self, move):
-        if move.pieceCaptured[0] == 'w':
-            self.whitePieces[move.pieceCaptured[1]] += 1
-        elif move.pieceCaptured[0] == 'b':
-            self.blackPieces[move.pieceCaptured[1]] += 1
-        self.board[move.startRow][move.startCol] = move.pieceMoved
-        self.board[move.endRow][move.endCol] = move.pieceCaptured
-        self.whitesMove = not self.whitesMove
-    
+            return score
+        return -score
+
 
     def aiMove(self):
         self.makeMove(self.findBestMove())
 
+    # Returns the best Move found, self.bestMove and self.globalBestMove hold packed moves while searching
     def findBestMove(self):
+        if self.openingBook is not None:
+            bookMove = self.openingBook.chooseMove(self)
+            if bookMove is not None:
+                self.globalBestMove = bookMove
+                self.globalBestScore = None
+                self.searchStatistics = []
+                return Move.fromPacked(bookMove, self.squares)
+        if self.tablebases is not None:
+            result = self.tablebases.bestMove(self)
+            if result is not None:
+                self.globalBestMove, self.globalBestScore = result
+                self.searchStatistics = []
+                return Move.fromPacked(self.globalBestMove, self.squares)
+        if self.searchCache is not None and self.probeSearchCache():
+            self.searchStatistics = []
+            return Move.fromPacked(self.globalBestMove, self.squares)
+        if self.searchWorkers > 1:
+            import ParallelSearch # Imported here as ParallelSearch itself imports this module
+            move = ParallelSearch.findBestMove(self, self.searchWorkers)
+            if self.searchStatistics: # Not when there were no moves or no depth completed
+                self.saveSearchResult()
+            return move
         self.timedOut = False
-        start = time.time()
-        for d in range(6):
-            if d > 0:
+        self.startSearchClock()
+        self.transpositionTable.newSearch() # Entries are kept between the iterations and between moves
+        self.globalBestMove = None
+        self.globalBestScore = None
+        self.bestMove = None
+        self.clearMoveOrdering()
+        self.searchStatistics = []
+        try:
+            for depth in range(self.INTIAL_DEPTH, self.MAX_DEPTH + 1):
+                self.currentDepth = depth
+                self.statistics = SearchStatistics(depth)
+                # self.maximizer(self.currentDepth, -10000, 10000, start)
+                score = self.negamax(self.currentDepth, float("-inf"), float("inf"), self.whitesMove)
+                if self.timedOut or self.bestMove is None: # Out of time, or no legal moves
+                    break
                 self.globalBestMove = self.bestMove
-                print("Completed search with depth: " + str(self.currentDepth))
-            self.currentDepth = self.INTIAL_DEPTH + d
-            # self.maximizer(self.currentDepth, -10000, 10000, start)
-            self.negamax(self.currentDepth, float("-inf"), float("inf"), start, self.whitesMove)
-            if self.timedOut:
-                return self.globalBestMove
-        return self.globalBestMove
-
-    def negamax(self, depth, alpha, beta, start, whitesMove):
+                self.globalBestScore = score
+                self.nodesSearched += self.statistics.nodes
+                self.statistics.finish(self.searchStatistics[-1] if self.searchStatistics else None)
+                self.searchStatistics.append(self.statistics)
+                if self.printProgress:
+                    print("Completed search with depth: " + str(self.currentDepth) + " (" + str(self.statistics) + ")")
+                if self.statisticsCallback is not None:
+                    self.statisticsCallback(self.statistics)
+                if self.progressCallback is not None:
+                    self.progressCallback(self.currentDepth, Move.fromPacked(self.globalBestMove, self.squares))
+                if self.softDeadline is not None and time.time() > self.softDeadline:
+                    break # The next depth would most likely not finish
+        finally:
+            self.stopRequested = False
+        if self.globalBestMove is None:
+            return None
+        self.saveSearchResult()
+        return Move.fromPacked(self.globalBestMove, self.squares)
+
+    # Returns True when the search cache has a result for this position as deep as findBestMove would search,
+    # which is then taken as globalBestMove. A shallower result goes in the transposition table instead,
+    # so its move is searched first
+    def probeSearchCache(self):
+        entry = self.searchCache.probe(self.zobristKey)
+        if entry is None:
+            return False
+        depth, bound, score, move = entry
+        if move is None or not self.isLegal(move):
+            return False
+        if bound == EXACT and depth >= self.MAX_DEPTH:
+            self.globalBestMove = move
+            self.globalBestScore = _scoreFromTable(score, 0)
+            return True
+        self.transpositionTable.store(self.zobristKey, depth, bound, score, move)
+        return False
+
+    # Writes a deep enough result of the last search to the search cache, with the transposition table's
+    # entries along its principal variation
+    def saveSearchResult(self):
+        if self.searchCache is None or not self.searchStatistics or self.globalBestMove is None:
+            return
+        depth = self.searchStatistics[-1].depth
+        if depth < SEARCH_CACHE_MIN_DEPTH:
+            return
+        self.searchCache.store(self.zobristKey, depth, EXACT, _scoreToTable(self.globalBestScore, 0), self.globalBestMove)
+        line = self.getPrincipalVariation()
+        for move in line[:-1]:
+            self.pushMove(move)
+            entry = self.transpositionTable.probe(self.zobristKey)
+            if entry is not None and entry[0] >= SEARCH_CACHE_MIN_DEPTH:
+                self.searchCache.store(self.zobristKey, *entry)
+        for move in line[:-1]:
+            self.popMove()
+
+    # Ends the running findBestMove as if it timed out, safe to call from another thread
+    def requestStop(self):
+        self.stopRequested = True
+
+    # Sets the limits of a search starting now from self.timeManager, or TIMEOUT without one
+    # time.time() is used so the deadlines mean the same in worker processes
+    def startSearchClock(self):
+        now = time.time()
+        if self.timeManager is None:
+            self.softDeadline, self.deadline, self.nodeLimit = None, now + TIMEOUT, None
+        else:
+            self.softDeadline, self.deadline = self.timeManager.deadlines(now)
+            self.nodeLimit = self.timeManager.nodeLimit
+        self.nodesSearched = 0
+
+    # Whether the running search has to end now, read every NODE_CHECK_INTERVAL nodes
+    def searchLimitReached(self):
+        if self.stopRequested or (self.stopSignal is not None and self.stopSignal.is_set()):
+            return True
+        if self.deadline is not None and time.time() > self.deadline:
+            return True
+        return self.nodeLimit is not None and self.nodesSearched + self.statistics.nodes >= self.nodeLimit
+
+    # ply counts the moves from the root, depth the moves left to search, which reductions can make less than the
+    # moves left to the search's full depth
+    def negamax(self, depth, alpha, beta, whitesMove, ply = 0):
+        stats = self.statistics
+        if depth <= 0 and self.useQuiescence:
+            stats.leafNodes += 1
+            return self.quiescence(alpha, beta, ply) # Counts the node itself
+        stats.nodes += 1
         value = float("-inf")
-        end = time.time()
-        if end - start > TIMEOUT:
+        if self.timedOut or (stats.nodes & (NODE_CHECK_INTERVAL - 1) == 0 and self.searchLimitReached()):
             self.timedOut = True
             return value
-        if depth == 0:
+        if depth <= 0:
+            stats.leafNodes += 1
+            if self.leafCallback is not None:
+                self.leafCallback()
             return self.computeScore()  
-        moves = self.giveValuesToMoves(self.getValidMoves())
-        orderedMoves = sorted(moves, key=lambda list: list[0], reverse=True)
-        for val, move in orderedMoves:
-            self.makeMove(move)
-            value = max(value, - self.negamax(depth - 1, -beta, -alpha, start, not whitesMove))
-            self.undoMovee(move)
+        # Few enough pieces for the tablebases, which know the result exactly (queen or rook make a phase of 4 or 2)
+        if self.tablebases is not None and self.phase <= 4 and ply != 0:
+            score = self.tablebases.probe(self, ply)
+            if score is not None:
+                stats.tablebaseHits += 1
+                return score
+        # A stored result that is deep enough can answer this node without searching it
+        # The root is always searched so that self.bestMove gets set
+        alphaOrig = alpha
+        key = self.zobristKey
+        entry = self.transpositionTable.probe(key)
+        ttMove = None
+        if entry is not None:
+            stats.ttHits += 1
+            ttDepth, ttBound, ttScore, ttMove = entry
+            ttScore = _scoreFromTable(ttScore, ply)
+            if ttDepth >= depth and ply != 0:
+                if ttBound == EXACT:
+                    stats.ttCutoffs += 1
+                    return ttScore
+                elif ttBound == LOWER:
+                    alpha = max(alpha, ttScore)
+                else:
+                    beta = min(beta, ttScore)
+                if alpha >= beta:
+                    stats.ttCutoffs += 1
+                    return ttScore
+        if ply == 0 and self.globalBestMove is not None:
+            ttMove = self.globalBestMove # Best move of the previous iteration is searched first at the root
+        inCheck = self.inCheck()
+
+        # Null move pruning: if the side to move can pass and still fail high, a real move would as well
+        # Not in check, not twice in a row, and not with only pawns left, where passing can be better than
+        # every move (zugzwang) and the cutoff would be wrong
+        if (self.useNullMove and ply != 0 and depth >= NULL_MOVE_MIN_DEPTH and not inCheck and beta < MATE_BOUND
+                and self.undoStack[self.undoCount - 1].move != NULL_MOVE and self.hasPieces()
+                and self.computeScore() >= beta):
+            reduction = NULL_MOVE_REDUCTION + (depth > NULL_MOVE_DEEP)
+            self.pushNullMove()
+            score = - self.negamax(depth - 1 - reduction, -beta, -beta + 1, not whitesMove, ply + 1)
+            self.popNullMove()
+            if score >= beta and not self.timedOut:
+                stats.nullMoveCutoffs += 1
+                return beta # Not score, which may be a mate found without making a move
+
+        # Futility pruning: close to the leaves, quiet moves are skipped when the position is so far below
+        # alpha that not even a margin's worth of positional gain would raise it
+        futile = (self.useFutilityPruning and depth < len(FUTILITY_MARGINS) and ply != 0 and not inCheck
+                  and -MATE_BOUND < alpha < MATE_BOUND and self.computeScore() + FUTILITY_MARGINS[depth] <= alpha)
+        reduce = self.useLateMoveReductions and depth >= LMR_MIN_DEPTH and not inCheck
+        bestMove = None
+        movesSearched = 0
+        for move in self.generateMoves(ttMove, ply):
+            # Quiet moves after the first can be pruned or reduced, unless they give check
+            late = (movesSearched and (futile or (reduce and movesSearched >= LMR_MIN_MOVES))
+                    and not _isTactical(move, self.squares))
+            if late and futile and depth == 1: # Not worth making the move to see if it checks this close to the leaves
+                stats.futilityPrunes += 1
+                continue
+            self.pushMove(move)
+            reduction = 0
+            if late and not self.inCheck():
+                if futile:
+                    self.popMove()
+                    stats.futilityPrunes += 1
+                    continue
+                reduction = 1 if movesSearched < LMR_LATE_MOVES else 2
+            movesSearched += 1
+            if reduction:
+                # A reduced null window search, only a move that beats alpha there gets its full depth
+                stats.reducedMoves += 1
+                score = - self.negamax(depth - 1 - reduction, -alpha - 1, -alpha, not whitesMove, ply + 1)
+                if score > alpha:
+                    stats.researches += 1
+                    score = - self.negamax(depth - 1, -beta, -alpha, not whitesMove, ply + 1)
+            else:
+                score = - self.negamax(depth - 1, -beta, -alpha, not whitesMove, ply + 1)
+            self.popMove()
+            if score > value:
+                value = score
+                bestMove = move
             if value > alpha:
                 alpha = value
-                if depth == self.currentDepth:
+                if ply == 0:
                     self.bestMove = move
             if alpha >= beta:
-                return alpha
+                stats.betaCutoffs += 1
+                if movesSearched == 1:
+                    stats.firstMoveCutoffs += 1
+                if not _isTactical(move, self.squares):
+                    self.updateQuietMoveOrdering(move, depth, ply)
+                break
+        if movesSearched == 0: # Checkmate or stalemate
+            return -MATE_SCORE + ply if inCheck else 0
+        stats.interiorNodes += 1
+        stats.movesSearched += movesSearched
+        if self.timedOut: # Scores of an unfinished search cannot be trusted
+            return value
+        if value <= alphaOrig:
+            bound = UPPER
+        elif value >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.transpositionTable.store(key, depth, bound, _scoreToTable(value, ply), bestMove)
         return value
 
-
-    def giveValuesToMoves(self, moves):
-        newMoves = []
+    # Searches captures and queen promotions only, until the position is quiet, so the score at the horizon
+    # does not miss a piece left hanging. The side to move can stand pat on the static score instead of capturing,
+    # except in check, where every evasion is searched
+    def quiescence(self, alpha, beta, ply):
+        stats = self.statistics
+        stats.nodes += 1
+        stats.quiescenceNodes += 1
+        if self.timedOut or (stats.nodes & (NODE_CHECK_INTERVAL - 1) == 0 and self.searchLimitReached()):
+            self.timedOut = True
+            return float("-inf")
+        if self.leafCallback is not None:
+            self.leafCallback()
+        standPat = self.computeScore()
+        if ply >= MAX_PLY:
+            return standPat
+        color = WHITE if self.whitesMove else BLACK
+        kingSq = self.kingSquares[color]
+        checks, pins = self.getChecksAndPins(kingSq, color)
+        squares = self.squares
+        if checks:
+            value = float("-inf")
+            moves = self.filterValidMoves(self.getCaptureMoves() + self.getQuietMoves(), kingSq, checks, pins)
+            if not moves:
+                return -MATE_SCORE + ply
+        else:
+            value = standPat
+            if standPat >= beta:
+                return standPat
+            if standPat > alpha:
+                alpha = standPat
+            moves = self.filterValidMoves(self.getCaptureMoves(), kingSq, checks, pins)
+        moves.sort(key = lambda move: _captureOrder(move, squares), reverse = True)
         for move in moves:
-            self.makeMove(move)
-            score = self.computeScore()
-            newMoves.append([score, move])
-            self.undoMovee(move)
-        return newMoves
+            if not checks:
+                promotionPiece = move >> 12 & 7
+                if promotionPiece and promotionPiece != QUEEN:
+                    continue
+                victim = PAWN if move & ENPASSANT_FLAG else squares[move & 63] & TYPE_MASK
+                # Delta pruning: the capture cannot bring the score up to alpha
+                if not promotionPiece and standPat + SEE_VALUES[victim] + DELTA_MARGIN <= alpha:
+                    stats.deltaPrunes += 1
+                    continue
+                # Captures that lose material once all the recaptures are made are not worth searching
+                # Taking a piece worth at least the capturer never loses
+                attacker = squares[move >> 6 & 63] & TYPE_MASK
+                if SEE_VALUES[attacker] > SEE_VALUES[victim] and self.staticExchange(move) < 0:
+                    stats.seePrunes += 1
+                    continue
+            self.pushMove(move)
+            score = - self.quiescence(-beta, -alpha, ply + 1)
+            self.popMove()
+            if score > value:
+                value = score
+            if value > alpha:
+                alpha = value
+            if alpha >= beta:
+                break
+        return value
+
+    # Static exchange evaluation: the material the side to move wins (negative if it loses) with a capture on
+    # the move's end square, when both sides then keep recapturing there with their least valuable piece
+    # and may stop whenever continuing would lose. Pins are not considered
+    def staticExchange(self, move):
+        squares = self.squares
+        startSq = move >> 6 & 63
+        endSq = move & 63
+        removed = {startSq} # Squares whose piece has already captured, pieces behind them can attack through
+        if move & ENPASSANT_FLAG:
+            gains = [SEE_VALUES[PAWN]]
+            removed.add((startSq & ~7) | (endSq & 7))
+        else:
+            gains = [SEE_VALUES[squares[endSq] & TYPE_MASK]]
+        onSquare = SEE_VALUES[squares[startSq] & TYPE_MASK] # Value of the piece the next capture takes
+        promotionPiece = move >> 12 & 7
+        if promotionPiece:
+            gains[0] += SEE_VALUES[promotionPiece] - SEE_VALUES[PAWN]
+            onSquare = SEE_VALUES[promotionPiece]
+        color = (squares[startSq] & COLOR_MASK) ^ COLOR_MASK
+        while True:
+            attackerSq = self.leastValuableAttacker(endSq, color, removed)
+            if attackerSq is None:
+                break
+            gains.append(onSquare - gains[-1])
+            onSquare = SEE_VALUES[squares[attackerSq] & TYPE_MASK]
+            removed.add(attackerSq)
+            color ^= COLOR_MASK
+        # Going back, each side takes the better of capturing and stopping
+        for i in range(len(gains) - 1, 0, -1):
+            gains[i - 1] = -max(-gains[i - 1], gains[i])
+        return gains[0]
+
+    # Square of the least valuable piece of byColor attacking sq, None if there is not one
+    # Squares in removed count as empty
+    def leastValuableAttacker(self, sq, byColor, removed):
+        squares = self.squares
+        for attackerSq in PAWN_CAPTURES[byColor ^ COLOR_MASK][sq]:
+            if squares[attackerSq] == byColor | PAWN and attackerSq not in removed:
+                return attackerSq
+        for attackerSq in KNIGHT_TARGETS[sq]:
+            if squares[attackerSq] == byColor | KNIGHT and attackerSq not in removed:
+                return attackerSq
+        best = None
+        bestType = KING
+        for rays, rider in ((BISHOP_RAYS, BISHOP), (ROOK_RAYS, ROOK)):
+            for ray in rays[sq]:
+                for attackerSq in ray:
+                    piece = squares[attackerSq]
+                    if piece and attackerSq not in removed:
+                        pieceType = piece & TYPE_MASK
+                        if piece & COLOR_MASK == byColor and pieceType in (rider, QUEEN) and pieceType < bestType:
+                            best = attackerSq
+                            bestType = pieceType
+                        break
+        if best is not None:
+            return best
+        for attackerSq in KING_TARGETS[sq]:
+            if squares[attackerSq] == byColor | KING and attackerSq not in removed:
+                return attackerSq
+        return None
+
+    # Whether the side to move has a piece besides its king and pawns, null move pruning is unsafe without one
+    def hasPieces(self):
+        pieces = self.whitePieces if self.whitesMove else self.blackPieces
+        return pieces['N'] + pieces['B'] + pieces['R'] + pieces['Q'] > 0
+
+
+    # Sorts moves best first without playing any of them:
+    #    the transposition table or previous iteration's move, then captures and promotions by
+    #    most valuable victim / least valuable attacker, then the killer moves, then quiet moves by history
+    def orderMoves(self, moves, ttMove, ply):
+        squares = self.squares
+        killers = self.killerMoves[ply] if ply < MAX_PLY else (None, None)
+        history = self.historyTable[WHITE if self.whitesMove else BLACK]
+
+        def moveScore(move):
+            if move == ttMove:
+                return ORDER_TT_MOVE
+            if _isTactical(move, squares):
+                return ORDER_CAPTURE + _captureOrder(move, squares)
+            if move == killers[0]:
+                return ORDER_KILLER + 1
+            if move == killers[1]:
+                return ORDER_KILLER
+            return history[move & 4095]
+
+        moves.sort(key = moveScore, reverse = True)
+        return moves
+
+    # A quiet move of the side to move caused a beta cutoff, make it a killer for this ply and raise its history score
+    def updateQuietMoveOrdering(self, move, depth, ply):
+        if ply < MAX_PLY:
+            killers = self.killerMoves[ply]
+            if killers[0] != move:
+                killers[1] = killers[0]
+                killers[0] = move
+        history = self.historyTable[WHITE if self.whitesMove else BLACK]
+        index = move & 4095
+        history[index] += depth * depth
+        if history[index] >= HISTORY_LIMIT:
+            for i in range(4096):
+                history[i] //= 2
+
+    # Killers only make sense for one position, history is aged so old searches count for less
+    def clearMoveOrdering(self):
+        for killers in self.killerMoves:
+            killers[0] = killers[1] = None
+        for history in self.historyTable.values():
+            for i in range(4096):
+                history[i] //= 8
+
+    # Forgets everything earlier searches learned, so the next search does not depend on them
+    def clearSearchTables(self):
+        self.transpositionTable.clear()
+        for killers in self.killerMoves:
+            killers[0] = killers[1] = None
+        for history in self.historyTable.values():
+            for i in range(4096):
+                history[i] = 0
 
 
     def maximizer(self, depth, alpha, beta, start):
@@ -399,11 +1445,11 @@ class Board():
             return alpha
         if depth == 0:
             return self.computeScore()
-        moves = self.getValidMoves()
+        moves = self.getLegalMoves()
         for move in moves:
-            self.makeMove(move)
+            self.pushMove(move)
             score = self.minimizer(depth - 1, alpha, beta, start)
-            self.undoMovee(move)
+            self.popMove()
             if score > alpha:
                 alpha = score
                 if depth == self.currentDepth:
@@ -416,49 +1462,114 @@ class Board():
     def minimizer(self, depth, alpha, beta, start):
         if depth == 0:
             return self.computeScore()
-        moves = self.getValidMoves()
+        moves = self.getLegalMoves()
         for move in moves:
-            self.makeMove(move)
+            self.pushMove(move)
             score = self.maximizer(depth - 1, alpha, beta, start)
-            self.undoMovee(move)
+            self.popMove()
             if score <= beta:
                 beta = score
             if alpha >= beta:
                 return beta
         return beta
         
-class CastleRights():
-    def __init__(self, wks, bks, wqs, bqs): # WhiteQueensSide, BlackQueenSide, ...
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
+# What popMove needs to restore the position before a move
+class UndoRecord():
+    __slots__ = ('move', 'pieceCaptured', 'castlingRights', 'enpassantPossible', 'zobristKey',
+                 'mgScore', 'egScore', 'phase', 'halfmoveClock')
+
+# Records allocated up front, enough for most games and searches, the stack grows past it if needed
+UNDO_STACK_SIZE = 256
 
 
+# A packed move with what the GUI wants to know about it
 class Move():
+    __slots__ = ('packed', 'pieceMoved', 'pieceCaptured')
 
     rankToRows = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
     rowsToRanks = {v: k for k, v in rankToRows.items()}
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
-    def __init__(self, startSquare, endSquare, board, isCastleMove = False):
-        self.startRow = startSquare[0]
-        self.startCol = startSquare[1]
-        self.endRow = endSquare[0]
-        self.endCol = endSquare[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        self.isPawnPromotion = False
-        self.isCastleMove = isCastleMove
-        if (self.pieceMoved == 'wP' and self.endRow == 0) or (self.pieceMoved == 'bP' and self.endRow == 7): # Made it to end
-            self.isPawnPromotion = True
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol # moveID's are unique
-        # 1323 means piece moving from (1,3) to (2,3)
+    # board is the 2D list of strings from Board.board
+    # Pawns reaching the end promote to a queen unless promotionPiece says otherwise
+    def __init__(self, startSquare, endSquare, board, isCastleMove = False, promotionPiece = QUEEN):
+        startSq = startSquare[0] * 8 + startSquare[1]
+        endSq = endSquare[0] * 8 + endSquare[1]
+        self.pieceMoved = PIECE_CODES[board[startSquare[0]][startSquare[1]]]
+        self.pieceCaptured = PIECE_CODES[board[endSquare[0]][endSquare[1]]]
+        self.packed = startSq << 6 | endSq
+        if self.pieceMoved & TYPE_MASK == PAWN and (endSq < 8 or endSq >= 56): # Made it to end
+            self.packed |= promotionPiece << 12
+        if isCastleMove:
+            self.packed |= CASTLE_FLAG
+
+    # Wraps a packed move of the position squares is in, before the move is made
+    @classmethod
+    def fromPacked(cls, packed, squares):
+        move = cls.__new__(cls)
+        move.packed = packed
+        move.pieceMoved = squares[packed >> 6 & 63]
+        move.pieceCaptured = squares[move.capturedSq]
+        return move
+
+    @property
+    def moveID(self):
+        return self.packed & MOVE_ID_MASK # 716 means piece moving from square 11 (1,3) to square 12 (1,4)
+
+    @property
+    def startSq(self):
+        return self.packed >> 6 & 63
+
+    @property
+    def endSq(self):
+        return self.packed & 63
+
+    @property
+    def isCastleMove(self):
+        return self.packed & CASTLE_FLAG != 0
+
+    @property
+    def isEnpassantMove(self):
+        return self.packed & ENPASSANT_FLAG != 0
+
+    # En passant captures the pawn beside the start square, on the file the pawn moves to
+    @property
+    def capturedSq(self):
+        if self.packed & ENPASSANT_FLAG:
+            return (self.startSq & ~7) | (self.endSq & 7)
+        return self.endSq
+
+    @property
+    def promotionPiece(self):
+        return self.packed >> 12 & 7
+
+    @property
+    def isPawnPromotion(self):
+        return self.packed & PROMOTION_MASK != 0
+
+    @property
+    def startRow(self):
+        return self.startSq >> 3
+
+    @property
+    def startCol(self):
+        return self.startSq & 7
+
+    @property
+    def endRow(self):
+        return self.endSq >> 3
 
+    @property
+    def endCol(self):
+        return self.endSq & 7
 
+    # Long algebraic notation as used by UCI, e.g. e2e4 or e7e8q
     def getChessNotation(self):
-        return self.getRankAndFile(self.startRow, self.startCol) + self.getRankAndFile(self.endRow, self.endCol)
+        notation = self.getRankAndFile(self.startRow, self.startCol) + self.getRankAndFile(self.endRow, self.endCol)
+        if self.isPawnPromotion:
+            notation += PIECE_LETTERS[self.promotionPiece].lower()
+        return notation
 
     def getRankAndFile(self, row, col):
         return self.colsToFiles[col] + self.rowsToRanks[row]
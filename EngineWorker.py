@@ -0,0 +1,106 @@
+import io
+import pickle
+import threading
+from OpeningBook import OpeningBook
+from Tablebase import Tablebases
+
+# Runs Board.findBestMove on a background thread so a GUI loop can keep drawing while the engine thinks
+#    handle = EngineWorker.startSearch(game)
+#    ... every frame: if handle.done(): move = handle.result()
+# and to ponder, search during the opponent's turn, with startPonder
+
+# Files the engine reads that the copy shares with the board, pickling them would open them again
+SHARED_FILES = (OpeningBook, Tablebases)
+
+# Copy of the position for the search thread to play moves on, so the caller's board never changes under it
+# The search tables are shared so what the engine learns carries over to its next move
+def _searchCopy(board):
+    shared = []
+    def persistentId(obj):
+        if isinstance(obj, SHARED_FILES):
+            shared.append(obj)
+            return len(shared) - 1
+        return None
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer)
+    pickler.persistent_id = persistentId
+    pickler.dump(board)
+    buffer.seek(0)
+    unpickler = pickle.Unpickler(buffer)
+    unpickler.persistent_load = shared.__getitem__
+    copy = unpickler.load()
+    copy.transpositionTable = board.transpositionTable
+    copy.killerMoves = board.killerMoves
+    copy.historyTable = board.historyTable
+    copy.searchCache = board.searchCache
+    return copy
+
+class SearchHandle():
+
+    # onProgress is called from the search thread with (depth, bestMove) after every completed depth,
+    # and board's statisticsCallback with the statistics of every completed depth
+    # ponderMove is a legal move of board that is played before searching, see startPonder
+    def __init__(self, board, onProgress = None, ponderMove = None):
+        self._board = _searchCopy(board)
+        self._board.progressCallback = self._progress
+        self._board.statisticsCallback = board.statisticsCallback
+        self.ponderMove = ponderMove
+        if ponderMove is not None:
+            self._board.makeMove(ponderMove)
+        self._onProgress = onProgress
+        self._result = None
+        self._error = None
+        self.cancelled = False
+        self.depth = 0 # Deepest completed depth so far
+        self.bestMove = None # Best move of that depth
+        self._thread = threading.Thread(target = self._run, daemon = True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._result = self._board.findBestMove()
+        except BaseException as error:
+            self._error = error
+
+    def _progress(self, depth, bestMove):
+        self.depth = depth
+        self.bestMove = bestMove
+        if self._onProgress is not None:
+            self._onProgress(depth, bestMove)
+
+    def done(self):
+        return not self._thread.is_alive()
+
+    # Waits for the search to finish and returns its best move (None if it was cancelled)
+    def result(self):
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        if self.cancelled:
+            return None
+        return self._result
+
+    # Stops the search and waits for the thread, which takes at most NODE_CHECK_INTERVAL nodes' worth of time
+    # (a parallel search's workers also stop, see ParallelSearch), so nothing writes to the shared tables after
+    def cancel(self):
+        self.cancelled = True
+        self._board.requestStop()
+        self._thread.join()
+
+def startSearch(board, onProgress = None):
+    return SearchHandle(board, onProgress)
+
+# Search while the opponent is thinking
+# The handle plays the reply the transposition table expects (its ponderMove) and searches the position after it.
+# If the opponent then makes that move, the handle is already the engine's search for its answer and has a head start.
+# Otherwise it should be cancelled, the table still holds what it found.
+# With no expected reply it searches the current position, which fills the table for every reply
+def startPonder(board, onProgress = None):
+    entry = board.transpositionTable.probe(board.zobristKey)
+    ponderMove = None
+    if entry is not None and entry[3] is not None:
+        for move in board.getValidMoves(): # Only ponder on a move that is legal here
+            if move.packed == entry[3]:
+                ponderMove = move
+                break
+    return SearchHandle(board, onProgress, ponderMove)
@@ -0,0 +1,122 @@
+import mmap
+import random
+import struct
+import ChessBoard
+
+# Opening book in the Polyglot file layout, read through mmap so only the pages a lookup touches are loaded
+#    book = OpeningBook("book.bin")
+#    board.openingBook = book # findBestMove then plays book moves without searching
+# A book is a sorted array of 16 byte big-endian entries: position key (8 bytes), move (2), weight (2), learn (4).
+# Several entries with the same key are the moves known for that position, chosen in proportion to their weight.
+# The keys are ChessBoard's Zobrist keys, not the Polyglot ones, so books have to be made with buildBook
+# (see makebook.py).
+
+ENTRY = struct.Struct(">QHHI")
+KEY = struct.Struct(">Q")
+MAX_WEIGHT = 0xFFFF
+
+# Polyglot move: bits 0-2 to file, 3-5 to rank, 6-8 from file, 9-11 from rank, 12-14 promotion piece
+# (1 knight to 4 queen). Ranks count from White's side, so a square is ChessBoard's square ^ 56.
+# Castling is written as the king taking its own rook
+def encodeMove(move):
+    startSq = move >> 6 & 63
+    endSq = move & 63
+    if move & ChessBoard.CASTLE_FLAG:
+        endSq = endSq + 1 if endSq > startSq else endSq - 2 # The rook's square
+    promotionPiece = move >> 12 & 7
+    return ((promotionPiece - ChessBoard.PAWN if promotionPiece else 0) << 12 | (startSq ^ 56) << 6 | (endSq ^ 56))
+
+class OpeningBook():
+
+    def __init__(self, path, seed = None):
+        self.path = path
+        self.random = random.Random(seed)
+        self.file = open(path, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        except ValueError: # An empty file cannot be mapped
+            self.map = b""
+        self.size = len(self.map) // ENTRY.size
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    # A book goes to another process (e.g. with a pickled Board) as its path and is opened again there
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def __len__(self):
+        return self.size
+
+    # (move, weight, learn) of every entry for key, as stored
+    def lookup(self, key):
+        low, high = 0, self.size
+        while low < high: # First entry with a key not below key
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.map, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        for index in range(low, self.size):
+            entryKey, move, weight, learn = ENTRY.unpack_from(self.map, index * ENTRY.size)
+            if entryKey != key:
+                break
+            entries.append((move, weight, learn))
+        return entries
+
+    # (packed move, weight) of the book moves that are legal on board, best weighted first
+    def getMoves(self, board):
+        entries = self.lookup(board.zobristKey)
+        if not entries:
+            return []
+        legalMoves = {encodeMove(move): move for move in board.getLegalMoves()}
+        moves = [(legalMoves[move], weight) for move, weight, learn in entries if move in legalMoves and weight > 0]
+        moves.sort(key = lambda entry: entry[1], reverse = True)
+        return moves
+
+    # A packed book move for board chosen at random in proportion to the weights, None when out of book
+    def chooseMove(self, board):
+        moves = self.getMoves(board)
+        if not moves:
+            return None
+        pick = self.random.randrange(sum(weight for move, weight in moves))
+        for move, weight in moves:
+            pick -= weight
+            if pick < 0:
+                return move
+
+# Writes a book of the first maxPlies moves of games to path, returns the number of entries
+# games are (fen, moves, result) with packed moves and a PGN result; a move weighs 2 for every game the side
+# that played it won and 1 for every draw or game without a result, so moves that only lost are left out
+def buildBook(games, path, maxPlies = 16):
+    weights = {}
+    board = ChessBoard.Board.__new__(ChessBoard.Board) # Only the position is needed, not the search tables
+    for fen, moves, result in games:
+        board.loadFen(fen)
+        for move in moves[:maxPlies]:
+            if result in ("1-0", "0-1"):
+                weight = 2 if (result == "1-0") == board.whitesMove else 0
+            else:
+                weight = 1
+            entry = (board.zobristKey, encodeMove(move))
+            weights[entry] = weights.get(entry, 0) + weight
+            board.pushMove(move)
+    # Sorted by key for the binary search, the moves of a position best first
+    entries = sorted(((key, move, min(weight, MAX_WEIGHT)) for (key, move), weight in weights.items() if weight > 0),
+                     key = lambda entry: (entry[0], -entry[2], entry[1]))
+    with open(path, "wb") as file:
+        for key, move, weight in entries:
+            file.write(ENTRY.pack(key, move, weight, 0))
+    return len(entries)
@@ -0,0 +1,132 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+import ChessBoard
+from SearchStats import SearchStatistics
+from TranspositionTable import TranspositionTable
+
+# Root move splitting: the root moves are dealt out to a pool of worker processes and every worker
+# runs its own iterative deepening over its share, reporting the best move of each depth it completes.
+# The answer is the best move over all workers at the deepest depth every worker completed.
+# Board.requestStop ends a parallel search like a sequential one: the workers share an event with this
+# process, set when the board's stopRequested is seen, and stop at their next node check.
+# One parallel search runs at a time, the pool and its event are shared by every board.
+
+_pool = None
+_poolWorkers = 0
+_stopEvent = None
+STOP_POLL_INTERVAL = 0.01 # Seconds between looks at the board's stopRequested while the workers search
+
+# Transposition table of the worker process, kept between searches like the one on a Board
+_workerTable = None
+_workerStopEvent = None
+
+def _initWorker(stopEvent):
+    global _workerTable, _workerStopEvent
+    _workerTable = TranspositionTable()
+    _workerStopEvent = stopEvent
+
+# The pool is created on first use and kept, so worker start up is only paid once
+def getPool(workers):
+    global _pool, _poolWorkers, _stopEvent
+    if _pool is None or _poolWorkers != workers:
+        shutdownPool()
+        _stopEvent = multiprocessing.Event()
+        _pool = ProcessPoolExecutor(max_workers = workers, initializer = _initWorker, initargs = (_stopEvent,))
+        _poolWorkers = workers
+    return _pool
+
+def shutdownPool():
+    global _pool, _poolWorkers
+    if _pool is not None:
+        _pool.shutdown(cancel_futures = True)
+        _pool = None
+        _poolWorkers = 0
+
+# Runs in a worker process
+# rootMoves is this worker's share of the root's packed moves
+# Returns a list of (depth, score, move, statistics) with one entry per completed depth, and whether it timed out
+def _searchRootMoves(board, rootMoves):
+    board.transpositionTable = _workerTable
+    board.stopSignal = _workerStopEvent
+    board.transpositionTable.newSearch()
+    board.clearMoveOrdering()
+    board.timedOut = False
+    moves = [move for move in board.getLegalMoves() if move in rootMoves]
+    results = []
+    bestMove = None
+    for depth in range(board.INTIAL_DEPTH, board.MAX_DEPTH + 1):
+        board.currentDepth = depth
+        board.statistics = SearchStatistics(depth)
+        alpha = float("-inf")
+        depthBestMove = None
+        for move in board.orderMoves(moves, bestMove, 0):
+            board.pushMove(move)
+            score = - board.negamax(depth - 1, float("-inf"), -alpha, board.whitesMove, 1)
+            board.popMove()
+            if board.timedOut:
+                return results, True
+            if score > alpha or depthBestMove is None:
+                alpha = score
+                depthBestMove = move
+        bestMove = depthBestMove
+        board.nodesSearched += board.statistics.nodes
+        board.statistics.finish()
+        results.append((depth, alpha, bestMove, board.statistics))
+        if board.softDeadline is not None and time.time() > board.softDeadline:
+            break
+    return results, False
+
+# Same result and limits as Board.findBestMove, searched with workers processes
+# A node limit is shared out between the workers
+def findBestMove(board, workers = None):
+    board.startSearchClock()
+    board.timedOut = False
+    board.globalBestMove = None # Nothing of the last search is left over when this one completes no depth
+    board.globalBestScore = None
+    board.searchStatistics = []
+    workers = workers or os.cpu_count() or 1
+    moves = board.orderMoves(board.getLegalMoves(), None, 0)
+    if len(moves) == 0:
+        return None
+    workers = min(workers, len(moves))
+    # Dealt round robin so every worker gets some of the likely best moves
+    shares = [set(moves[i::workers]) for i in range(workers)]
+    if board.nodeLimit is not None:
+        board.nodeLimit = max(board.nodeLimit // workers, 1)
+    pool = getPool(workers)
+    _stopEvent.clear()
+    futures = [pool.submit(_searchRootMoves, board, share) for share in shares]
+    while wait(futures, STOP_POLL_INTERVAL).not_done:
+        if board.stopRequested:
+            _stopEvent.set()
+    board.stopRequested = False
+    results = []
+    for future in futures:
+        result, timedOut = future.result()
+        results.append(result)
+        board.timedOut = board.timedOut or timedOut
+
+    completedDepth = min(len(result) for result in results)
+    if completedDepth == 0: # Not even the first depth finished everywhere, like the sequential search there is no move
+        return None
+    # Each completed depth is reported as the sequential search reports it, with its best move over all workers
+    # and its statistics summed over them
+    for i in range(completedDepth):
+        depth = results[0][i][0]
+        statistics = SearchStatistics(depth)
+        for result in results:
+            statistics.merge(result[i][3])
+        if board.searchStatistics and board.searchStatistics[-1].nodes:
+            statistics.effectiveBranchingFactor = statistics.nodes / board.searchStatistics[-1].nodes
+        board.globalBestScore, board.globalBestMove = max((result[i][1], result[i][2]) for result in results)
+        board.nodesSearched += statistics.nodes
+        board.searchStatistics.append(statistics)
+        if board.printProgress:
+            print("Completed search with depth: " + str(depth) + " (" + str(statistics) + ")")
+        if board.statisticsCallback is not None:
+            board.statisticsCallback(statistics)
+        if board.progressCallback is not None:
+            board.progressCallback(depth, ChessBoard.Move.fromPacked(board.globalBestMove, board.squares))
+    return ChessBoard.Move.fromPacked(board.globalBestMove, board.squares)
@@ -0,0 +1,86 @@
+import mmap
+import os
+import struct
+from TranspositionTable import EXACT
+
+# Search results kept on disk, so positions searched in an earlier run are known when they come up again
+#    board.searchCache = SearchCache("searchcache.bin")
+# findBestMove probes it before searching and writes its result back afterwards, see Board.findBestMove.
+# The file is a header followed by a fixed number of 20 byte records, read and written through mmap,
+# so its size never grows. Records are grouped in buckets of BUCKET_SIZE; a new result replaces the record
+# of its bucket that matters least, one from the oldest session and with the shallowest depth.
+
+HEADER = struct.Struct("<8sII") # Magic, number of records, session number
+MAGIC = b"CBSC\x01\x00\x00\x00"
+RECORD = struct.Struct("<QiIBBH") # Key, score, move, depth, bound, session the record was written in
+DEFAULT_ENTRIES = 1 << 16
+BUCKET_SIZE = 4
+AGE_WEIGHT = 2 # Plies of depth one session of age is worth when choosing the record to replace
+NO_MOVE = 0 # a8a8, never a real move
+
+class SearchCache():
+
+    # entries only matters when the file is created, an existing file keeps its size
+    def __init__(self, path, entries = DEFAULT_ENTRIES):
+        self.path = path
+        if entries < BUCKET_SIZE or entries % BUCKET_SIZE:
+            raise ValueError("Search cache entries must be a multiple of " + str(BUCKET_SIZE))
+        exists = os.path.exists(path)
+        self.file = open(path, "r+b" if exists else "w+b")
+        header = self.file.read(HEADER.size)
+        if len(header) == HEADER.size and HEADER.unpack(header)[0] == MAGIC:
+            magic, entries, session = HEADER.unpack(header)
+        else:
+            session = 0
+        size = HEADER.size + entries * RECORD.size
+        if os.fstat(self.file.fileno()).st_size != size: # New or not a search cache, start empty
+            self.file.truncate(0)
+            self.file.truncate(size)
+            session = 0
+        self.entries = entries
+        self.buckets = entries // BUCKET_SIZE
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.session = (session + 1) & 0xFFFF # Every opening is a new session, records age by it
+        HEADER.pack_into(self.map, 0, MAGIC, entries, self.session)
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+    def flush(self):
+        self.map.flush()
+
+    def _bucketOffset(self, key):
+        return HEADER.size + (key % self.buckets) * BUCKET_SIZE * RECORD.size
+
+    # Returns (depth, bound, score, bestMove) for the position like TranspositionTable.probe, or None
+    def probe(self, key):
+        offset = self._bucketOffset(key)
+        for slot in range(BUCKET_SIZE):
+            storedKey, score, move, depth, bound, session = RECORD.unpack_from(self.map, offset + slot * RECORD.size)
+            if storedKey == key:
+                return depth, bound, score, None if move == NO_MOVE else move
+        return None
+
+    def store(self, key, depth, bound, score, move):
+        offset = self._bucketOffset(key)
+        replace = None
+        replacePriority = None
+        for slot in range(BUCKET_SIZE):
+            recordOffset = offset + slot * RECORD.size
+            storedKey, storedScore, storedMove, storedDepth, storedBound, session = \
+                RECORD.unpack_from(self.map, recordOffset)
+            if storedKey == key: # The same position, a shallower search does not replace an exact deeper one
+                if storedDepth > depth and storedBound == EXACT:
+                    return
+                replace = recordOffset
+                break
+            if storedKey == 0: # Empty
+                priority = -1 << 20
+            else:
+                priority = storedDepth - AGE_WEIGHT * ((self.session - session) & 0xFFFF)
+            if replacePriority is None or priority < replacePriority:
+                replace, replacePriority = recordOffset, priority
+        RECORD.pack_into(self.map, replace, key, score, NO_MOVE if move is None else move, min(depth, 255), bound,
+                         self.session)
@@ -0,0 +1,150 @@
+import time
+
+# Counters for one iteration of the search, filled in by Board.negamax
+# findBestMove keeps one per completed depth in board.searchStatistics and hands each to board.statisticsCallback
+class SearchStatistics():
+
+    def __init__(self, depth = 0):
+        self.depth = depth
+        self.nodes = 0 # negamax calls
+        self.leafNodes = 0 # Nodes at depth 0, evaluated with computeScore or the quiescence search
+        self.quiescenceNodes = 0 # Nodes of the quiescence search, counted in nodes as well
+        self.interiorNodes = 0 # Nodes that searched at least one move
+        self.movesSearched = 0 # Moves searched over all interior nodes
+        self.betaCutoffs = 0
+        self.firstMoveCutoffs = 0 # Beta cutoffs on the first move searched, high when the move ordering is good
+        self.ttHits = 0
+        self.ttCutoffs = 0 # Nodes answered by the transposition table without searching them
+        self.tablebaseHits = 0 # Nodes answered by the endgame tablebases
+        self.nullMoveCutoffs = 0 # Nodes cut off by null move pruning
+        self.reducedMoves = 0 # Moves searched with a late move reduction...
+        self.researches = 0 # ...and those searched again at full depth after beating alpha
+        self.futilityPrunes = 0 # Quiet moves skipped by futility pruning
+        self.deltaPrunes = 0 # Captures the quiescence search skipped as unable to reach alpha...
+        self.seePrunes = 0 # ...and as losing material by static exchange evaluation
+        self.elapsed = 0.0 # Seconds
+        self.effectiveBranchingFactor = 0.0 # Nodes of this iteration over nodes of the previous one, 0 for the first
+        self._start = time.perf_counter()
+
+    # Called when the iteration completes, previous is the statistics of the iteration before it
+    def finish(self, previous = None):
+        self.elapsed = time.perf_counter() - self._start
+        if previous is not None and previous.nodes:
+            self.effectiveBranchingFactor = self.nodes / previous.nodes
+
+    # Adds the counters of another worker's search of the same depth, see ParallelSearch
+    def merge(self, other):
+        self.nodes += other.nodes
+        self.leafNodes += other.leafNodes
+        self.quiescenceNodes += other.quiescenceNodes
+        self.interiorNodes += other.interiorNodes
+        self.movesSearched += other.movesSearched
+        self.betaCutoffs += other.betaCutoffs
+        self.firstMoveCutoffs += other.firstMoveCutoffs
+        self.ttHits += other.ttHits
+        self.ttCutoffs += other.ttCutoffs
+        self.tablebaseHits += other.tablebaseHits
+        self.nullMoveCutoffs += other.nullMoveCutoffs
+        self.reducedMoves += other.reducedMoves
+        self.researches += other.researches
+        self.futilityPrunes += other.futilityPrunes
+        self.deltaPrunes += other.deltaPrunes
+        self.seePrunes += other.seePrunes
+        self.elapsed = max(self.elapsed, other.elapsed) # The workers ran side by side
+
+    @property
+    def nodesPerSecond(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+    # Share of interior nodes that ended in a beta cutoff
+    @property
+    def cutoffRate(self):
+        return self.betaCutoffs / self.interiorNodes if self.interiorNodes else 0.0
+
+    # Share of beta cutoffs that came from the first move
+    @property
+    def firstMoveCutoffRate(self):
+        return self.firstMoveCutoffs / self.betaCutoffs if self.betaCutoffs else 0.0
+
+    # Average number of moves searched per interior node
+    @property
+    def branchingFactor(self):
+        return self.movesSearched / self.interiorNodes if self.interiorNodes else 0.0
+
+    @property
+    def ttHitRate(self):
+        return self.ttHits / self.nodes if self.nodes else 0.0
+
+    def asDict(self):
+        return {"depth": self.depth, "nodes": self.nodes, "leafNodes": self.leafNodes,
+                "quiescenceNodes": self.quiescenceNodes,
+                "nodesPerSecond": round(self.nodesPerSecond), "cutoffRate": self.cutoffRate,
+                "firstMoveCutoffRate": self.firstMoveCutoffRate, "branchingFactor": self.branchingFactor,
+                "effectiveBranchingFactor": self.effectiveBranchingFactor, "ttHitRate": self.ttHitRate,
+                "ttCutoffs": self.ttCutoffs, "tablebaseHits": self.tablebaseHits,
+                "nullMoveCutoffs": self.nullMoveCutoffs,
+                "reducedMoves": self.reducedMoves, "researches": self.researches,
+                "futilityPrunes": self.futilityPrunes, "deltaPrunes": self.deltaPrunes,
+                "seePrunes": self.seePrunes, "elapsed": self.elapsed}
+
+    def __str__(self):
+        return ("nodes %d, %.0f nodes/s, cutoffs %.0f%% (first move %.0f%%), branching %.2f (effective %.2f), "
+                "tt hits %.0f%%, %.2fs" % (self.nodes, self.nodesPerSecond, self.cutoffRate * 100,
+                                           self.firstMoveCutoffRate * 100, self.branchingFactor,
+                                           self.effectiveBranchingFactor, self.ttHitRate * 100, self.elapsed))
+
+
+# The Board methods Profiler times by default
+# Times are inclusive, getLegalMoves for example includes the filterValidMoves and getChecksAndPins calls it makes
+PROFILED_METHODS = ('getValidMoves', 'getLegalMoves', 'getCaptureMoves', 'getQuietMoves', 'filterValidMoves',
+                    'getChecksAndPins', 'makeMove', 'pushMove', 'popMove', 'computeScore')
+
+# Counts the calls to and the time spent in methods of one board
+#    profiler = Profiler(board)
+#    board.findBestMove()
+#    print(profiler.report())
+#    profiler.detach()
+# The timing wrappers are attributes of that board only, so other boards and a detached board pay nothing
+class Profiler():
+
+    def __init__(self, board, names = PROFILED_METHODS):
+        self.board = board
+        self.names = tuple(names)
+        self.calls = dict.fromkeys(self.names, 0)
+        self.seconds = dict.fromkeys(self.names, 0.0)
+        for name in self.names:
+            setattr(board, name, self._timed(name, getattr(board, name)))
+        board.profiler = self
+
+    def _timed(self, name, method):
+        calls = self.calls
+        seconds = self.seconds
+        clock = time.perf_counter
+
+        def timed(*args, **kwargs):
+            begin = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                seconds[name] += clock() - begin
+                calls[name] += 1
+        return timed
+
+    def reset(self):
+        for name in self.names:
+            self.calls[name] = 0
+            self.seconds[name] = 0.0
+
+    def detach(self):
+        for name in self.names:
+            delattr(self.board, name)
+        self.board.profiler = None
+
+    # One line per method, most time first
+    def report(self):
+        lines = []
+        for name in sorted(self.names, key = lambda name: self.seconds[name], reverse = True):
+            calls = self.calls[name]
+            perCall = self.seconds[name] / calls * 1e6 if calls else 0.0
+            lines.append("%-18s %10d calls %9.3fs %9.2fus/call" % (name, calls, self.seconds[name], perCall))
+        return "\n".join(lines)
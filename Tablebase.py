@@ -0,0 +1,228 @@
+import mmap
+from ChessBoard import (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, BLACK, COLOR_MASK, TYPE_MASK, MATE_SCORE,
+                        KING_TARGETS, ROOK_RAYS, QUEEN_RAYS, PAWN_CAPTURES)
+
+# Endgame tablebases for king and queen, king and rook, and king and pawn against a lone king
+#    python maketablebases.py # Writes tablebases.bin, takes a few seconds
+#    board.tablebases = Tablebases("tablebases.bin")
+# The tables are made by retrograde analysis: starting from the checkmates, every position the
+# stronger side can reach a lost position from is won one ply further from mate, and every position
+# where all of the weaker side's moves reach won positions is lost.
+# Each table has one byte per position: 0 for a draw (or an impossible position), otherwise
+# 1 + the number of plies to mate with best play. The stronger side is White in the tables, positions
+# with Black as the stronger side are looked up with the board mirrored.
+
+TABLES = (QUEEN, ROOK, PAWN) # Order of the tables in the file, by the stronger side's piece
+TABLE_NAMES = {QUEEN: "KQK", ROOK: "KRK", PAWN: "KPK"}
+TABLE_SIZE = 2 * 64 * 64 * 64 # Side to move, then the stronger king, weaker king and piece squares
+MAGIC = b"CBTB\x01\x00\x00\x00" # File header, the last four bytes are the version and padding
+FILE_SIZE = len(MAGIC) + len(TABLES) * TABLE_SIZE
+
+# Index of a position, strongToMove says whether the stronger side is to move
+def tableIndex(strongToMove, strongKing, weakKing, pieceSq):
+    return (((0 if strongToMove else 1) * 64 + strongKing) * 64 + weakKing) * 64 + pieceSq
+
+_adjacent = [frozenset(targets) for targets in KING_TARGETS]
+
+# Squares the stronger side's piece on pieceSq attacks with its king on kingSq in the way
+# The weaker king is left out, it does not block the squares behind it from itself
+_attackCache = {}
+def _attacks(pieceType, pieceSq, kingSq):
+    key = (pieceType, pieceSq, kingSq)
+    attacked = _attackCache.get(key)
+    if attacked is None:
+        if pieceType == PAWN:
+            attacked = frozenset(PAWN_CAPTURES[WHITE][pieceSq])
+        else:
+            squares = set()
+            for ray in (QUEEN_RAYS if pieceType == QUEEN else ROOK_RAYS)[pieceSq]:
+                for sq in ray:
+                    if sq == kingSq:
+                        break
+                    squares.add(sq)
+            attacked = frozenset(squares)
+        _attackCache[key] = attacked
+    return attacked
+
+# Whether the pieces can stand on these squares, with either side to move
+def _possible(pieceType, strongKing, weakKing, pieceSq):
+    if len({strongKing, weakKing, pieceSq}) < 3 or weakKing in _adjacent[strongKing]:
+        return False
+    return pieceType != PAWN or 1 <= pieceSq >> 3 <= 6 # No pawns on the first or last rank
+
+# Squares the weaker king can move to, and whether it can take the piece
+def _weakKingMoves(pieceType, strongKing, weakKing, pieceSq):
+    attacked = _attacks(pieceType, pieceSq, strongKing)
+    moves = []
+    captures = False
+    for sq in KING_TARGETS[weakKing]:
+        if sq in _adjacent[strongKing] or sq == strongKing:
+            continue
+        if sq == pieceSq:
+            captures = True # Leaves a drawn king against king
+        elif sq not in attacked:
+            moves.append(sq)
+    return moves, captures
+
+# Positions with the stronger side to move that have a move to (strongKing, weakKing, pieceSq)
+def _strongPredecessors(pieceType, strongKing, weakKing, pieceSq):
+    predecessors = []
+    for sq in KING_TARGETS[strongKing]: # The king came from sq
+        if sq != pieceSq and sq != weakKing and sq not in _adjacent[weakKing]:
+            predecessors.append((sq, pieceSq))
+    if pieceType == PAWN:
+        sq = pieceSq + 8 # Pawns move up the board, towards row 0
+        if sq >> 3 <= 6 and sq != strongKing and sq != weakKing:
+            predecessors.append((strongKing, sq))
+            if pieceSq >> 3 == 4 and sq + 8 not in (strongKing, weakKing): # A two square advance
+                predecessors.append((strongKing, sq + 8))
+    else:
+        for ray in (QUEEN_RAYS if pieceType == QUEEN else ROOK_RAYS)[pieceSq]:
+            for sq in ray:
+                if sq == strongKing or sq == weakKing:
+                    break
+                predecessors.append((strongKing, sq))
+    # Before the move it was the stronger side's turn, so the weaker king was not in check
+    return [tableIndex(True, king, weakKing, piece) for king, piece in predecessors
+            if weakKing not in _attacks(pieceType, piece, king)]
+
+# Positions with the weaker side to move that have a king move to weakKing
+def _weakPredecessors(pieceType, strongKing, weakKing, pieceSq):
+    return [tableIndex(False, strongKing, sq, pieceSq) for sq in KING_TARGETS[weakKing]
+            if sq != strongKing and sq != pieceSq and sq not in _adjacent[strongKing]]
+
+# The table for the stronger side's pieceType as a bytearray
+# promotionTables maps QUEEN and ROOK to their finished tables, needed for the pawn's
+def generateTable(pieceType, promotionTables = None):
+    table = bytearray(TABLE_SIZE)
+    moveCounts = bytearray(TABLE_SIZE // 2) # Weaker side's moves not yet known to lose, by index - TABLE_SIZE // 2
+    layers = {0: []} # Positions by their number of plies to mate
+    promotions = {} # Positions won by promoting, by their number of plies to mate
+    for strongKing in range(64):
+        for weakKing in range(64):
+            for pieceSq in range(64):
+                if not _possible(pieceType, strongKing, weakKing, pieceSq):
+                    continue
+                inCheck = weakKing in _attacks(pieceType, pieceSq, strongKing)
+                index = tableIndex(False, strongKing, weakKing, pieceSq)
+                moves, captures = _weakKingMoves(pieceType, strongKing, weakKing, pieceSq)
+                if captures:
+                    moveCounts[index - TABLE_SIZE // 2] = 255 # Never lost, taking the piece draws
+                elif moves:
+                    moveCounts[index - TABLE_SIZE // 2] = len(moves)
+                elif inCheck: # Checkmate, no moves and stalemate are draws
+                    table[index] = 1
+                    layers[0].append(index)
+                # Promotions lead into the other tables, a won promotion seeds the search
+                if pieceType == PAWN and pieceSq >> 3 == 1 and pieceSq - 8 not in (strongKing, weakKing) and not inCheck:
+                    plies = [promotionTables[piece][tableIndex(False, strongKing, weakKing, pieceSq - 8)]
+                             for piece in (QUEEN, ROOK)]
+                    plies = [value for value in plies if value] # value - 1 plies to mate after promoting
+                    if plies:
+                        promotions.setdefault(min(plies), []).append(tableIndex(True, strongKing, weakKing, pieceSq))
+
+    plies = 0
+    while layers or promotions:
+        layer = layers.pop(plies, [])
+        for index in promotions.pop(plies, []):
+            if table[index] == 0: # Unless the retrograde search found a win as fast
+                table[index] = plies + 1
+                layer.append(index)
+        strongToMove = plies % 2 == 1 # The stronger side mates, so its wins are an odd number of plies away
+        for index in layer:
+            pieceSq = index & 63
+            weakKing = index >> 6 & 63
+            strongKing = index >> 12 & 63
+            if strongToMove: # Won, the weaker side's moves to it lose
+                for predecessor in _weakPredecessors(pieceType, strongKing, weakKing, pieceSq):
+                    count = predecessor - TABLE_SIZE // 2
+                    if table[predecessor] == 0 and moveCounts[count] != 255:
+                        moveCounts[count] -= 1
+                        if moveCounts[count] == 0:
+                            table[predecessor] = plies + 2
+                            layers.setdefault(plies + 1, []).append(predecessor)
+            else: # Lost, any move of the stronger side to it wins
+                for predecessor in _strongPredecessors(pieceType, strongKing, weakKing, pieceSq):
+                    if table[predecessor] == 0:
+                        table[predecessor] = plies + 2
+                        layers.setdefault(plies + 1, []).append(predecessor)
+        plies += 1
+        if plies >= 254:
+            raise ValueError("Mate too long to store")
+    return table
+
+# Generates every table and writes the tablebase file to path
+def writeTablebases(path, progress = None):
+    tables = {}
+    for pieceType in (QUEEN, ROOK, PAWN): # The pawn's table needs the others for its promotions
+        tables[pieceType] = generateTable(pieceType, tables)
+        if progress is not None:
+            progress(TABLE_NAMES[pieceType])
+    with open(path, "wb") as file:
+        file.write(MAGIC)
+        for pieceType in TABLES:
+            file.write(tables[pieceType])
+
+# The tablebase file read through mmap, probing a position reads one byte
+class Tablebases():
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        if len(self.map) != FILE_SIZE or self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("Not a tablebase file: " + path)
+        self.offsets = {pieceType: len(MAGIC) + i * TABLE_SIZE for i, pieceType in enumerate(TABLES)}
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    # Tablebases go to another process (e.g. with a pickled Board) as their path and are opened again there
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    # Score of board for the side to move as negamax gives it at ply, None if the position is not in the tables
+    def probe(self, board, ply = 0):
+        white, black = board.whitePieces, board.blackPieces
+        if white['P'] + white['N'] + white['B'] + white['R'] + white['Q'] + \
+           black['P'] + black['N'] + black['B'] + black['R'] + black['Q'] > 1 or board.castlingRights:
+            return None
+        squares = board.squares
+        pieceSq = None
+        for sq in range(64):
+            piece = squares[sq]
+            if piece and piece & TYPE_MASK != KING:
+                pieceSq = sq
+                break
+        if pieceSq is None or squares[pieceSq] & TYPE_MASK in (KNIGHT, BISHOP): # No mate possible
+            return 0
+        piece = squares[pieceSq]
+        strong = piece & COLOR_MASK
+        strongKing = board.kingSquares[strong]
+        weakKing = board.kingSquares[strong ^ COLOR_MASK]
+        if strong == BLACK: # Mirrored so the stronger side plays up the board like White
+            strongKing, weakKing, pieceSq = strongKing ^ 56, weakKing ^ 56, pieceSq ^ 56
+        strongToMove = board.whitesMove == (strong == WHITE)
+        value = self.map[self.offsets[piece & TYPE_MASK] + tableIndex(strongToMove, strongKing, weakKing, pieceSq)]
+        if value == 0:
+            return 0
+        mateScore = MATE_SCORE - ply - (value - 1)
+        return mateScore if strongToMove else -mateScore
+
+    # (packed move, score) of the fastest win or slowest loss on board, None if the position is not in the tables
+    def bestMove(self, board):
+        if self.probe(board) is None:
+            return None
+        best, bestScore = None, None
+        for move in board.getLegalMoves():
+            board.pushMove(move)
+            score = - self.probe(board, 1)
+            board.popMove()
+            if bestScore is None or score > bestScore:
+                best, bestScore = move, score
+        return None if best is None else (best, bestScore)
@@ -0,0 +1,34 @@
+# How long to search a move for under a chess clock
+# A search gets two limits: past the soft limit no new iteration is started, since it would most likely
+# not finish, and at the hard limit the running iteration is abandoned. Times are in seconds.
+
+MOVE_OVERHEAD = 0.05 # Kept back for the GUI to receive the move
+DEFAULT_MOVES_TO_GO = 30 # Moves the remaining time is shared between when the time control does not say
+INCREMENT_SHARE = 0.75 # Part of the increment spent on each move
+SOFT_SHARE = 0.6 # Soft limit as a part of the move's budget
+HARD_FACTOR = 2.5 # Hard limit as a multiple of the move's budget...
+MAX_TIME_SHARE = 0.5 # ...but never more than this part of the clock
+MIN_TIME = 0.01
+
+class TimeManager():
+
+    # moveTime fixes the time for the move, otherwise timeLeft, increment and movesToGo describe the clock of
+    # the side to move; with neither there is no time limit
+    # nodes limits the number of nodes searched, approximately
+    def __init__(self, timeLeft = None, increment = 0.0, movesToGo = None, moveTime = None, nodes = None):
+        self.nodeLimit = nodes
+        if moveTime is not None:
+            self.softLimit = self.hardLimit = max(moveTime - MOVE_OVERHEAD, MIN_TIME)
+        elif timeLeft is not None:
+            available = max(timeLeft - MOVE_OVERHEAD, MIN_TIME)
+            budget = available / (movesToGo or DEFAULT_MOVES_TO_GO) + increment * INCREMENT_SHARE
+            self.hardLimit = max(min(budget * HARD_FACTOR, available * MAX_TIME_SHARE), MIN_TIME)
+            self.softLimit = min(budget * SOFT_SHARE, self.hardLimit)
+        else:
+            self.softLimit = self.hardLimit = None
+
+    # (soft deadline, hard deadline) in time.time() for a search started at start, None where there is no limit
+    def deadlines(self, start):
+        soft = start + self.softLimit if self.softLimit is not None else None
+        hard = start + self.hardLimit if self.hardLimit is not None else None
+        return soft, hard
@@ -0,0 +1,55 @@
+# Fixed size hash table of searched positions, indexed by the low bits of the Zobrist key
+# Every field lives in its own preallocated list so storing an entry never allocates
+
+DEFAULT_SIZE = 1 << 18 # Number of entries, must be a power of two
+
+# Bound types, describe how the stored score relates to the true score
+EXACT = 0 # Score is exact
+LOWER = 1 # Search failed high, true score >= score
+UPPER = 2 # Search failed low, true score <= score
+
+class TranspositionTable():
+
+    def __init__(self, size = DEFAULT_SIZE):
+        if size <= 0 or size & (size - 1):
+            raise ValueError("Transposition table size must be a power of two")
+        self.size = size
+        self.mask = size - 1
+        self.keys = [None] * size
+        self.depths = [0] * size
+        self.bounds = [EXACT] * size
+        self.scores = [0] * size
+        self.moves = [None] * size
+        self.ages = [0] * size
+        self.age = 0
+
+    # Called once per findBestMove so entries from older searches become the first to be replaced
+    def newSearch(self):
+        self.age += 1
+
+    def clear(self):
+        self.__init__(self.size)
+
+    # Returns (depth, bound, score, bestMove) for the position, or None if it is not stored
+    def probe(self, key):
+        index = key & self.mask
+        if self.keys[index] != key:
+            return None
+        return self.depths[index], self.bounds[index], self.scores[index], self.moves[index]
+
+    # Replacement policy: an entry from the current search is only overwritten by one searched at least as deep
+    # Entries from older searches and entries for the same position are always replaced
+    def store(self, key, depth, bound, score, move):
+        index = key & self.mask
+        storedKey = self.keys[index]
+        if storedKey == key:
+            if move is None: # Keep the old best move rather than forgetting it
+                move = self.moves[index]
+        elif storedKey is not None and self.ages[index] == self.age and self.depths[index] > depth:
+            return
+        self.keys[index] = key
+        self.depths[index] = depth
+        self.bounds[index] = bound
+        self.scores[index] = score
+        self.moves[index] = move
+        self.ages[index] = self.age
@@ -0,0 +1,151 @@
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import ChessBoard
+from TimeManager import TimeManager
+
+# Batch analysis of the positions in an EPD (or FEN) file
+#    python analyze.py positions.epd --depth 5 --output results.jsonl
+# The file is read lazily and only a bounded number of positions are in flight at a time, so the size of the
+# file does not matter. Results are written as one JSON object per line in the order of the input.
+
+# Positions in flight per worker, enough to keep every worker busy while results are written in order
+PENDING_PER_WORKER = 4
+
+# Splits an EPD line into a FEN and its operations, e.g. {"bm": ["Nf3"], "id": ["\"test 1\""]}
+# The halfmove clock and fullmove number of a FEN line are kept, EPD has hmvc and fmvn operations for them
+def parseEpd(line):
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("EPD needs at least 4 fields: " + line.strip())
+    fen = fields[:4]
+    operations = {}
+    rest = fields[4] if len(fields) > 4 else ""
+    counters = rest.split()[:2]
+    if len(counters) == 2 and all(counter.isdigit() for counter in counters): # Plain FEN
+        return " ".join(fen + counters), operations
+    for operation in rest.split(';'):
+        tokens = operation.split()
+        if tokens:
+            operations[tokens[0]] = tokens[1:]
+    halfmoveClock = operations.get("hmvc", ["0"])[0]
+    fullmoveNumber = operations.get("fmvn", ["1"])[0]
+    return " ".join(fen + [halfmoveClock, fullmoveNumber]), operations
+
+# The board a worker process analyzes every position on, created once per process
+_board = None
+
+def _initWorker(depth, moveTime):
+    global _board
+    _board = ChessBoard.Board()
+    _board.printProgress = False
+    _board.INTIAL_DEPTH = 1
+    _board.MAX_DEPTH = depth
+    _board.timeManager = TimeManager(moveTime = moveTime)
+
+# Runs in a worker process, returns the result for one line of the input
+def analyzePosition(lineNumber, line):
+    result = {"line": lineNumber}
+    try:
+        fen, operations = parseEpd(line)
+        _board.loadFen(fen)
+    except (ValueError, KeyError, IndexError) as error:
+        result["error"] = str(error)
+        return result
+    result["fen"] = fen
+    if "id" in operations:
+        result["id"] = " ".join(operations["id"]).strip('"')
+    # Fresh tables and move ordering for every position, so a result does not depend on what the worker analyzed before
+    _board.clearSearchTables()
+    start = time.perf_counter()
+    move = _board.findBestMove()
+    result["time"] = round(time.perf_counter() - start, 4)
+    result["nodes"] = _board.nodesSearched
+    if move is None:
+        legalMoves = _board.getValidMoves()
+        if not legalMoves:
+            result["bestmove"] = None
+            result["result"] = "checkmate" if _board.checkMate else "stalemate"
+            return result
+        # The time or node limit came before the first depth finished, the first legal move stands in
+        move = legalMoves[0]
+        result["incomplete"] = True
+    result["bestmove"] = move.getChessNotation()
+    result["san"] = _board.getSan(move)
+    result["depth"] = _board.searchStatistics[-1].depth if _board.searchStatistics else 0
+    score = _board.globalBestScore # None without a completed depth
+    if score is not None:
+        if score >= ChessBoard.MATE_BOUND: # Moves to mate, negative when being mated
+            result["mate"] = (ChessBoard.MATE_SCORE - score + 1) // 2
+        elif score <= -ChessBoard.MATE_BOUND:
+            result["mate"] = -((ChessBoard.MATE_SCORE + score) // 2)
+        else:
+            result["score"] = score
+    pv = []
+    for packed in _board.getPrincipalVariation():
+        pv.append(ChessBoard.Move.fromPacked(packed, _board.squares).getChessNotation())
+        _board.pushMove(packed)
+    for notation in pv:
+        _board.popMove()
+    result["pv"] = pv
+    if "bm" in operations: # Test suite position, was the expected move found
+        result["bm"] = operations["bm"]
+        result["solved"] = result["san"].rstrip("+#") in [san.rstrip("+#") for san in operations["bm"]]
+    return result
+
+# (line number, line) for every position in the file, read lazily
+def readPositions(file):
+    for lineNumber, line in enumerate(file, 1):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield lineNumber, line
+
+# Analyzes every position of the input and writes the results in input order as JSON lines
+# Returns the number of positions analyzed
+def analyzeFile(input, output, depth, moveTime = None, workers = None):
+    workers = workers or os.cpu_count() or 1
+    pending = collections.deque()
+    count = 0
+    with ProcessPoolExecutor(max_workers = workers, initializer = _initWorker, initargs = (depth, moveTime)) as pool:
+        for lineNumber, line in readPositions(input):
+            pending.append(pool.submit(analyzePosition, lineNumber, line))
+            if len(pending) >= workers * PENDING_PER_WORKER: # Wait for the oldest before reading further
+                output.write(json.dumps(pending.popleft().result()) + "\n")
+                count += 1
+        while pending:
+            output.write(json.dumps(pending.popleft().result()) + "\n")
+            count += 1
+    output.flush()
+    return count
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Analyze every position of an EPD or FEN file")
+    parser.add_argument("input", help = "EPD or FEN file, one position per line, - for stdin")
+    parser.add_argument("--output", default = "-", help = "JSON lines file to write, - for stdout")
+    parser.add_argument("--depth", type = int, default = 5)
+    parser.add_argument("--movetime", type = float, help = "seconds per position")
+    parser.add_argument("--workers", type = int, default = os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+    if args.depth < 1:
+        parser.error("--depth must be at least 1")
+
+    input = sys.stdin if args.input == "-" else open(args.input)
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        start = time.time()
+        count = analyzeFile(input, output, args.depth, args.movetime, args.workers)
+        seconds = time.time() - start
+        print("Analyzed %d positions in %.1fs" % (count, seconds), file = sys.stderr)
+    finally:
+        if input is not sys.stdin:
+            input.close()
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
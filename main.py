@@ -1,36 +1,59 @@
 import pygame as pyg
 from pygame import gfxdraw
 import ChessBoard
-import sys 
-sys.setrecursionlimit(5000) 
+import EngineWorker
+import collections
+import os
+from OpeningBook import OpeningBook
+from Tablebase import Tablebases
+from SearchCache import SearchCache
 
 WIDTH = HEIGHT = 600
 DIMENSION = 8
 MAX_FPS = 60
 SQUARE_SIZE = 75
-IMAGES = {}
-CLICK = False
+PONDER = True # Let the engine think during the player's turn in vs AI games
+BOOK_FILE = "book.bin" # Opening book the AI plays from when the file exists, see makebook.py
+TABLEBASE_FILE = "tablebases.bin" # Endgame tablebases the AI uses when the file exists, see maketablebases.py
+# The AI keeps its search results here from one game to the next when the file exists,
+# an empty file to start with is enough (e.g. touch searchcache.bin)
+SEARCH_CACHE_FILE = "searchcache.bin"
+MOVE_CACHE_SIZE = 256 # Positions whose legal moves are kept, see LegalMoveCache
+IMAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images')
+PIECES = ["wR", "wN", "wB", "wQ", "wK", "wP", "bR", "bN", "bB", "bQ", "bK", "bP"]
+IMAGES = {} # Piece images by name, views into the atlas, filled by load_assets
+ASSETS = {} # The board image and the piece atlas once they are loaded
+# Events after which the window's contents may be lost, the WINDOW ones only exist in newer pygame versions
+REDRAW_EVENTS = tuple(getattr(pyg, name) for name in ('VIDEOEXPOSE', 'VIDEORESIZE', 'WINDOWEXPOSED', 'WINDOWSHOWN',
+                                                      'WINDOWRESTORED', 'WINDOWRESIZED') if hasattr(pyg, name))
 
 # Main driver of the chess engine
-def main(window, clock, versusPlayer):
+# engineFiles maps Board attributes to the open engine files given to every game, see open_engine_files
+def main(window, clock, versusPlayer, engineFiles):
     if versusPlayer:
         pyg.display.set_caption('vs Player')
     else:
         pyg.display.set_caption('vs AI')
-    game = ChessBoard.Board() # creating the 2D list representation of the chess board
-    validMoves = game.getValidMoves()
+    game = new_game(engineFiles) # creating the 2D list representation of the chess board
+    legalMoves = LegalMoveCache()
+    validMoves, movesFrom = legalMoves.get(game) # movesFrom has the valid moves by start square
     moveMade = False # Boolean when a move is made so validMoves does not prematurely makes the appropriate moves
-    create_chess_pieces() 
+    renderer = Renderer(window)
     running = True
     squareSelected = () # Will keep track of the last click of the user
     playerClicks = [] # Keep track of player clicks in (row, col) format i.e. [(1, 2), (1, 4)]
     gameOver = False
+    aiSearch = None # Handle of the engine's background search while it is the AI's turn
+    shownDepth = 0 # Search depth currently shown in the window caption
     while running:
+        humanTurn = versusPlayer or game.whitesMove
         for event in pyg.event.get():
             if event.type == pyg.QUIT:
                 running = False
+            elif event.type in REDRAW_EVENTS:
+                renderer.redraw_all()
             elif event.type == pyg.MOUSEBUTTONDOWN:
-                if not gameOver:
+                if not gameOver and humanTurn:
                     location = pyg.mouse.get_pos()
                     col = location[0] // SQUARE_SIZE
                     row = location[1] // SQUARE_SIZE
@@ -43,22 +66,31 @@ def main(window, clock, versusPlayer):
                     if len(playerClicks) == 2: # Player clicked two different squares
                         move = ChessBoard.Move(playerClicks[0], playerClicks[1], game.board)
                         # print(move.getChessNotation())
-                        for i in range(len(validMoves)):
-                            if move == validMoves[i]:
-                                game.makeMove(validMoves[i])
+                        for validMove in movesFrom.get(move.startSq, ()):
+                            if move == validMove:
+                                game.makeMove(validMove)
                                 # game.computeScore()
                                 moveMade = True
+                                # Pondering on the move just played means the AI's search is already running
+                                if aiSearch is not None and aiSearch.ponderMove != validMove:
+                                    aiSearch.cancel()
+                                    aiSearch = None
                                 squareSelected = ()
                                 playerClicks = []
+                                break
                         if not moveMade: # Invalid second click/Move i.e (second click on friendly piece)
                             playerClicks = [squareSelected]
             elif event.type == pyg.KEYDOWN:
+                if event.key in (pyg.K_u, pyg.K_r, pyg.K_ESCAPE) and aiSearch is not None: # Stop the AI thinking
+                    aiSearch.cancel()
+                    aiSearch = None
+                    pyg.display.set_caption('vs AI')
                 if event.key == pyg.K_u: # Undo when u is pressed
                     game.undoMove()
                     moveMade = True
                 if event.key == pyg.K_r: # Reset game when r is pressed 
-                    game = ChessBoard.Board()
-                    validMoves = game.getValidMoves()
+                    game = new_game(engineFiles)
+                    validMoves, movesFrom = legalMoves.get(game)
                     squareSelected = ()
                     playerClicks = []
                     moveMade = False
@@ -67,38 +99,84 @@ def main(window, clock, versusPlayer):
 
             
         if moveMade:
-            validMoves = game.getValidMoves()
+            validMoves, movesFrom = legalMoves.get(game)
             moveMade = False
 
-        if not gameOver:
-            draw_game(window, game, validMoves, squareSelected, game.movesLog)
-        
-
+        text = None
         if game.checkMate:
             gameOver = True
             if game.whitesMove:
-                draw_text(window, 'Black Wins By Checkmate')
+                text = 'Black Wins By Checkmate'
             else:
-                draw_text(window, 'White Wins By Checkmate')
+                text = 'White Wins By Checkmate'
         elif game.staleMate:
             gameOver = True
-            draw_text(window, 'Stalemate')
+            text = 'Stalemate'
+        renderer.draw(game, movesFrom, squareSelected, text)
 
-        if not versusPlayer and not game.whitesMove:
-            game.aiMove()
-            moveMade = True
+        # The engine searches on a background thread, so the window keeps drawing and handling events meanwhile
+        if not versusPlayer and game.whitesMove and not gameOver and PONDER and aiSearch is None and not moveMade:
+            aiSearch = EngineWorker.startPonder(game)
+        elif not versusPlayer and not game.whitesMove and not gameOver:
+            if aiSearch is None:
+                aiSearch = EngineWorker.startSearch(game)
+                shownDepth = 0
+            elif aiSearch.done():
+                aiMove = aiSearch.result() or validMoves[0] # First move if not even the first depth finished
+                aiSearch = None
+                for validMove in movesFrom.get(aiMove.startSq, ()):
+                    if validMove == aiMove:
+                        game.makeMove(validMove)
+                        break
+                moveMade = True
+                pyg.display.set_caption('vs AI')
+            elif aiSearch.depth != shownDepth: # Show the search's progress
+                shownDepth = aiSearch.depth
+                pyg.display.set_caption('vs AI - thinking, depth ' + str(shownDepth) + ' best ' +
+                                        aiSearch.bestMove.getChessNotation())
 
         clock.tick(MAX_FPS)
-        pyg.display.flip()
 
+    if aiSearch is not None:
+        aiSearch.cancel() # Waits for the search, nothing uses the engine files after this
+
+def new_game(engineFiles):
+    game = ChessBoard.Board()
+    for name, engineFile in engineFiles.items():
+        setattr(game, name, engineFile)
+    return game
+
+# Opens the engine files that exist, once for every game played. A file that cannot be opened is left out
+def open_engine_files():
+    engineFiles = {}
+    for name, path, opener in (('openingBook', BOOK_FILE, OpeningBook), ('tablebases', TABLEBASE_FILE, Tablebases),
+                               ('searchCache', SEARCH_CACHE_FILE, SearchCache)):
+        if os.path.exists(path):
+            try:
+                engineFiles[name] = opener(path)
+            except (OSError, ValueError) as error:
+                print("Cannot open " + path + ": " + str(error))
+    return engineFiles
+
+def close_engine_files(engineFiles):
+    for engineFile in engineFiles.values():
+        engineFile.close()
 
 def main_menu():
     pyg.init()
     window = pyg.display.set_mode((WIDTH, HEIGHT))
     clock = pyg.time.Clock()
-    running = True
     font = pyg.font.SysFont('Arial', 25)
     pyg.display.set_caption('Main Menu')
+    engineFiles = open_engine_files()
+    try:
+        run_menu(window, clock, font, engineFiles)
+    finally:
+        close_engine_files(engineFiles)
+
+def run_menu(window, clock, font, engineFiles):
+    running = True
+    CLICK = False
     while running:       
         window.fill((0, 0, 0))
         mx, my = pyg.mouse.get_pos()
@@ -106,10 +184,10 @@ def main_menu():
         button_2 = pyg.Rect(235, 300, 125, 50)
         if button_1.collidepoint((mx, my)):
             if CLICK:
-                main(window, clock, True)
+                main(window, clock, True, engineFiles)
         if button_2.collidepoint((mx, my)):
             if CLICK:  
-                main(window, clock, False)
+                main(window, clock, False, engineFiles)
         pyg.draw.rect(window, (255, 255 , 255), button_1)
         pyg.draw.rect(window, (255, 255 , 255), button_2)
         window.blit(font.render("vs Player", True, (0, 0, 0)), (260, 210))
@@ -127,96 +205,139 @@ def main_menu():
 
                 
     
-# Highlight king if in check
-def highlight_king(screen, game):
-    if game.inCheck():
-        if game.whitesMove:
-            row, col = game.whiteKingLocation
-        else: 
-            row, col = game.blackKingLocation
-        s = pyg.Surface((SQUARE_SIZE, SQUARE_SIZE)) # Highlight square
-        s.set_alpha(125) # Transparency value (0 - 255)
-        s.fill(pyg.Color('red'))
-        screen.blit(s, (col * SQUARE_SIZE, row * SQUARE_SIZE))
-
-# Highlight moves for piece selected
-def highlight_squares(screen, game, validMoves, squareSelected, movesLog):
-    
-    squares = pyg.Surface((SQUARE_SIZE, SQUARE_SIZE)) # Highlight square
-    squares.set_alpha(100) # Transparency value (0 - 255)
-
-    # Highlight last move
-    if len(movesLog) > 0:
-        squares.fill(pyg.Color('yellow'))
-        last_move = movesLog.pop()
-        screen.blit(squares, (SQUARE_SIZE * last_move.startCol, SQUARE_SIZE * last_move.startRow))
-        screen.blit(squares, (SQUARE_SIZE * last_move.endCol, SQUARE_SIZE * last_move.endRow))
-        movesLog.append(last_move)
-
-    if squareSelected != ():
-        row, col = squareSelected
-        if game.board[row][col][0] == ('w' if game.whitesMove else 'b'): # Square selected is a piece we can move
-            squares.fill(pyg.Color('blue'))
-            screen.blit(squares, (col * SQUARE_SIZE, row * SQUARE_SIZE))
-             # squares.fill(pyg.Color('dark green')) # Highlight moves from that square
-            for move in validMoves:
-                if move.startRow == row and move.startCol == col:
-                    squares.fill(pyg.Color('red'))
-                    squares.set_alpha(150)
-                    if game.whitesMove:
-                        if game.board[move.endRow][move.endCol][0] == 'b':
-                            screen.blit(squares, (move.endCol * SQUARE_SIZE, move.endRow * SQUARE_SIZE))
-                        elif game.board[move.endRow][move.endCol] == '--':
-                            draw_circle(screen, SQUARE_SIZE * move.endCol + (75 // 2),
-                                       SQUARE_SIZE * move.endRow + (75 // 2), 8, (0, 85, 0, 175))
+# Draws the game, redrawing and updating only the squares whose contents changed since the last frame
+# The scaled board and the highlights are made once, and a frame where nothing changed draws nothing
+class Renderer():
+
+    def __init__(self, window):
+        self.window = window
+        self.boardImage = load_assets()['board']
+        self.lastMoveHighlight = make_highlight('yellow', 100)
+        self.selectedHighlight = make_highlight('blue', 100)
+        self.captureHighlight = make_highlight('red', 150)
+        self.checkHighlight = make_highlight('red', 125)
+        self.moveDot = pyg.Surface((SQUARE_SIZE, SQUARE_SIZE), pyg.SRCALPHA)
+        draw_circle(self.moveDot, SQUARE_SIZE // 2, SQUARE_SIZE // 2, 8, (0, 85, 0, 175))
+        self.font = pyg.font.SysFont('Helvetica', 32, True, False)
+        self.shown = [None] * 64 # (piece, highlights) each square shows in the window, None before it is drawn
+        self.shownText = None
+
+    # (piece, highlights) for every square, the highlights in the order they are drawn
+    def square_contents(self, game, movesFrom, squareSelected):
+        squares = game.squares
+        highlights = [() for sq in range(64)]
+        if game.inCheck(): # King in check
+            king = game.kingSquares[ChessBoard.WHITE if game.whitesMove else ChessBoard.BLACK]
+            highlights[king] += (self.checkHighlight,)
+        if game.movesLog: # Last move
+            lastMove = game.movesLog[-1]
+            highlights[lastMove.startSq] += (self.lastMoveHighlight,)
+            highlights[lastMove.endSq] += (self.lastMoveHighlight,)
+        if squareSelected != ():
+            row, col = squareSelected
+            selected = row * 8 + col
+            piece = squares[selected]
+            if piece and (piece & ChessBoard.COLOR_MASK == ChessBoard.WHITE) == game.whitesMove: # A piece we can move
+                highlights[selected] += (self.selectedHighlight,)
+                for move in movesFrom.get(selected, ()): # Captures in red, moves to empty squares with a dot
+                    if squares[move.endSq] == ChessBoard.EMPTY:
+                        highlights[move.endSq] += (self.moveDot,)
                     else:
-                        if game.board[move.endRow][move.endCol][0] == 'w':
-                            screen.blit(squares, (move.endCol * SQUARE_SIZE, move.endRow * SQUARE_SIZE))
-                        elif game.board[move.endRow][move.endCol] == '--':
-                            draw_circle(screen, SQUARE_SIZE * move.endCol + (75 // 2),
-                                       SQUARE_SIZE * move.endRow + (75 // 2), 8, (0, 85, 0, 175))
-                    # screen.blit(squares, (SQUARE_SIZE * move.endCol, SQUARE_SIZE * move.endRow))
-                    
+                        highlights[move.endSq] += (self.captureHighlight,)
+        return [(squares[sq], highlights[sq]) for sq in range(64)]
 
+    # Draws what changed since the last call, text is shown over the middle of the board
+    def draw(self, game, movesFrom, squareSelected, text = None):
+        contents = self.square_contents(game, movesFrom, squareSelected)
+        if text != self.shownText: # Text covers several squares, all of them are drawn again
+            self.shown = [None] * 64
+        dirty = []
+        for sq in range(64):
+            if contents[sq] != self.shown[sq]:
+                dirty.append(self.draw_square(sq, *contents[sq]))
+        if not dirty:
+            return
+        if text is not None:
+            dirty.append(draw_text(self.window, text, self.font))
+        self.shown = contents
+        self.shownText = text
+        pyg.display.update(dirty)
+
+    # The next draw draws every square, for when the window lost what was drawn in it
+    def redraw_all(self):
+        self.shown = [None] * 64
+
+    def draw_square(self, sq, piece, highlights):
+        row, col = divmod(sq, 8)
+        rect = pyg.Rect(col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+        self.window.blit(self.boardImage, rect, rect)
+        for highlight in highlights:
+            self.window.blit(highlight, rect)
+        if piece:
+            self.window.blit(IMAGES[ChessBoard.PIECE_NAMES[piece]], rect)
+        return rect
+
+# Valid moves of the positions seen lately, so going back to one (undo, reset) does not generate them again
+# Keyed by the position's Zobrist key, the least recently used position is dropped when it is full
+class LegalMoveCache():
+
+    def __init__(self, capacity = MOVE_CACHE_SIZE):
+        self.capacity = capacity
+        self.positions = collections.OrderedDict() # key -> (validMoves, movesFrom, checkMate, staleMate)
+
+    # (validMoves, movesFrom) of game's position, movesFrom maps a start square to the valid moves from it
+    # Sets game.checkMate and game.staleMate like getValidMoves
+    def get(self, game):
+        key = game.zobristKey
+        entry = self.positions.get(key)
+        if entry is None:
+            validMoves = game.getValidMoves()
+            movesFrom = {}
+            for move in validMoves:
+                movesFrom.setdefault(move.startSq, []).append(move)
+            entry = (validMoves, movesFrom, game.checkMate, game.staleMate)
+            self.positions[key] = entry
+            if len(self.positions) > self.capacity:
+                self.positions.popitem(last = False)
+        else:
+            self.positions.move_to_end(key)
+            game.checkMate, game.staleMate = entry[2], entry[3]
+        return entry[0], entry[1]
+
+def make_highlight(color, alpha):
+    surface = pyg.Surface((SQUARE_SIZE, SQUARE_SIZE))
+    surface.set_alpha(alpha) # Transparency value (0 - 255)
+    surface.fill(pyg.Color(color))
+    return surface
+
+# Loads the images the first time a game is drawn and keeps them for every later game
+# The pieces are scaled once to the square size into one atlas surface, IMAGES holds a view of it per piece
+# Needs the window to exist, the surfaces are converted to its pixel format so blitting them is fast
+def load_assets():
+    if not ASSETS:
+        board = pyg.image.load(os.path.join(IMAGE_DIR, 'board.png'))
+        ASSETS['board'] = pyg.transform.scale(board, (WIDTH, HEIGHT)).convert()
+        atlas = pyg.Surface((SQUARE_SIZE * len(PIECES), SQUARE_SIZE), pyg.SRCALPHA).convert_alpha()
+        for i, piece in enumerate(PIECES):
+            image = pyg.image.load(os.path.join(IMAGE_DIR, piece + '.png'))
+            atlas.blit(pyg.transform.scale(image.convert_alpha(), (SQUARE_SIZE, SQUARE_SIZE)), (i * SQUARE_SIZE, 0))
+            IMAGES[piece] = atlas.subsurface((i * SQUARE_SIZE, 0, SQUARE_SIZE, SQUARE_SIZE))
+        ASSETS['pieces'] = atlas
+    return ASSETS
 
 
-# Fitting chess piece images to the correct size relative to the chess board
-def create_chess_pieces():
-    pieces = ["wR", "wN", "wB", "wQ", "wK", "wP", "bR", "bN", "bB", "bQ", "bK", "bP"]
-    for piece in pieces:
-        IMAGES[piece] = pyg.transform.scale(pyg.image.load('images/' + piece + '.png'), (SQUARE_SIZE, SQUARE_SIZE))
-    
 def draw_circle(surface, x, y, radius, color):
     pyg.gfxdraw.aacircle(surface, x, y, radius, color)
     pyg.gfxdraw.filled_circle(surface, x, y, radius, color)
 
-def draw_game(window, game, validMoves, squareSelected, movesLog):
-    chess_board = pyg.transform.scale(pyg.image.load('images/board.png'), (WIDTH, HEIGHT))
-    window.blit(chess_board, (0, 0))
-    highlight_king(window, game)
-    highlight_squares(window, game, validMoves, squareSelected, movesLog)
-    draw_pieces(window, game)
-    pyg.display.update()
-    
-def draw_pieces(window, game):
-    for row in range(DIMENSION):
-        for col in range(DIMENSION):
-            piece = game.board[row][col]
-            if piece != '--':
-                window.blit(IMAGES[piece], (col * SQUARE_SIZE, row * SQUARE_SIZE))
-
-def draw_text(screen, text):
-    font = pyg.font.SysFont('Helvetica', 32, True, False)
+# Returns the rect drawn on
+def draw_text(screen, text, font):
     textObject = font.render(text, 0, pyg.Color('Black'))
     textLocation = pyg.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObject.get_width()/2, HEIGHT/2 - textObject.get_height()/2)
-    screen.blit(textObject, textLocation)
-
-
-
+    return screen.blit(textObject, textLocation)
 
+if __name__ == "__main__":
+    main_menu()
 
-#if __name__ == "__main__":
-#    main()
-main_menu()
 
 
@@ -0,0 +1,106 @@
+import argparse
+import re
+import sys
+import ChessBoard
+import OpeningBook
+import selfplay
+
+# Builds an opening book for OpeningBook from games
+#    python makebook.py games.pgn --output book.bin --plies 16
+# Input files are PGN, or lines of UCI moves from the starting position (e.g. "e2e4 e7e5 g1f3").
+# Without an input file the book is made from selfplay's default openings.
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+MOVE_NUMBER = re.compile(r"^\d+\.+")
+
+# The legal packed move of board written in SAN, ignoring check and annotation marks
+def findSan(board, san):
+    san = san.rstrip("+#!?")
+    for move in board.getValidMoves():
+        if board.getSan(move).rstrip("+#") == san:
+            return move.packed
+    raise ValueError("Illegal move " + san)
+
+# Movetext of a PGN game without comments, variations and numeric annotations
+def movetextTokens(movetext):
+    movetext = re.sub(r"\{[^}]*\}|;[^\n]*|\$\d+", " ", movetext)
+    while "(" in movetext: # Innermost variations first, they can be nested
+        movetext = re.sub(r"\([^()]*\)", " ", movetext)
+    tokens = []
+    for token in movetext.split():
+        token = MOVE_NUMBER.sub("", token)
+        if token:
+            tokens.append(token)
+    return tokens
+
+# (fen, packed moves, result) for every game of a PGN file, read lazily
+# Only the first maxPlies moves of a game are read, the book uses no more
+def readPgn(file, maxPlies):
+    board = ChessBoard.Board()
+    headers = {}
+    movetext = []
+
+    def game():
+        board.loadFen(headers.get("FEN", ChessBoard.START_FEN))
+        fen = board.getFen()
+        moves = []
+        result = headers.get("Result", "*")
+        for token in movetextTokens(" ".join(movetext)):
+            if token in RESULTS:
+                result = token
+                break
+            if len(moves) < maxPlies:
+                move = findSan(board, token)
+                moves.append(move)
+                board.pushMove(move)
+        return fen, moves, result
+
+    for line in file:
+        line = line.strip()
+        if line.startswith("["):
+            if movetext: # A new game starts
+                yield game()
+                headers, movetext = {}, []
+            match = re.match(r'\[(\w+)\s+"(.*)"\]', line)
+            if match:
+                headers[match.group(1)] = match.group(2)
+        elif line and not line.startswith("%"):
+            movetext.append(line)
+    if movetext:
+        yield game()
+
+# (fen, packed moves, result) for lines of UCI moves from the starting position
+def readMoveLines(lines):
+    board = ChessBoard.Board()
+    for line in lines:
+        line = line.split("#")[0].strip()
+        if not line:
+            continue
+        board.loadFen(ChessBoard.START_FEN)
+        moves = []
+        for notation in line.split():
+            move = selfplay.findMove(board, notation).packed
+            moves.append(move)
+            board.pushMove(move)
+        yield ChessBoard.START_FEN, moves, "*"
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Build an opening book from PGN games or UCI move lines")
+    parser.add_argument("input", nargs = "?", help = "PGN file, or a file of UCI move lines")
+    parser.add_argument("--output", default = "book.bin")
+    parser.add_argument("--plies", type = int, default = 16, help = "moves of each game that go in the book")
+    args = parser.parse_args(argv)
+
+    if args.input is None:
+        games = readMoveLines(selfplay.DEFAULT_OPENINGS)
+        count = OpeningBook.buildBook(games, args.output, args.plies)
+    else:
+        with open(args.input) as file:
+            isPgn = args.input.lower().endswith(".pgn")
+            games = readPgn(file, args.plies) if isPgn else readMoveLines(file)
+            count = OpeningBook.buildBook(games, args.output, args.plies)
+    print("Wrote %d entries to %s" % (count, args.output))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,19 @@
+import argparse
+import sys
+import time
+import Tablebase
+
+# Generates the endgame tablebases (see Tablebase) on this machine
+#    python maketablebases.py --output tablebases.bin
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Generate the KQK, KRK and KPK endgame tablebases")
+    parser.add_argument("--output", default = "tablebases.bin")
+    args = parser.parse_args(argv)
+    start = time.time()
+    Tablebase.writeTablebases(args.output, lambda name: print("%s done after %.0fs" % (name, time.time() - start)))
+    print("Wrote " + args.output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
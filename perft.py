@@ -0,0 +1,100 @@
+import argparse
+import sys
+import time
+import ChessBoard
+
+# Well known positions with their published perft node counts, index i is the count for depth i + 1
+# Together they cover castling, en passant, promotions and checks
+REFERENCE_POSITIONS = [
+    ("Start position", ChessBoard.START_FEN,
+     [20, 400, 8902, 197281, 4865609, 119060324]),
+    ("Kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603, 193690690]),
+    ("Position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624, 11030083]),
+    ("Position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333, 15833292]),
+    ("Position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487, 89941194]),
+    ("Position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594, 164075551]),
+]
+
+# Number of leaf nodes of the legal move tree depth plies deep
+def perft(board, depth):
+    moves = board.getLegalMoves()
+    if depth == 1: # Counting the moves is enough, no need to play them
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        board.pushMove(move)
+        nodes += perft(board, depth - 1)
+        board.popMove()
+    return nodes
+
+# Perft split by root move, to find which move a wrong count comes from
+def divide(board, depth):
+    counts = {}
+    for move in board.getValidMoves():
+        board.makeMove(move)
+        counts[move.getChessNotation()] = perft(board, depth - 1) if depth > 1 else 1
+        board.undoMove()
+    return counts
+
+# Runs perft and returns (nodes, seconds)
+def timePerft(board, depth):
+    start = time.perf_counter()
+    nodes = perft(board, depth)
+    return nodes, time.perf_counter() - start
+
+def formatResult(nodes, seconds):
+    nodesPerSecond = nodes / seconds if seconds > 0 else 0
+    return "%d nodes in %.2fs (%.0f nodes/s)" % (nodes, seconds, nodesPerSecond)
+
+# Checks every reference position up to maxDepth, returns True if every count matched
+def runSuite(maxDepth):
+    allPassed = True
+    totalNodes = 0
+    totalSeconds = 0
+    for name, fen, counts in REFERENCE_POSITIONS:
+        board = ChessBoard.Board(fen)
+        for depth in range(1, min(maxDepth, len(counts)) + 1):
+            nodes, seconds = timePerft(board, depth)
+            totalNodes += nodes
+            totalSeconds += seconds
+            passed = nodes == counts[depth - 1]
+            allPassed = allPassed and passed
+            print("%-15s depth %d: %s  %s" % (name, depth, formatResult(nodes, seconds),
+                                              "ok" if passed else "FAILED, expected %d" % counts[depth - 1]))
+    print("Total: " + formatResult(totalNodes, totalSeconds))
+    return allPassed
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Count and time the move generator's leaf nodes")
+    parser.add_argument("--fen", default = ChessBoard.START_FEN, help = "position to start from")
+    parser.add_argument("--depth", type = int, default = 4)
+    parser.add_argument("--divide", action = "store_true", help = "print the count below each root move")
+    parser.add_argument("--suite", action = "store_true",
+                        help = "check the reference positions up to --depth against their known counts")
+    args = parser.parse_args(argv)
+    if args.depth < 1:
+        parser.error("--depth must be at least 1")
+
+    if args.suite:
+        return 0 if runSuite(args.depth) else 1
+
+    board = ChessBoard.Board(args.fen)
+    if args.divide:
+        start = time.perf_counter()
+        counts = divide(board, args.depth)
+        seconds = time.perf_counter() - start
+        for notation in sorted(counts):
+            print(notation + ": " + str(counts[notation]))
+        print("Moves: " + str(len(counts)))
+        print(formatResult(sum(counts.values()), seconds))
+    else:
+        print("Depth " + str(args.depth) + ": " + formatResult(*timePerft(board, args.depth)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
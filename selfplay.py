@@ -0,0 +1,253 @@
+import argparse
+import datetime
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import ChessBoard
+from TimeManager import TimeManager
+
+# Plays engine against engine without the GUI, to measure changes in strength and speed
+#    python selfplay.py --games 40 --depth 4 --depth-b 3 --pgn games.pgn
+# Every opening is played twice with the colors swapped, the games are spread over a process pool
+# and written to the PGN file as they finish, with the depth and time of every engine move as comments.
+# Results are given from player A's side.
+
+# Opening lines from the starting position in UCI notation, used when no openings file is given
+DEFAULT_OPENINGS = [
+    "e2e4 e7e5 g1f3 b8c6 f1b5",      # Ruy Lopez
+    "e2e4 e7e5 g1f3 b8c6 f1c4",      # Italian
+    "e2e4 c7c5 g1f3 d7d6",           # Sicilian
+    "e2e4 e7e6 d2d4 d7d5",           # French
+    "e2e4 c7c6 d2d4 d7d5",           # Caro-Kann
+    "d2d4 d7d5 c2c4 e7e6",           # Queen's Gambit Declined
+    "d2d4 d7d5 c2c4 c7c6",           # Slav
+    "d2d4 g8f6 c2c4 g7g6 b1c3 f8g7", # King's Indian
+    "d2d4 g8f6 c2c4 e7e6 b1c3 f8b4", # Nimzo-Indian
+    "c2c4 e7e5 b1c3 g8f6",           # English
+    "g1f3 d7d5 g2g3 g8f6",           # Reti
+    "e2e4 d7d5 e4d5 d8d5",           # Scandinavian
+]
+
+RESULT_SCORES = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5}
+
+# An opening is (fen, moves): a position and UCI moves to play from it
+# Lines of an openings file are FEN or EPD positions, EPD operations after the fourth field are ignored
+def readOpenings(path):
+    openings = []
+    with open(path) as file:
+        for line in file:
+            fields = line.split(';')[0].split()
+            if len(fields) < 4 or line.startswith('#'):
+                continue
+            fen = fields[:4] + [field for field in fields[4:6] if field.isdigit()]
+            openings.append((" ".join(fen), []))
+    return openings
+
+# The legal Move of board written as notation (e.g. e2e4, e7e8q)
+def findMove(board, notation):
+    for move in board.getValidMoves():
+        if move.getChessNotation() == notation:
+            return move
+    raise ValueError("Illegal move " + notation)
+
+# A board for a player to search with, it keeps its transposition table for the whole game
+def createEngine(fen, player):
+    engine = ChessBoard.Board(fen)
+    engine.printProgress = False
+    engine.INTIAL_DEPTH = 1
+    engine.MAX_DEPTH = player["depth"]
+    return engine
+
+# The search limits for a player's next move, clock is its remaining game time (None without a game clock)
+def timeManagerFor(player, clock):
+    if player["moveTime"] is not None:
+        return TimeManager(moveTime = player["moveTime"])
+    if clock is not None:
+        return TimeManager(timeLeft = clock, increment = player["increment"])
+    return TimeManager() # Only the depth limits the search
+
+# Runs in a worker process, plays one game and returns what happened in it
+# players maps ChessBoard.WHITE and ChessBoard.BLACK to the player settings from parsePlayer
+def playGame(number, opening, players, maxPlies):
+    fen, openingMoves = opening
+    game = ChessBoard.Board(fen)
+    engines = {color: createEngine(fen, player) for color, player in players.items()}
+    clocks = {color: player["gameTime"] for color, player in players.items()}
+    moves = [] # (san, depth, seconds) with depth None for opening moves
+    for notation in openingMoves:
+        move = findMove(game, notation)
+        moves.append((game.getSan(move), None, 0.0))
+        for board in (game, *engines.values()):
+            board.makeMove(move)
+
+    result, termination = None, None
+    while result is None:
+        legalMoves = game.getValidMoves()
+        color = ChessBoard.WHITE if game.whitesMove else ChessBoard.BLACK
+        winner = "0-1" if game.whitesMove else "1-0"
+        if not legalMoves:
+            result, termination = (winner, "checkmate") if game.checkMate else ("1/2-1/2", "stalemate")
+        elif game.isRepetition():
+            result, termination = "1/2-1/2", "threefold repetition"
+        elif game.isFiftyMoveDraw():
+            result, termination = "1/2-1/2", "fifty move rule"
+        elif game.isInsufficientMaterial():
+            result, termination = "1/2-1/2", "insufficient material"
+        elif len(moves) >= maxPlies:
+            result, termination = "1/2-1/2", "adjudicated after " + str(maxPlies) + " plies"
+        else:
+            engine = engines[color]
+            engine.timeManager = timeManagerFor(players[color], clocks[color])
+            start = time.perf_counter()
+            move = engine.findBestMove()
+            seconds = time.perf_counter() - start
+            if clocks[color] is not None:
+                clocks[color] += players[color]["increment"] - seconds
+                if clocks[color] < 0:
+                    result, termination = winner, "time forfeit"
+                    break
+            if move is None: # Not even the first depth finished
+                move = legalMoves[0]
+            depth = engine.searchStatistics[-1].depth if engine.searchStatistics else 0
+            moves.append((game.getSan(move), depth, seconds))
+            for board in (game, *engines.values()):
+                board.makeMove(move)
+    return {"number": number, "fen": fen, "moves": moves, "result": result, "termination": termination,
+            "white": players[ChessBoard.WHITE]["name"], "black": players[ChessBoard.BLACK]["name"]}
+
+# The game as PGN text, engine moves carry a {depth, seconds} comment
+def formatPgn(game, event):
+    board = ChessBoard.Board(game["fen"])
+    headers = [("Event", event), ("Site", "?"), ("Date", datetime.date.today().strftime("%Y.%m.%d")),
+               ("Round", str(game["number"] + 1)), ("White", game["white"]), ("Black", game["black"]),
+               ("Result", game["result"]), ("Termination", game["termination"])]
+    if board.getFen() != ChessBoard.START_FEN:
+        headers += [("SetUp", "1"), ("FEN", board.getFen())]
+    lines = ['[%s "%s"]' % header for header in headers]
+    lines.append("")
+    tokens = []
+    moveNumber = board.fullmoveNumber
+    whitesMove = board.whitesMove
+    for i, (san, depth, seconds) in enumerate(game["moves"]):
+        if whitesMove:
+            tokens.append(str(moveNumber) + ".")
+        elif i == 0:
+            tokens.append(str(moveNumber) + "...")
+        tokens.append(san)
+        if depth is not None:
+            tokens.append("{%d, %.2fs}" % (depth, seconds))
+        if not whitesMove:
+            moveNumber += 1
+        whitesMove = not whitesMove
+    tokens.append(game["result"])
+    line = ""
+    for token in tokens: # PGN lines are kept below 80 characters
+        if line and len(line) + 1 + len(token) > 79:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n\n"
+
+# Elo difference from a match result with the margin of a 95% confidence interval
+def eloDifference(wins, draws, losses):
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, float("inf")
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+
+    def elo(score):
+        score = min(max(score, 1e-6), 1 - 1e-6)
+        return 400 * math.log10(score / (1 - score))
+    return elo(score), (elo(score + margin) - elo(score - margin)) / 2
+
+# Player settings from the command line, suffix is "" for player A and "_b" for player B
+def parsePlayer(args, name, suffix):
+    def value(option):
+        specific = getattr(args, option + suffix)
+        return specific if specific is not None else getattr(args, option)
+    player = {"depth": value("depth"), "moveTime": value("movetime"), "gameTime": value("time"),
+              "increment": value("increment")}
+    limits = ["depth " + str(player["depth"])]
+    if player["moveTime"] is not None:
+        limits.append(str(player["moveTime"]) + "s/move")
+    elif player["gameTime"] is not None:
+        limits.append("%g+%g" % (player["gameTime"], player["increment"]))
+    player["name"] = name + " (" + ", ".join(limits) + ")"
+    return player
+
+# Plays the match and writes every game to pgnPath as it finishes, returns (wins, draws, losses) for player A
+def runMatch(openings, games, playerA, playerB, workers, pgnPath, maxPlies, event = "Self-play"):
+    wins = draws = losses = 0
+    depths = []
+    start = time.time()
+    with ProcessPoolExecutor(max_workers = workers) as pool, open(pgnPath, "w") as pgn:
+        futures = {}
+        for number in range(games):
+            opening = openings[(number // 2) % len(openings)]
+            aIsWhite = number % 2 == 0 # Each opening twice, once with each color
+            players = {ChessBoard.WHITE: playerA if aIsWhite else playerB,
+                       ChessBoard.BLACK: playerB if aIsWhite else playerA}
+            futures[pool.submit(playGame, number, opening, players, maxPlies)] = aIsWhite
+        for future in as_completed(futures):
+            game = future.result()
+            pgn.write(formatPgn(game, event))
+            pgn.flush()
+            depths.extend(depth for san, depth, seconds in game["moves"] if depth is not None)
+            score = RESULT_SCORES[game["result"]]
+            if not futures[future]:
+                score = 1 - score
+            if score == 1:
+                wins += 1
+            elif score == 0:
+                losses += 1
+            else:
+                draws += 1
+            print("Game %d: %s - %s %s (%s)" % (game["number"] + 1, game["white"], game["black"],
+                                               game["result"], game["termination"]))
+    hours = (time.time() - start) / 3600
+    elo, margin = eloDifference(wins, draws, losses)
+    print("Score of %s vs %s: %d - %d - %d (W - L - D)" % (playerA["name"], playerB["name"], wins, losses, draws))
+    print("Elo difference: %.1f +/- %.1f" % (elo, margin))
+    print("%.1f games/hour, average depth %.2f" % (games / hours if hours else 0,
+                                                   sum(depths) / len(depths) if depths else 0))
+    return wins, draws, losses
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Play engine against engine and report the result")
+    parser.add_argument("--games", type = int, default = 24)
+    parser.add_argument("--openings", help = "file with one FEN or EPD position per line")
+    parser.add_argument("--workers", type = int, default = os.cpu_count() or 1)
+    parser.add_argument("--pgn", default = "selfplay.pgn", help = "file the games are written to")
+    parser.add_argument("--max-plies", type = int, default = 300, help = "games this long are drawn")
+    # Limits of player A, and of player B where the _b option is not given
+    parser.add_argument("--depth", type = int, default = 4)
+    parser.add_argument("--movetime", type = float, help = "seconds per move")
+    parser.add_argument("--time", type = float, help = "seconds per game")
+    parser.add_argument("--increment", type = float, default = 0.0, help = "seconds added after every move")
+    parser.add_argument("--depth-b", type = int)
+    parser.add_argument("--movetime-b", type = float)
+    parser.add_argument("--time-b", type = float)
+    parser.add_argument("--increment-b", type = float)
+    args = parser.parse_args(argv)
+    if args.games < 1:
+        parser.error("--games must be at least 1")
+
+    if args.openings:
+        openings = readOpenings(args.openings)
+        if not openings:
+            parser.error("no positions in " + args.openings)
+    else:
+        openings = [(ChessBoard.START_FEN, line.split()) for line in DEFAULT_OPENINGS]
+    playerA = parsePlayer(args, "A", "")
+    playerB = parsePlayer(args, "B", "_b")
+    runMatch(openings, args.games, playerA, playerB, args.workers, args.pgn, args.max_plies)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,460 @@
+import argparse
+import array
+import asyncio
+import collections
+import itertools
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import ChessBoard
+import selfplay
+from OpeningBook import OpeningBook
+from Tablebase import Tablebases
+from TimeManager import TimeManager
+
+# Hosts many games against the engine at once, its moves are searched by a pool of worker processes
+#    python server.py --port 8765 --workers 4
+#    python server.py --unix /tmp/chess.sock
+# The protocol is one JSON object per line in each direction. A request has a "cmd" and may have an "id",
+# which is repeated in its response, so a client can send several requests without waiting for the answers:
+#    {"cmd": "new", "fen": ...}                  -> {"game": 1, "fen": ...}, fen is optional
+#    {"cmd": "move", "game": 1, "move": "e2e4"}  -> {"fen": ..., "status": "playing"}
+#    {"cmd": "go", "game": 1}                    -> {"bestmove": "e7e5", "san": "e5", "score": -12, "depth": 6, ...}
+#        The engine plays its move in the game. Optional "movetime" and "depth" limit the search and
+#        "deadline" is the seconds from now the answer is due by, time spent waiting for a worker included
+#    {"cmd": "state", "game": 1}                 -> {"fen": ..., "moves": ["e2e4", "e7e5"], "status": "playing"}
+#    {"cmd": "close", "game": 1}                 -> {}
+#    {"cmd": "stats"}                            -> counters and latency percentiles in milliseconds
+# A request that fails is answered with {"error": ...}.
+#
+# Searches wait in one queue served round robin by connection, so a client sending many requests at once
+# does not hold up the others. When the queue is full new searches are refused with an error, and a connection
+# with PIPELINE_DEPTH requests unanswered is not read from until one is answered. A game keeps only its start
+# position and moves while it is idle; its Board is made again the next time it is used.
+
+PIPELINE_DEPTH = 16 # Unanswered requests of one connection before the server stops reading it
+QUEUE_PER_WORKER = 8 # Searches waiting per worker before new ones are refused
+MIN_SEARCH_TIME = 0.02 # A search with less time than this left before its deadline is not started
+LATENCY_WINDOW = 10000 # Latest searches the percentiles are taken over
+MAX_SEARCH_DEPTH = ChessBoard.MAX_PLY - 1
+
+class RequestError(Exception):
+    pass
+
+# The value of a request field, checked to be of one of types, default when it is missing or null
+def requestField(request, name, types, default = None):
+    value = request.get(name)
+    if value is None:
+        return default
+    if not isinstance(value, types) or (isinstance(value, bool) and bool not in types): # JSON true is not a number
+        raise RequestError("Invalid " + name + ": " + json.dumps(value))
+    return value
+
+# A number field that has to be above zero
+def positiveField(request, name, types, default):
+    value = requestField(request, name, types, default)
+    if value is not None and value <= 0:
+        raise RequestError("Invalid " + name + ": " + json.dumps(value))
+    return value
+
+# The board a worker process searches every position on, created once per process
+_board = None
+
+def _initWorker(bookPath, tablebasePath):
+    global _board
+    _board = ChessBoard.Board()
+    _board.printProgress = False
+    if bookPath:
+        _board.openingBook = OpeningBook(bookPath)
+    if tablebasePath:
+        _board.tablebases = Tablebases(tablebasePath)
+
+# Runs in a worker process, searches the position after the packed moves from fen
+# Returns (packed move, score, depth, nodes), or None when the deadline (in time.time()) is too close to start
+def searchPosition(fen, moves, depth, moveTime, deadline):
+    remaining = deadline - time.time()
+    if remaining < MIN_SEARCH_TIME:
+        return None
+    board = _board
+    board.loadFen(fen)
+    for move in moves: # Played rather than loaded from a FEN so repetitions are seen
+        board.pushMove(move)
+    board.INTIAL_DEPTH = 1
+    board.MAX_DEPTH = depth
+    board.timeManager = TimeManager(moveTime = remaining if moveTime is None else min(moveTime, remaining))
+    move = board.findBestMove()
+    if move is None: # Not even the first depth finished
+        return board.getLegalMoves()[0], None, 0, board.nodesSearched
+    depth = board.searchStatistics[-1].depth if board.searchStatistics else 0 # 0 for book and tablebase moves
+    return move.packed, board.globalBestScore, depth, board.nodesSearched
+
+# How the game stands, "playing" while it goes on
+def gameStatus(board):
+    if not board.getLegalMoves():
+        return "checkmate" if board.checkMate else "stalemate"
+    if board.isRepetition():
+        return "threefold repetition"
+    if board.isFiftyMoveDraw():
+        return "fifty move rule"
+    if board.isInsufficientMaterial():
+        return "insufficient material"
+    return "playing"
+
+# Score fields of a response, mates are given in moves like analyze.py
+def scoreFields(score):
+    if score is None:
+        return {}
+    if score >= ChessBoard.MATE_BOUND:
+        return {"mate": (ChessBoard.MATE_SCORE - score + 1) // 2}
+    if score <= -ChessBoard.MATE_BOUND:
+        return {"mate": -((ChessBoard.MATE_SCORE + score) // 2)}
+    return {"score": score}
+
+# One game: its start position and moves, and a Board while it is in use
+class GameSession():
+    __slots__ = ('id', 'fen', 'moves', 'board', 'lastUsed', 'searching')
+
+    def __init__(self, gameId, fen):
+        self.id = gameId
+        self.fen = fen
+        self.moves = array.array('I') # Packed moves made since fen
+        self.board = None
+        self.lastUsed = time.monotonic()
+        self.searching = False
+
+    # The game's Board, made again from the moves if it was dropped while the game was idle
+    # It holds only the position, the search tables live in the worker processes
+    def getBoard(self):
+        self.lastUsed = time.monotonic()
+        if self.board is None:
+            board = ChessBoard.Board.positionOnly(self.fen)
+            for move in self.moves:
+                board.pushMove(move)
+            self.board = board
+        return self.board
+
+    def makeMove(self, move):
+        self.getBoard().pushMove(move)
+        self.moves.append(move)
+
+    # The moves in UCI notation, replayed on a Board of their own
+    def notations(self):
+        board = ChessBoard.Board.positionOnly(self.fen)
+        notations = []
+        for move in self.moves:
+            notations.append(ChessBoard.Move.fromPacked(move, board.squares).getChessNotation())
+            board.pushMove(move)
+        return notations
+
+# Searches waiting for a worker, one queue per connection served in turn
+class FairQueue():
+
+    def __init__(self):
+        self.queues = collections.OrderedDict() # Connection -> deque of jobs, only connections with jobs
+        self.waiting = set() # Futures of the queued jobs still wanted, jobs given up on stay queued until taken
+        self.items = asyncio.Semaphore(0)
+
+    # Jobs still wanted, the ones discarded are not counted
+    def __len__(self):
+        return len(self.waiting)
+
+    # job is (future, ...), the future being done before the job is taken means it is no longer wanted
+    def put(self, client, job):
+        self.queues.setdefault(client, collections.deque()).append(job)
+        self.waiting.add(job[0])
+        self.items.release()
+
+    # A queued job's future was given up on, it is skipped when its turn comes
+    def discard(self, future):
+        self.waiting.discard(future)
+
+    # The oldest job of the connection whose turn it is, that connection then goes to the back
+    async def get(self):
+        await self.items.acquire()
+        client, jobs = next(iter(self.queues.items()))
+        job = jobs.popleft()
+        if jobs:
+            self.queues.move_to_end(client)
+        else:
+            del self.queues[client]
+        self.waiting.discard(job[0])
+        return job
+
+# Latencies of the latest searches, in seconds
+class LatencyStats():
+
+    def __init__(self, window = LATENCY_WINDOW):
+        self.samples = collections.deque(maxlen = window)
+        self.count = 0
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    # Nearest rank percentiles in milliseconds
+    def percentiles(self):
+        result = {"count": self.count}
+        if self.samples:
+            ordered = sorted(self.samples)
+            for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+                result[name] = round(ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)] * 1000, 1)
+            result["max"] = round(ordered[-1] * 1000, 1)
+        return result
+
+class GameServer():
+
+    def __init__(self, pool, workers, maxGames, moveTime, deadline, depth, idleTime, expireTime):
+        self.pool = pool
+        self.workers = workers
+        self.maxGames = maxGames
+        self.moveTime = moveTime # Defaults of go requests
+        self.deadline = deadline
+        self.depth = depth
+        self.idleTime = idleTime # Seconds before an unused game's Board is dropped
+        self.expireTime = expireTime # Seconds before an unused game is closed
+        self.games = {}
+        self.gameIds = itertools.count(1)
+        self.queue = FairQueue()
+        self.maxQueue = workers * QUEUE_PER_WORKER
+        self.searching = 0
+        self.refused = 0 # Searches refused because the queue was full
+        self.missed = 0 # Searches whose deadline passed while they waited
+        self.latency = LatencyStats() # From a go request arriving to its answer
+        self.waiting = LatencyStats() # Time go requests spent in the queue
+        self.searchTime = LatencyStats()
+
+    # Worker tasks take searches from the queue and run them in the pool, one each
+    # so the pool itself never has more work than it has processes
+    async def dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            future, arguments, queued = await self.queue.get()
+            if future.done(): # The client went away
+                continue
+            self.waiting.record(time.monotonic() - queued)
+            if arguments[-1] - time.time() < MIN_SEARCH_TIME: # Its deadline passed while it waited
+                future.set_result(None)
+                continue
+            self.searching += 1
+            start = time.monotonic()
+            try:
+                result = await loop.run_in_executor(self.pool, searchPosition, *arguments)
+            except Exception as error: # A worker process died, or the search raised
+                if not future.done():
+                    future.set_exception(RequestError("Search failed: " + repr(error)))
+                continue
+            finally:
+                self.searching -= 1
+            if result is not None:
+                self.searchTime.record(time.monotonic() - start)
+            if not future.done():
+                future.set_result(result)
+
+    # Drops the Boards of idle games and closes games unused for expireTime
+    async def sweep(self):
+        while True:
+            await asyncio.sleep(min(self.idleTime, self.expireTime) / 2)
+            now = time.monotonic()
+            for gameId, session in list(self.games.items()):
+                if session.searching:
+                    continue
+                if now - session.lastUsed > self.expireTime:
+                    del self.games[gameId]
+                elif now - session.lastUsed > self.idleTime:
+                    session.board = None
+
+    async def handleConnection(self, reader, writer):
+        pending = asyncio.Semaphore(PIPELINE_DEPTH)
+        tasks = set()
+        disconnected = True
+        try:
+            while True:
+                await pending.acquire() # Backpressure, the client waits for answers before more is read
+                try:
+                    line = await reader.readline()
+                except ValueError: # A line longer than the reader's limit
+                    break
+                if not line: # The client is done sending but may still be reading its answers
+                    disconnected = False
+                    break
+                task = asyncio.create_task(self.answer(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda task: pending.release())
+            if not disconnected:
+                await asyncio.gather(*tasks)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            disconnected = True
+        finally:
+            if disconnected:
+                for task in tasks: # Searches nobody will read are taken out of the queue
+                    task.cancel()
+            writer.close()
+
+    # Handles one request line and writes its response, the connection's writer is also its place in the queue
+    async def answer(self, line, writer):
+        requestId = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise RequestError("A request must be a JSON object")
+            requestId = request.get("id")
+            response = await self.handle(request, writer)
+        except (ValueError, RequestError) as error: # json.JSONDecodeError is a ValueError
+            response = {"error": str(error)}
+        if requestId is not None:
+            response["id"] = requestId
+        if writer.is_closing():
+            return
+        writer.write((json.dumps(response) + "\n").encode())
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def handle(self, request, client):
+        command = request.get("cmd")
+        if command == "new":
+            return self.newGame(request)
+        if command == "move":
+            return self.playerMove(request)
+        if command == "go":
+            return await self.engineMove(request, client)
+        if command == "state":
+            session = self.getSession(request)
+            board = session.getBoard()
+            return {"game": session.id, "fen": board.getFen(), "moves": session.notations(),
+                    "status": gameStatus(board)}
+        if command == "close":
+            self.games.pop(self.getSession(request).id)
+            return {}
+        if command == "stats":
+            return self.stats()
+        raise RequestError("Unknown command: " + str(command))
+
+    def getSession(self, request):
+        gameId = requestField(request, "game", int)
+        session = self.games.get(gameId)
+        if session is None:
+            raise RequestError("No such game: " + json.dumps(gameId))
+        return session
+
+    def newGame(self, request):
+        if len(self.games) >= self.maxGames:
+            raise RequestError("Too many games")
+        fen = requestField(request, "fen", str, ChessBoard.START_FEN)
+        session = GameSession(next(self.gameIds), fen)
+        board = session.getBoard() # Raises ValueError for a bad FEN
+        self.games[session.id] = session
+        return {"game": session.id, "fen": board.getFen(), "status": gameStatus(board)}
+
+    def playerMove(self, request):
+        session = self.getSession(request)
+        if session.searching:
+            raise RequestError("The engine is thinking")
+        board = session.getBoard()
+        if gameStatus(board) != "playing":
+            raise RequestError("The game is over")
+        notation = requestField(request, "move", str)
+        if notation is None:
+            raise RequestError("A move request needs a move")
+        session.makeMove(selfplay.findMove(board, notation).packed)
+        return {"game": session.id, "fen": board.getFen(), "status": gameStatus(board)}
+
+    async def engineMove(self, request, client):
+        received = time.monotonic()
+        session = self.getSession(request)
+        if session.searching:
+            raise RequestError("The engine is already thinking")
+        board = session.getBoard()
+        if gameStatus(board) != "playing":
+            raise RequestError("The game is over")
+        if len(self.queue) >= self.maxQueue:
+            self.refused += 1
+            raise RequestError("Server busy")
+        moveTime = positiveField(request, "movetime", (int, float), self.moveTime)
+        depth = min(positiveField(request, "depth", int, self.depth), MAX_SEARCH_DEPTH)
+        deadline = time.time() + positiveField(request, "deadline", (int, float), self.deadline)
+        arguments = (session.fen, session.moves.tolist(), depth, moveTime, deadline)
+        future = asyncio.get_running_loop().create_future()
+        session.searching = True
+        try:
+            self.queue.put(client, (future, arguments, received))
+            result = await future
+        finally:
+            session.searching = False
+            if not future.done(): # Cancelled with the connection, the dispatcher skips it
+                future.cancel()
+                self.queue.discard(future)
+        if result is None:
+            self.missed += 1
+            raise RequestError("Deadline passed before the search could start")
+        move, score, depth, nodes = result
+        board = session.getBoard()
+        notation = ChessBoard.Move.fromPacked(move, board.squares).getChessNotation()
+        san = board.getSan(ChessBoard.Move.fromPacked(move, board.squares))
+        session.makeMove(move)
+        self.latency.record(time.monotonic() - received)
+        response = {"game": session.id, "bestmove": notation, "san": san, "depth": depth, "nodes": nodes}
+        response.update(scoreFields(score))
+        response.update({"fen": board.getFen(), "status": gameStatus(board)})
+        return response
+
+    def stats(self):
+        return {"games": len(self.games), "loaded": sum(session.board is not None for session in self.games.values()),
+                "queued": len(self.queue), "searching": self.searching, "workers": self.workers,
+                "refused": self.refused, "missed": self.missed, "latency": self.latency.percentiles(),
+                "wait": self.waiting.percentiles(), "search": self.searchTime.percentiles()}
+
+async def serve(args):
+    with ProcessPoolExecutor(max_workers = args.workers, initializer = _initWorker,
+                             initargs = (args.book, args.tablebases)) as pool:
+        server = GameServer(pool, args.workers, args.max_games, args.movetime, args.deadline, args.depth,
+                            args.idle, args.expire)
+        background = [asyncio.create_task(server.dispatch()) for worker in range(args.workers)]
+        background.append(asyncio.create_task(server.sweep()))
+        if args.unix:
+            listener = await asyncio.start_unix_server(server.handleConnection, path = args.unix)
+        else:
+            listener = await asyncio.start_server(server.handleConnection, args.host, args.port)
+        where = args.unix or "%s:%d" % (args.host, args.port)
+        print("Serving on %s with %d workers" % (where, args.workers), file = sys.stderr)
+        try:
+            async with listener:
+                await listener.serve_forever()
+        finally:
+            for task in background:
+                task.cancel()
+            print(json.dumps(server.stats()), file = sys.stderr)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Serve games against the engine over a socket")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--unix", help = "listen on this Unix socket path instead of TCP")
+    parser.add_argument("--workers", type = int, default = os.cpu_count() or 1)
+    parser.add_argument("--max-games", type = int, default = 10000)
+    parser.add_argument("--movetime", type = float, default = 1.0, help = "default seconds per engine move")
+    parser.add_argument("--deadline", type = float, default = 10.0,
+                        help = "default seconds an engine move may take, waiting for a worker included")
+    parser.add_argument("--depth", type = int, default = MAX_SEARCH_DEPTH, help = "default search depth limit")
+    parser.add_argument("--idle", type = float, default = 30.0, help = "seconds before an idle game is unloaded")
+    parser.add_argument("--expire", type = float, default = 3600.0, help = "seconds before an idle game is closed")
+    parser.add_argument("--book", help = "opening book file, see makebook.py")
+    parser.add_argument("--tablebases", help = "tablebase file, see maketablebases.py")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,31 @@
+import analyze
+from TimeManager import TimeManager
+
+KIWIPETE = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"
+
+def test_checkmate_and_stalemate():
+    analyze._initWorker(2, None)
+    assert analyze.analyzePosition(1, "7k/6Q1/6K1/8/8/8/8/8 b - -")["result"] == "checkmate"
+    assert analyze.analyzePosition(2, "7k/8/6QK/8/8/8/8/8 b - -")["result"] == "stalemate"
+
+def test_search_stopped_before_the_first_depth():
+    analyze._initWorker(3, None)
+    analyze._board.INTIAL_DEPTH = 3
+    analyze._board.timeManager = TimeManager(nodes = 1)
+    result = analyze.analyzePosition(1, KIWIPETE)
+    assert "result" not in result
+    assert result["incomplete"] and result["bestmove"] is not None and result["depth"] == 0
+
+def test_completed_search():
+    analyze._initWorker(2, None)
+    result = analyze.analyzePosition(1, KIWIPETE)
+    assert "incomplete" not in result and result["depth"] == 2 and "score" in result
+
+def test_result_does_not_depend_on_earlier_positions():
+    analyze._initWorker(5, None)
+    fresh = analyze.analyzePosition(1, KIWIPETE)
+    analyze.analyzePosition(2, "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq -")
+    analyze.analyzePosition(3, "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq -")
+    again = analyze.analyzePosition(4, KIWIPETE)
+    for field in ("nodes", "pv", "bestmove", "score"):
+        assert again[field] == fresh[field]
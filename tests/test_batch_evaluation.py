@@ -0,0 +1,49 @@
+import pickle
+import pytest
+import ChessBoard
+
+np = pytest.importorskip("numpy")
+import BatchEvaluation
+
+KIWIPETE = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"
+
+def createBoard():
+    board = ChessBoard.Board(KIWIPETE)
+    board.printProgress = False
+    board.INTIAL_DEPTH = board.MAX_DEPTH = 3
+    return board
+
+def test_records_the_quiescence_leaves():
+    board = createBoard()
+    recorder = BatchEvaluation.LeafRecorder(board)
+    board.findBestMove()
+    squares, whitesMove = recorder.positions()
+    assert len(squares) == board.searchStatistics[-1].quiescenceNodes > 0
+    scores = recorder.evaluate()
+    for i in range(0, len(squares), 97): # The batch scores are the ones the search used
+        position = ChessBoard.Board.positionOnly(KIWIPETE)
+        position.squares = [int(piece) for piece in squares[i]]
+        position.whitesMove = bool(whitesMove[i])
+        position.mgScore, position.egScore, position.phase = position.computeEvaluation()
+        assert scores[i] == position.computeScore()
+    recorder.detach()
+    assert board.leafCallback is None
+
+def test_records_depth_zero_without_quiescence():
+    board = createBoard()
+    board.useQuiescence = False
+    recorder = BatchEvaluation.LeafRecorder(board)
+    board.findBestMove()
+    assert len(recorder.positions()[0]) == board.searchStatistics[-1].leafNodes
+
+def test_board_still_pickles_while_recording():
+    board = createBoard()
+    BatchEvaluation.LeafRecorder(board)
+    copy = pickle.loads(pickle.dumps(board))
+    assert copy.leafCallback is None and copy.squares == board.squares
+
+def test_refuses_a_parallel_search():
+    board = createBoard()
+    board.searchWorkers = 2
+    with pytest.raises(ValueError):
+        BatchEvaluation.LeafRecorder(board)
@@ -0,0 +1,64 @@
+import time
+import ChessBoard
+import EngineWorker
+
+def createBoard(workers):
+    board = ChessBoard.Board()
+    board.printProgress = False
+    board.INTIAL_DEPTH = 1
+    board.MAX_DEPTH = 30 # Only a stop ends the search in time
+    board.searchWorkers = workers
+    return board
+
+def test_cancel_stops_a_sequential_search():
+    handle = EngineWorker.startSearch(createBoard(1))
+    time.sleep(0.2)
+    start = time.time()
+    handle.cancel()
+    assert handle.done() and time.time() - start < 2
+    assert handle.result() is None
+
+def test_cancel_stops_a_parallel_search():
+    board = createBoard(2)
+    handle = EngineWorker.startSearch(board)
+    time.sleep(0.5)
+    start = time.time()
+    handle.cancel()
+    assert handle.done() and time.time() - start < 2
+    # The pool is free for the next search, which completes normally
+    board.MAX_DEPTH = 3
+    assert EngineWorker.startSearch(board).result() is not None
+
+def test_parallel_search_reports_every_depth():
+    board = createBoard(2)
+    board.MAX_DEPTH = 4
+    reported = []
+    board.progressCallback = lambda depth, move: reported.append((depth, move.packed))
+    move = board.findBestMove()
+    assert [depth for depth, packed in reported] == [1, 2, 3, 4]
+    assert reported[-1][1] == move.packed == board.globalBestMove
+    assert [statistics.depth for statistics in board.searchStatistics] == [1, 2, 3, 4]
+    assert board.nodesSearched == sum(statistics.nodes for statistics in board.searchStatistics) > 0
+
+def test_search_copy_shares_the_opening_book(tmp_path):
+    import OpeningBook
+    path = str(tmp_path / "book.bin")
+    OpeningBook.buildBook([(ChessBoard.START_FEN, [], "*")], path)
+    board = createBoard(1)
+    board.openingBook = OpeningBook.OpeningBook(path)
+    copy = EngineWorker._searchCopy(board)
+    assert copy.openingBook is board.openingBook
+    assert copy.squares == board.squares and copy.squares is not board.squares
+    board.openingBook.close()
+
+def test_search_copy_shares_the_tablebases(tmp_path):
+    import Tablebase
+    path = str(tmp_path / "tablebases.bin")
+    with open(path, "wb") as file: # Only the size and header are checked when opening
+        file.write(Tablebase.MAGIC)
+        file.truncate(Tablebase.FILE_SIZE)
+    board = createBoard(1)
+    board.tablebases = Tablebase.Tablebases(path)
+    copy = EngineWorker._searchCopy(board)
+    assert copy.tablebases is board.tablebases
+    board.tablebases.close()
@@ -0,0 +1,49 @@
+import ChessBoard
+from SearchCache import SearchCache
+from TimeManager import TimeManager
+
+MATED = "7k/6Q1/6K1/8/8/8/8/8 b - - 0 1"
+MIDDLEGAME = "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3"
+
+def createBoard(cache, workers):
+    board = ChessBoard.Board()
+    board.printProgress = False
+    board.MAX_DEPTH = 4
+    board.searchWorkers = workers
+    board.searchCache = cache
+    return board
+
+def test_results_are_kept_between_boards(tmp_path):
+    path = str(tmp_path / "cache.bin")
+    cache = SearchCache(path, 1024)
+    board = createBoard(cache, 1)
+    board.loadFen(MIDDLEGAME)
+    move = board.findBestMove()
+    cache.close()
+
+    cache = SearchCache(path, 1024)
+    board = createBoard(cache, 1)
+    board.loadFen(MIDDLEGAME)
+    assert board.findBestMove().packed == move.packed
+    assert board.searchStatistics == [] # Taken from the cache without searching
+    cache.close()
+
+# A parallel search that finds nothing must not store the previous search's result under the new position
+def test_parallel_search_without_a_result_stores_nothing(tmp_path):
+    cache = SearchCache(str(tmp_path / "cache.bin"), 1024)
+    board = createBoard(cache, 2)
+    assert board.findBestMove() is not None
+    assert cache.probe(board.zobristKey) is not None
+
+    board.loadFen(MATED) # No legal moves
+    assert board.findBestMove() is None
+    assert board.globalBestMove is None and board.searchStatistics == []
+    assert cache.probe(board.zobristKey) is None
+
+    board.loadFen(MIDDLEGAME) # Stopped before the first depth completes
+    board.INTIAL_DEPTH = board.MAX_DEPTH = 6
+    board.timeManager = TimeManager(moveTime = 0.06)
+    assert board.findBestMove() is None
+    assert board.timedOut and board.searchStatistics == []
+    assert cache.probe(board.zobristKey) is None
+    cache.close()
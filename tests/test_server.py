@@ -0,0 +1,102 @@
+import asyncio
+import json
+import pytest
+import server
+
+# Collects what the server writes to a connection
+class Writer():
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.append(json.loads(data))
+
+    async def drain(self):
+        pass
+
+    def is_closing(self):
+        return False
+
+def createServer():
+    return server.GameServer(None, 1, 10, 1.0, 10.0, 5, 30.0, 3600.0)
+
+# The response to each request, sent one after the other on one connection
+def exchange(gameServer, *requests):
+    writer = Writer()
+    async def run():
+        for request in requests:
+            line = request if isinstance(request, str) else json.dumps(request)
+            await asyncio.wait_for(gameServer.answer(line.encode(), writer), 5)
+    asyncio.run(run())
+    return writer.lines
+
+@pytest.mark.parametrize("request_", [
+    {"cmd": "go", "game": 1, "depth": "x"},
+    {"cmd": "go", "game": 1, "depth": 0},
+    {"cmd": "go", "game": 1, "deadline": "soon"},
+    {"cmd": "go", "game": 1, "movetime": [1]},
+    {"cmd": "go", "game": 1, "movetime": True},
+    {"cmd": "new", "fen": 5},
+    {"cmd": "new", "fen": "8/8/8/8/8/8/8/K6k w - e"},
+    {"cmd": "state", "game": [1]},
+    {"cmd": "state", "game": "1"},
+    {"cmd": "move", "game": 1, "move": 42},
+    {"cmd": "move", "game": 1},
+    "[1, 2]",
+    "not json",
+])
+def test_bad_requests_are_answered_with_an_error(request_):
+    gameServer = createServer()
+    lines = exchange(gameServer, {"cmd": "new"}, request_)
+    assert lines[0]["game"] == 1
+    assert "error" in lines[1]
+
+def test_null_fields_take_their_defaults():
+    gameServer = createServer()
+    lines = exchange(gameServer, {"cmd": "new", "fen": None}, {"cmd": "state", "game": 1, "depth": None})
+    assert lines[1]["moves"] == [] and lines[1]["status"] == "playing"
+
+def test_discarded_jobs_do_not_count_as_queued():
+    async def run():
+        queue = server.FairQueue()
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for i in range(3)]
+        for future in futures:
+            queue.put("client", (future, (), 0.0))
+        futures[0].cancel()
+        queue.discard(futures[0])
+        assert len(queue) == 2
+        job = await queue.get() # The discarded job is still handed out, the dispatcher skips it
+        assert job[0] is futures[0] and len(queue) == 2
+        await queue.get()
+        assert len(queue) == 1
+    asyncio.run(run())
+
+def test_request_field():
+    assert server.requestField({"depth": None}, "depth", int, 5) == 5
+    assert server.requestField({}, "deadline", (int, float), 2.5) == 2.5
+    assert server.requestField({"deadline": 3}, "deadline", (int, float)) == 3
+    with pytest.raises(server.RequestError):
+        server.requestField({"depth": 2.5}, "depth", int)
+
+def test_half_closed_connection_gets_its_answers(monkeypatch):
+    monkeypatch.setattr(server, "_board", None)
+    server._initWorker(None, None) # Searches run in this process through the loop's default executor
+    gameServer = createServer()
+    async def run():
+        dispatcher = asyncio.create_task(gameServer.dispatch())
+        listener = await asyncio.start_server(gameServer.handleConnection, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b'{"cmd": "new"}\n{"cmd": "go", "game": 1, "depth": 2}\n')
+        await writer.drain()
+        writer.write_eof()
+        lines = [json.loads(line) for line in (await asyncio.wait_for(reader.read(), 10)).splitlines()]
+        writer.close()
+        listener.close()
+        dispatcher.cancel()
+        return lines
+    lines = asyncio.run(run())
+    assert lines[0]["game"] == 1
+    assert "bestmove" in lines[1]
@@ -0,0 +1,31 @@
+import io
+import pytest
+import uci
+
+def createEngine():
+    output = io.StringIO()
+    return uci.UciEngine(output), output
+
+@pytest.mark.parametrize("line", [
+    "position fen 8/8/8",
+    "position fen 8/8/8/8/8/8/8/K6k w - e",
+    "go depth x",
+    "go wtime",
+])
+def test_bad_input_is_reported_and_the_position_kept(line):
+    engine, output = createEngine()
+    assert engine.handle("position startpos moves e2e4")
+    fen = engine.board.getFen()
+    assert engine.handle(line)
+    engine.stop()
+    assert "info string" in output.getvalue()
+    assert engine.board.getFen() == fen
+    assert engine.handle("isready")
+    assert output.getvalue().splitlines()[-1] == "readyok"
+
+def test_search_after_bad_input():
+    engine, output = createEngine()
+    engine.handle("go depth")
+    engine.handle("go depth 2")
+    engine.stop()
+    assert output.getvalue().splitlines()[-1].startswith("bestmove ")
@@ -0,0 +1,193 @@
+import sys
+import threading
+import ChessBoard
+from OpeningBook import OpeningBook
+from Tablebase import Tablebases
+from TimeManager import TimeManager
+
+# Universal Chess Interface front end, so the engine can be run by chess GUIs and tournament managers
+#    python uci.py
+# Supports uci, isready, setoption (BookFile, TablebaseFile), ucinewgame, position,
+# go (wtime btime winc binc movestogo movetime depth nodes infinite), stop and quit.
+# Every completed depth is reported with an info line.
+
+ENGINE_NAME = "ChessBoard"
+ENGINE_AUTHOR = "ChessBoard authors"
+MAX_SEARCH_DEPTH = ChessBoard.MAX_PLY - 1
+
+# UCI score of a search score, mates are given in moves
+def formatScore(score):
+    if score >= ChessBoard.MATE_BOUND:
+        return "mate " + str((ChessBoard.MATE_SCORE - score + 1) // 2)
+    if score <= -ChessBoard.MATE_BOUND:
+        return "mate " + str(-((ChessBoard.MATE_SCORE + score) // 2))
+    return "cp " + str(score)
+
+# The legal move of board written as notation (e.g. e2e4, e7e8q), None if there is not one
+def findMove(board, notation):
+    for move in board.getValidMoves():
+        if move.getChessNotation() == notation:
+            return move
+    return None
+
+# Parses the arguments of a go command into a TimeManager and the depth to search to
+def parseGo(tokens, whitesMove):
+    values = {}
+    i = 0
+    while i < len(tokens):
+        if tokens[i] in ("wtime", "btime", "winc", "binc", "movestogo", "movetime", "depth", "nodes"):
+            values[tokens[i]] = int(tokens[i + 1])
+            i += 2
+        else: # infinite, ponder and anything unsupported
+            i += 1
+    clock, increment = ("wtime", "winc") if whitesMove else ("btime", "binc")
+    timeManager = TimeManager(timeLeft = values[clock] / 1000 if clock in values else None,
+                              increment = values.get(increment, 0) / 1000,
+                              movesToGo = values.get("movestogo"),
+                              moveTime = values["movetime"] / 1000 if "movetime" in values else None,
+                              nodes = values.get("nodes"))
+    return timeManager, min(values.get("depth", MAX_SEARCH_DEPTH), MAX_SEARCH_DEPTH)
+
+class UciEngine():
+
+    def __init__(self, output = sys.stdout):
+        self.output = output
+        self.outputLock = threading.Lock() # info lines come from the search thread
+        self.board = ChessBoard.Board()
+        self.board.printProgress = False # stdout belongs to the protocol
+        self.board.INTIAL_DEPTH = 1
+        self.board.progressCallback = self.sendInfo
+        self.searchThread = None
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    # Handles one line from the GUI, returns False after quit
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command = tokens[0]
+        try: # Bad input is reported and ignored, the engine keeps its position and goes on
+            if command == "uci":
+                self.send("id name " + ENGINE_NAME)
+                self.send("id author " + ENGINE_AUTHOR)
+                self.send("option name BookFile type string default <empty>")
+                self.send("option name TablebaseFile type string default <empty>")
+                self.send("uciok")
+            elif command == "isready":
+                self.send("readyok")
+            elif command == "setoption":
+                self.stop()
+                self.setOption(tokens[1:])
+            elif command == "ucinewgame":
+                self.stop()
+                self.board.transpositionTable.clear()
+                self.board.loadFen(ChessBoard.START_FEN)
+            elif command == "position":
+                self.stop()
+                self.setPosition(tokens[1:])
+            elif command == "go":
+                self.stop()
+                self.go(tokens[1:])
+            elif command == "stop":
+                self.stop()
+            elif command == "quit":
+                self.stop()
+                return False
+        except (ValueError, IndexError) as error:
+            self.send("info string cannot handle " + line.strip() + ": " + str(error))
+        return True
+
+    # setoption name <name> value <value>
+    def setOption(self, tokens):
+        if "value" not in tokens:
+            return
+        name = " ".join(tokens[1:tokens.index("value")])
+        value = " ".join(tokens[tokens.index("value") + 1:])
+        if name.lower() == "bookfile":
+            if self.board.openingBook is not None:
+                self.board.openingBook.close()
+                self.board.openingBook = None
+            if value and value != "<empty>":
+                try:
+                    self.board.openingBook = OpeningBook(value)
+                except OSError as error:
+                    self.send("info string cannot open book " + str(error))
+        elif name.lower() == "tablebasefile":
+            if self.board.tablebases is not None:
+                self.board.tablebases.close()
+                self.board.tablebases = None
+            if value and value != "<empty>":
+                try:
+                    self.board.tablebases = Tablebases(value)
+                except (OSError, ValueError) as error:
+                    self.send("info string cannot open tablebases " + str(error))
+
+    # position startpos [moves ...] or position fen <fen> [moves ...]
+    def setPosition(self, tokens):
+        moves = tokens.index("moves") if "moves" in tokens else len(tokens)
+        if tokens and tokens[0] == "fen":
+            self.board.loadFen(" ".join(tokens[1:moves]))
+        else:
+            self.board.loadFen(ChessBoard.START_FEN)
+        for notation in tokens[moves + 1:]:
+            move = findMove(self.board, notation)
+            if move is None:
+                self.send("info string illegal move " + notation)
+                break
+            self.board.makeMove(move)
+
+    def go(self, tokens):
+        self.board.timeManager, self.board.MAX_DEPTH = parseGo(tokens, self.board.whitesMove)
+        self.board.INTIAL_DEPTH = min(self.board.INTIAL_DEPTH, self.board.MAX_DEPTH)
+        self.board.stopRequested = False # A stop that came after the last search finished
+        self.searchThread = threading.Thread(target = self.search, daemon = True)
+        self.searchThread.start()
+
+    def search(self):
+        move = self.board.findBestMove()
+        if move is None: # Checkmate or stalemate, or not even the first depth finished
+            legalMoves = self.board.getValidMoves()
+            move = legalMoves[0] if legalMoves else None
+        self.send("bestmove " + (move.getChessNotation() if move is not None else "0000"))
+
+    # Ends the running search, which then sends its bestmove
+    def stop(self):
+        if self.searchThread is not None:
+            self.board.requestStop()
+            self.searchThread.join()
+            self.searchThread = None
+
+    def sendInfo(self, depth, bestMove):
+        board = self.board
+        milliseconds = int(sum(iteration.elapsed for iteration in board.searchStatistics) * 1000)
+        nodes = board.nodesSearched
+        self.send("info depth %d score %s nodes %d nps %d time %d pv %s" %
+                  (depth, formatScore(board.globalBestScore), nodes, nodes * 1000 // max(milliseconds, 1),
+                   milliseconds, " ".join(self.principalVariation())))
+
+    # Notation of each move of the principal variation
+    def principalVariation(self):
+        board = self.board
+        line = board.getPrincipalVariation()
+        notations = []
+        for move in line:
+            notations.append(ChessBoard.Move.fromPacked(move, board.squares).getChessNotation())
+            board.pushMove(move)
+        for move in line:
+            board.popMove()
+        return notations
+
+def main():
+    engine = UciEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    engine.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())